@@ -0,0 +1,474 @@
+"""
+End-to-end load test of the bot against a local fake Bot API server.
+
+Starts a stand-in for the Telegram Bot API, runs the real `main.py` against
+it, and lands a burst of synthetic updates in a quads minute: plain
+messages, forwarded messages and live locations from many users in a few
+chats. Then measures:
+- Latency from an update being available to its reply/delete being made
+- Throughput of updates fetched and of replies/deletes made
+- Backlog depth, both waiting to be fetched and fetched but not answered
+
+The fake API can also answer with 429 (RetryAfter), like Telegram does when
+the flood limits are hit. If it fails to handle a call (a 500, or a dropped
+connection) the run stops there and counts as failed, rather than waiting
+out the timeout for answers that will never come.
+
+```bash
+$ poetry run python -m benchmarks.load --messages 5000 --users 200 --output load.json
+```
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import pytz
+
+from quadsbot.handlers.message import State, calculate_forwarded_state, check
+
+token = "123456:load-test"
+tz = "Europe/London"
+# Somewhere in `tz`, for the live locations
+location = {"latitude": 51.5072, "longitude": -0.1276}
+
+texts = ["quads", "QUADS", "checked", "lol", "nice", "is it quads yet"]
+
+
+# >> Fake Bot API
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    """
+    Just enough of the Bot API for the bot to run: getUpdates (long polling)
+    over the updates we give it, and recording every sendMessage and
+    deleteMessage(s). Anything else succeeds without doing anything.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, flood_chance: float, retry_after: int):
+        super().__init__(address, FakeBotApiHandler)
+        self.flood_chance = flood_chance
+        self.retry_after = retry_after
+        self.random = random.Random(0)
+
+        self.condition = threading.Condition()
+        self.updates = []
+        # Everything before this index has been fetched by the bot
+        self.fetched = 0
+        # update index -> when it was made available
+        self.available_at = {}
+        # (chat_id, message_id) -> when it was first replied to or deleted
+        self.answered_at = {}
+        self.flood_errors = 0
+        # Calls we failed to handle, as "method: error"
+        self.errors = []
+        self.calls = {}
+        self.next_message_id = 10_000_000
+
+    def add_updates(self, updates: list[dict]) -> None:
+        with self.condition:
+            now = time.monotonic()
+            for update in updates:
+                self.available_at[len(self.updates)] = now
+                self.updates.append(update)
+            self.condition.notify_all()
+
+    def call(self, method: str, params: dict):
+        """
+        Returns (result, retry_after)
+        """
+        with self.condition:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method in ("sendMessage", "deleteMessage", "deleteMessages"):
+            if self.random.random() < self.flood_chance:
+                with self.condition:
+                    self.flood_errors += 1
+                return None, self.retry_after
+
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "Quads", "username": "quadsbot"}, 0
+        if method == "getUpdates":
+            return self.get_updates(params), 0
+        if method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            self.answer(chat_id, params.get("reply_to_message_id"))
+            with self.condition:
+                self.next_message_id += 1
+                message_id = self.next_message_id
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup"},
+                "text": params.get("text"),
+            }, 0
+        if method == "deleteMessage":
+            self.answer(int(params["chat_id"]), params["message_id"])
+        if method == "deleteMessages":
+            message_ids = params["message_ids"]
+            # python-telegram-bot sends lists as JSON strings
+            if isinstance(message_ids, str):
+                message_ids = json.loads(message_ids)
+            for message_id in message_ids:
+                self.answer(int(params["chat_id"]), message_id)
+        return True, 0
+
+    def failed(self, error: str) -> None:
+        with self.condition:
+            self.errors.append(error)
+
+    def handle_error(self, request, client_address) -> None:
+        # e.g. the connection was dropped halfway through a call
+        self.failed(repr(sys.exc_info()[1]))
+
+    def get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self.condition:
+            # Update ids are their index in self.updates
+            self.fetched = max(self.fetched, min(offset, len(self.updates)))
+            while len(self.updates) <= offset:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self.condition.wait(remaining)
+            batch = self.updates[offset : offset + limit]
+            self.fetched = max(self.fetched, offset + len(batch))
+            return batch
+
+    def answer(self, chat_id: int, message_id: Optional[int]) -> None:
+        if message_id is None:
+            return
+        with self.condition:
+            self.answered_at.setdefault((chat_id, int(message_id)), time.monotonic())
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    server: FakeBotApi
+
+    def do_POST(self) -> None:
+        # /bot<token>/<method>
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        params = json.loads(body) if body else {}
+
+        try:
+            result, retry_after = self.server.call(method, params)
+        except Exception as e:
+            self.server.failed(f"{method}: {e!r}")
+            self.respond(500, {"ok": False, "error_code": 500, "description": repr(e)})
+            return
+
+        if retry_after:
+            response = {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }
+            self.respond(429, response)
+        else:
+            self.respond(200, {"ok": True, "result": result})
+
+    def respond(self, status: int, response: dict) -> None:
+        data = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+# >> Workload
+
+
+def quads_minute() -> datetime:
+    """
+    The most recent 00:00, 11:11 or 22:22 in `tz`, so it's close enough to
+    now to use the bot's cached path
+    """
+    tzinfo = pytz.timezone(tz)
+    now = datetime.now(tzinfo).replace(tzinfo=None)
+    candidates = [
+        (now.replace(hour=hour, minute=hour, second=0, microsecond=0) - timedelta(days=days))
+        for days in (0, 1)
+        for hour in (0, 11, 22)
+    ]
+    wall = max(candidate for candidate in candidates if candidate <= now)
+    return tzinfo.localize(wall).astimezone(timezone.utc)
+
+
+def make_workload(args: argparse.Namespace) -> tuple[list[dict], dict]:
+    """
+    Returns the updates, and which (chat_id, message_id) the bot should
+    answer, with how ("reply" or "delete")
+    """
+    rng = random.Random(args.seed)
+    minute = quads_minute()
+    chats = [-1000 - chat for chat in range(args.chats)]
+
+    updates = []
+    expected = {}
+    for update_id in range(args.messages):
+        user_id = rng.randrange(args.users)
+        chat_id = chats[user_id % len(chats)]
+        message_id = update_id + 1
+        date = minute + timedelta(seconds=rng.randrange(60))
+        message = {
+            "message_id": message_id,
+            "date": int(date.timestamp()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Load test"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+        }
+
+        kind = rng.random()
+        if kind < args.locations:
+            message["location"] = {**location, "live_period": 60}
+            expected[(chat_id, message_id)] = "delete"
+        else:
+            text = rng.choice(texts)
+            message["text"] = text
+            state, _ = check(date, tz, text)
+            if kind < args.locations + args.forwarded:
+                forward_from = rng.randrange(args.users)
+                forward_date = date - timedelta(seconds=rng.randrange(7 * 24 * 60 * 60))
+                message["forward_from"] = {
+                    "id": forward_from,
+                    "is_bot": False,
+                    "first_name": f"User {forward_from}",
+                }
+                message["forward_date"] = int(forward_date.timestamp())
+                forward_state, _ = check(forward_date, tz, text)
+                state = calculate_forwarded_state(state, forward_state)
+            if state == State.CHECKED:
+                expected[(chat_id, message_id)] = "reply"
+            elif state in (State.DELETE, State.CHECK_THEN_DELETE):
+                expected[(chat_id, message_id)] = "delete"
+
+        updates.append({"update_id": update_id, "message": message})
+
+    return updates, expected
+
+
+# >> Reporting
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": values[len(values) // 2] * 1000,
+        "p90_ms": values[len(values) * 9 // 10] * 1000,
+        "p99_ms": values[min(len(values) - 1, len(values) * 99 // 100)] * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def update_index(updates: list[dict]) -> dict:
+    return {
+        (update["message"]["chat"]["id"], update["message"]["message_id"]): index
+        for index, update in enumerate(updates)
+    }
+
+
+def report(api: FakeBotApi, updates: list[dict], expected: dict, started: float) -> dict:
+    index = update_index(updates)
+    latencies = {"reply": [], "delete": []}
+    for key, how in expected.items():
+        answered = api.answered_at.get(key)
+        if answered is not None:
+            latencies[how].append(answered - api.available_at[index[key]])
+
+    answered = [api.answered_at[key] for key in expected if key in api.answered_at]
+    elapsed = (max(answered) if answered else time.monotonic()) - started
+    return {
+        "updates": len(updates),
+        "expected_answers": len(expected),
+        "answered": len(answered),
+        "elapsed_s": elapsed,
+        "answers_per_sec": len(answered) / elapsed if elapsed else 0,
+        "reply_latency": percentiles(latencies["reply"]),
+        # NOTE: Includes the 2 second delay the bot waits before deleting
+        "delete_latency": percentiles(latencies["delete"]),
+        "flood_errors": api.flood_errors,
+        "api_calls": api.calls,
+    }
+
+
+def print_report(result: dict) -> None:
+    print(
+        f"\n{result['answered']}/{result['expected_answers']} answered"
+        f" (of {result['updates']} updates) in {result['elapsed_s']:.1f}s,"
+        f" {result['answers_per_sec']:.1f} answers/s"
+    )
+    for name in ("reply_latency", "delete_latency"):
+        latency = result[name]
+        if latency["count"]:
+            print(
+                f"{name:<15} n={latency['count']:<6} p50 {latency['p50_ms']:>8.0f}ms"
+                f"  p90 {latency['p90_ms']:>8.0f}ms  p99 {latency['p99_ms']:>8.0f}ms"
+                f"  max {latency['max_ms']:>8.0f}ms"
+            )
+    print(
+        f"Max backlog: {result['max_unfetched']} unfetched,"
+        f" {result['max_unanswered']} fetched but unanswered"
+    )
+    print(f"429s sent: {result['flood_errors']}, API calls: {result['api_calls']}")
+    if result["errors"]:
+        print(f"Failed calls: {len(result['errors'])}, e.g. {result['errors'][0]}")
+
+
+# >> Running
+
+
+def start_bot(api_port: int, directory: str, args: argparse.Namespace) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "TELEGRAM_BOT_TOKEN": token,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}/bot",
+        "PERSISTENCE_FILE": f"{directory}/stats",
+        "TZ": tz,
+        "WORKERS": str(args.workers),
+        # The messages are from the last quads minute, which can be hours ago,
+        # so they'd all be caught up on rather than replied to
+        "CATCH_UP_AGE": os.environ.get("CATCH_UP_AGE", "inf"),
+    }
+    main = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+    log = open(args.bot_log or os.devnull, "w")
+    return subprocess.Popen([sys.executable, main], env=env, stdout=log, stderr=log)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument(
+        "--forwarded", type=float, default=0.1, help="Fraction of forwarded messages"
+    )
+    parser.add_argument(
+        "--locations", type=float, default=0.05, help="Fraction of live locations"
+    )
+    parser.add_argument(
+        "--spread", type=float, default=10, help="Seconds to spread the burst over"
+    )
+    parser.add_argument(
+        "--flood-chance", type=float, default=0.01, help="Chance of a 429 for each send/delete"
+    )
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=8, help="WORKERS for the bot")
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="Give up waiting for answers after this"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bot-log", help="Write the bot's log here")
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    args = parser.parse_args()
+
+    # The checks used to work out the expected answers log every message
+    logging.disable(logging.CRITICAL)
+
+    updates, expected = make_workload(args)
+    print(f"{len(updates)} updates, expecting {len(expected)} replies/deletes")
+
+    api = FakeBotApi(("127.0.0.1", 0), args.flood_chance, args.retry_after)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot = start_bot(api.server_address[1], directory, args)
+        try:
+            # Wait for the bot to start polling
+            while not api.calls.get("getUpdates"):
+                if bot.poll() is not None:
+                    raise SystemExit("The bot exited before it started polling")
+                time.sleep(0.1)
+
+            started = time.monotonic()
+            timeline = []
+            max_unfetched = max_unanswered = 0
+            step = max(1, len(updates) // max(1, int(args.spread * 10)))
+            added = 0
+            while True:
+                now = time.monotonic()
+                if added < len(updates):
+                    # Add the burst in steps, every 0.1s
+                    api.add_updates(updates[added : added + step])
+                    added += step
+
+                with api.condition:
+                    fetched = api.fetched
+                    answered = sum(key in api.answered_at for key in expected)
+                unfetched = min(added, len(updates)) - fetched
+                index = update_index(updates[:fetched])
+                unanswered = sum(key in index for key in expected) - answered
+                max_unfetched = max(max_unfetched, unfetched)
+                max_unanswered = max(max_unanswered, unanswered)
+                timeline.append(
+                    {"t": now - started, "unfetched": unfetched, "unanswered": unanswered}
+                )
+                print(
+                    f"\r{now - started:6.1f}s  fetched {fetched}/{len(updates)}"
+                    f"  answered {answered}/{len(expected)}",
+                    end="",
+                    flush=True,
+                )
+
+                if answered == len(expected) and added >= len(updates):
+                    break
+                if api.errors:
+                    print(f"\nFailed: {api.errors[0]}")
+                    break
+                if now - started > args.timeout:
+                    print("\nTimed out")
+                    break
+                time.sleep(0.1)
+        finally:
+            # Anything after this is the bot shutting down
+            with api.condition:
+                errors = list(api.errors)
+            bot.send_signal(signal.SIGINT)
+            try:
+                bot.wait(30)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+            api.shutdown()
+
+    result = report(api, updates, expected, started)
+    result["errors"] = errors
+    result["max_unfetched"] = max_unfetched
+    result["max_unanswered"] = max_unanswered
+    print_report(result)
+
+    if args.output:
+        result["args"] = vars(args)
+        result["timeline"] = timeline
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=4)
+
+    if errors:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+Micro-benchmarks for the hot paths of the bot.
+
+Each benchmark calls a function over a synthetic dataset until `--min-time`
+has passed, timing every call. Prints ops/sec, p50 and p99, and saves them
+as JSON so runs from before and after a change can be compared:
+
+```bash
+$ poetry run python -m benchmarks.micro --output before.json
+$ # ... make a change ...
+$ poetry run python -m benchmarks.micro --output after.json --compare before.json
+```
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Callable, Iterable, Optional
+
+import pytz
+
+from quadsbot.check_ids import oldest_day, pack_check_id
+from quadsbot.date_utils import get_date_strings
+from quadsbot.handlers.leaderboard import leaderboard
+from quadsbot.handlers.message import calculate_forwarded_state, check
+from quadsbot.persistence import ChatStats, SQLitePersistence
+from quadsbot.user import User, UserRecord
+
+tz = "Europe/London"
+chat_id = -1001
+
+# Mostly chatter, with the occasional attempt at a check
+texts = [
+    "lol",
+    "what time is it",
+    "anyone up?",
+    "quads",
+    "QUADS!!",
+    "checked",
+    "sexts",
+    "nice",
+    None,  # e.g. a sticker
+]
+
+quads_minutes = [(0, 0), (11, 11), (22, 22), (23, 11)]
+
+
+# >> Timing
+
+
+def bench(name: str, fn: Callable, inputs: Iterable, min_time: float) -> dict:
+    """
+    Call `fn(input)` over the inputs (cycling if needed) for at least
+    `min_time` seconds, and summarise the time taken by each call.
+    The first 1000 inputs are run once beforehand, untimed.
+    """
+    # Warm up any caches first, e.g. the day tables
+    inputs = list(inputs)
+    for value in inputs[:1000]:
+        fn(value)
+
+    timings = []
+    deadline = time.perf_counter() + min_time
+    for value in itertools.cycle(inputs):
+        start = time.perf_counter_ns()
+        fn(value)
+        timings.append(time.perf_counter_ns() - start)
+        if len(timings) % 100 == 0 and time.perf_counter() > deadline:
+            break
+
+    timings.sort()
+    result = {
+        "calls": len(timings),
+        "ops_per_sec": len(timings) / (sum(timings) / 1e9),
+        "p50_us": timings[len(timings) // 2] / 1e3,
+        "p99_us": timings[min(len(timings) - 1, len(timings) * 99 // 100)] / 1e3,
+    }
+    print(
+        f"{name:<34} {result['ops_per_sec']:>12,.0f} ops/s"
+        f"   p50 {result['p50_us']:>9.1f}us   p99 {result['p99_us']:>9.1f}us"
+    )
+    return result
+
+
+# >> Datasets
+
+
+def message_times(rng: random.Random, count: int, around: datetime) -> list[datetime]:
+    """
+    Times within a day of `around`, about half of them in a quads minute
+    (when a chat is actually busy)
+    """
+    tzinfo = pytz.timezone(tz)
+    local = around.astimezone(tzinfo).replace(tzinfo=None)
+    times = []
+    for _ in range(count):
+        day = local + timedelta(days=rng.choice([-1, 0, 0]))
+        if rng.random() < 0.5:
+            # 00:00, 11:11, 22:22 and 11:11pm
+            hour, minute = rng.choice(quads_minutes)
+        else:
+            hour, minute = rng.randrange(24), rng.randrange(60)
+        wall = day.replace(hour=hour, minute=minute, second=rng.randrange(60))
+        times.append(tzinfo.localize(wall).astimezone(timezone.utc))
+    return times
+
+
+def make_update(user_id: int, forward_from: Optional[int] = None) -> SimpleNamespace:
+    user = SimpleNamespace(
+        id=user_id, username=f"user{user_id}", first_name="User", last_name=None
+    )
+    forwarded = None
+    if forward_from is not None:
+        forwarded = SimpleNamespace(
+            id=forward_from, username=f"user{forward_from}", first_name="User", last_name=None
+        )
+    message = SimpleNamespace(forward_from=forwarded, from_user=user)
+    chat = SimpleNamespace(id=chat_id, type="supergroup")
+    return SimpleNamespace(effective_message=message, effective_chat=chat)
+
+
+def make_user_info(rng: random.Random, user_id: int) -> UserRecord:
+    checked = rng.randrange(200)
+    user_info = UserRecord(
+        username=f"user{user_id}",
+        checked_total=checked + rng.randrange(20),
+        checked_unique=checked,
+        deleted=rng.randrange(1000),
+        passed=rng.randrange(100),
+        messages_total=rng.randrange(5000),
+    )
+    # A few recent checks
+    today = datetime.now(timezone.utc)
+    for days in range(rng.randrange(10)):
+        check_id = (today - timedelta(days=days)).strftime("%Y%m%d") + "22220"
+        user_info.add_check(pack_check_id(check_id), oldest_day(today, tz))
+    return user_info
+
+
+def make_bot_data(rng: random.Random, users: int, load=None) -> dict:
+    chat_stats = ChatStats(load)
+    chat_stats[chat_id].update(
+        (user_id, make_user_info(rng, user_id)) for user_id in range(users)
+    )
+    return {"user_stats": {}, "chat_stats": chat_stats, "admin_id": None}
+
+
+# >> Benchmarks
+
+
+def bench_check(rng: random.Random, min_time: float) -> dict:
+    now = datetime.now(timezone.utc)
+    inputs = list(zip(message_times(rng, 10_000, now), rng.choices(texts, k=10_000)))
+    return bench("check", lambda value: check(value[0], tz, value[1]), inputs, min_time)
+
+
+def bench_check_forwarded(rng: random.Random, min_time: float) -> dict:
+    now = datetime.now(timezone.utc)
+    received = message_times(rng, 10_000, now)
+    # Forwarded from any time in the last year
+    sent = [date - timedelta(seconds=rng.randrange(365 * 24 * 60 * 60)) for date in received]
+    inputs = list(zip(received, sent, rng.choices(texts, k=10_000)))
+
+    def forwarded(value):
+        received, sent, text = value
+        message_state, _ = check(received, tz, text)
+        forward_state, _ = check(sent, tz, text)
+        calculate_forwarded_state(message_state, forward_state)
+
+    return bench("check (forwarded)", forwarded, inputs, min_time)
+
+
+def bench_check_april_fools(rng: random.Random, min_time: float) -> dict:
+    # NOTE: Unless it's actually april fools day these aren't close enough
+    # to now to be cached, so this measures the uncached path
+    april_fools = datetime(datetime.now().year, 4, 1, 12, tzinfo=timezone.utc)
+    inputs = list(zip(message_times(rng, 10_000, april_fools), rng.choices(texts, k=10_000)))
+    return bench(
+        "check (april fools)", lambda value: check(value[0], tz, value[1]), inputs, min_time
+    )
+
+
+def bench_get_date_strings(rng: random.Random, min_time: float) -> dict:
+    inputs = message_times(rng, 10_000, datetime.now(timezone.utc))
+    return bench("get_date_strings", lambda date: get_date_strings(date, tz), inputs, min_time)
+
+
+def bench_user(rng: random.Random, min_time: float, users: int) -> dict:
+    context = SimpleNamespace(bot_data=make_bot_data(rng, users))
+    # Mostly regulars, plus some new users
+    inputs = [make_update(rng.randrange(int(users * 1.1))) for _ in range(10_000)]
+
+    def user(update):
+        with User(update, context) as user_info:
+            user_info["messages_total"] += 1
+
+    return bench(f"User ({users} users)", user, inputs, min_time)
+
+
+def bench_leaderboard(rng: random.Random, min_time: float, users: int) -> dict:
+    user_stats = make_bot_data(rng, users)["chat_stats"][chat_id]
+    inputs = [rng.randrange(users) for _ in range(10_000)]
+    return bench(
+        f"leaderboard ({users} users)",
+        lambda user_id: leaderboard(user_stats, user_id, chat_id),
+        inputs,
+        min_time,
+    )
+
+
+def bench_leaderboard_after_check(rng: random.Random, min_time: float, users: int) -> dict:
+    context = SimpleNamespace(bot_data=make_bot_data(rng, users))
+    user_stats = context.bot_data["chat_stats"][chat_id]
+    inputs = [make_update(rng.randrange(users)) for _ in range(10_000)]
+
+    def check_then_leaderboard(update):
+        with User(update, context) as user_info:
+            user_info["checked_unique"] += 1
+        leaderboard(user_stats, update.effective_message.from_user.id, chat_id)
+
+    return bench("leaderboard after a check", check_then_leaderboard, inputs, min_time)
+
+
+def bench_persistence(rng: random.Random, min_time: float, users: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        persistence = SQLitePersistence(f"{directory}/stats.sqlite3")
+        bot_data = persistence.get_bot_data()
+        bot_data.update(make_bot_data(rng, users, persistence.load_chat))
+        persistence.update_bot_data(bot_data)
+        user_stats = bot_data["chat_stats"][chat_id]
+
+        # About what changes between updates when the chat is busy
+        inputs = [rng.sample(range(users), 20) for _ in range(1000)]
+
+        def update_bot_data(user_ids):
+            for user_id in user_ids:
+                user_info = user_stats[user_id]
+                user_info["messages_total"] += 1
+                user_stats[user_id] = user_info
+            persistence.update_bot_data(bot_data)
+
+        return bench(
+            f"persistence (20 of {users} changed)", update_bot_data, inputs, min_time
+        )
+
+
+benchmarks = {
+    "check": bench_check,
+    "check_forwarded": bench_check_forwarded,
+    "check_april_fools": bench_check_april_fools,
+    "get_date_strings": bench_get_date_strings,
+    "user": bench_user,
+    "leaderboard": bench_leaderboard,
+    "leaderboard_after_check": bench_leaderboard_after_check,
+    "persistence": bench_persistence,
+}
+# Benchmarks that take the number of users
+sized = {"user", "leaderboard", "leaderboard_after_check", "persistence"}
+
+
+# >> Running
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline_file: str) -> None:
+    with open(baseline_file) as f:
+        baseline = json.load(f)["results"]
+
+    print(f"\nCompared to {baseline_file}:")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        speedup = result["ops_per_sec"] / baseline[name]["ops_per_sec"]
+        print(f"{name:<34} {speedup:>6.2f}x ops/s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="Save the results to this JSON file")
+    parser.add_argument("--compare", help="Compare against the results in this JSON file")
+    parser.add_argument(
+        "--min-time", type=float, default=2.0, help="Seconds to run each benchmark for"
+    )
+    parser.add_argument("--users", type=int, default=10_000, help="Users in the chat")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "only", nargs="*", help=f"Only run these benchmarks, from: {', '.join(benchmarks)}"
+    )
+    args = parser.parse_args()
+    for name in args.only:
+        if name not in benchmarks:
+            parser.error(f"Unknown benchmark `{name}`")
+
+    # The handlers log every message, which would be most of what we measure
+    logging.disable(logging.CRITICAL)
+
+    results = {}
+    for name, benchmark in benchmarks.items():
+        if args.only and name not in args.only:
+            continue
+        rng = random.Random(args.seed)
+        if name in sized:
+            results[name] = benchmark(rng, args.min_time, args.users)
+        else:
+            results[name] = benchmark(rng, args.min_time)
+
+    if args.compare:
+        compare(results, args.compare)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "time": datetime.now(timezone.utc).isoformat(),
+                    "users": args.users,
+                    "results": results,
+                },
+                f,
+                indent=4,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,127 @@
+# Imported first so the startup profile includes the other imports
+from quadsbot.startup import lazy_callback, profile, trace_persistence, warm_up
+
+import argparse
 import logging
 import os
+import secrets
 
-from quadsbot.handlers.leaderboard import leaderboard_handler
+from quadsbot.catch_up import CatchUpHandler
+from quadsbot.event_log import events
 from quadsbot.handlers.setadmin import make_setadmin_handler
-from quadsbot.handlers.stats import stats_handler
-from quadsbot.handlers.clear import clear_handler
-from quadsbot.handlers.check import check_handler
-from quadsbot.handlers.location import location_handler
-from quadsbot.handlers.message import message_handler
+from quadsbot.history import history
+from quadsbot.logs import setup_logging
+from quadsbot.migrations import migrate
+from quadsbot.outbound import outbound
+from quadsbot.persistence import ChatStats, SQLitePersistence, Timezones
+from quadsbot.shadow import shadow
+from quadsbot.tracing import tracer
 
 from telegram.ext import (
     Updater,
     MessageHandler,
     CommandHandler,
     Filters,
-    PicklePersistence,
 )
 
-# Enable logging
-logging.basicConfig(
-    format="%(levelname)-7s %(asctime)s %(name)s %(message)s", level=logging.INFO
+# The handlers are only imported when they're first used, see lazy_callback
+leaderboard_handler = lazy_callback("quadsbot.handlers.leaderboard", "leaderboard_handler")
+next_handler = lazy_callback("quadsbot.handlers.next", "next_handler")
+stats_handler = lazy_callback("quadsbot.handlers.stats", "stats_handler")
+clear_handler = lazy_callback("quadsbot.handlers.clear", "clear_handler")
+export_handler = lazy_callback("quadsbot.handlers.export", "export_handler")
+profile_handler = lazy_callback("quadsbot.handlers.profile", "profile_handler")
+check_handler = lazy_callback("quadsbot.handlers.check", "check_handler")
+location_handler = lazy_callback("quadsbot.handlers.location", "location_handler")
+message_handler = lazy_callback("quadsbot.handlers.message", "message_handler")
+
+# Enable logging, written from a background thread
+setup_logging(
+    logging.INFO,
+    # The fraction of the per-message lines to log, and the most a second
+    sample=float(os.environ.get("LOG_SAMPLE", 1)),
+    rate=float(os.environ["LOG_RATE"]) if os.environ.get("LOG_RATE") else None,
 )
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="Log how long each step of starting up took, once the first update is handled",
+    )
+    args = parser.parse_args()
+    if (
+        os.environ.get("UPDATE_MODE") == "webhook"
+        and not os.environ.get("WEBHOOK_URL")
+        and not os.environ.get("WEBHOOK_SECRET")
+    ):
+        # Otherwise whatever sends the updates can't know the generated one
+        parser.error("WEBHOOK_SECRET must be set when WEBHOOK_URL isn't")
+    profile.enabled = args.startup_profile
+    profile.mark("Imports")
+
     # >> Setup persistance
 
+    # PERSISTENCE_FILE is the old PicklePersistence file, which is imported
+    # into the database the first time it's created
     persistence_location = os.environ.get("PERSISTENCE_FILE", "/data/stats")
-    persistence = PicklePersistence(filename=persistence_location)
+    database_location = os.environ.get("PERSISTENCE_DB", f"{persistence_location}.sqlite3")
+    persistence = SQLitePersistence(
+        database_location,
+        import_from=persistence_location,
+        hot_users=int(os.environ.get("HOT_USERS", 10_000)),
+    )
+    profile.mark("Open the database")
+
+    # How long each step of handling every update takes, for later analysis
+    if os.environ.get("TRACE_FILE"):
+        tracer.open(os.environ["TRACE_FILE"])
+
+    # Every message's text, so the stats can be rebuilt (see quadsbot.rebuild)
+    if os.environ.get("HISTORY_LOG"):
+        history.open(os.environ["HISTORY_LOG"])
+
+    # Check every message with candidate matchers too, to see how they'd do
+    # before replacing the live ones (see quadsbot.shadow)
+    if os.environ.get("SHADOW_MATCHERS"):
+        shadow.start(
+            os.environ["SHADOW_MATCHERS"],
+            os.environ.get("SHADOW_LOG", f"{persistence_location}.shadow.jsonl"),
+            workers=int(os.environ.get("SHADOW_WORKERS", 1)),
+            max_queued=int(os.environ.get("SHADOW_QUEUE", 1000)),
+        )
 
     # >> Setup the Bot
 
-    updater = Updater(token=os.environ["TELEGRAM_BOT_TOKEN"], persistence=persistence)
+    # Updates from different users are handled at the same time on this many
+    # threads, see quadsbot.user.User for how they're kept apart
+    workers = int(os.environ.get("WORKERS", 8))
+    updater = Updater(
+        token=os.environ["TELEGRAM_BOT_TOKEN"],
+        persistence=persistence,
+        workers=workers,
+        # Only set to use a different Bot API server, e.g. benchmarks/load.py
+        base_url=os.environ.get("TELEGRAM_API_URL"),
+    )
     dispatcher = updater.dispatcher
+    trace_persistence(dispatcher)
+    profile.mark("Create the updater (and load bot_data)")
 
-    # >> Handle bot_data migration
-    # TODO: Remove
-    # The previous version used the entire bot_data dict to store the user
-    # stats. We want this to be under a sub_key so we can store other things
-    # too.
-
-    if "user_stats" not in dispatcher.bot_data:
-        print("Running migration")
-
-        import copy
+    # >> Handle bot_data migrations
 
-        stats = copy.deepcopy(dispatcher.bot_data)
-        dispatcher.bot_data.clear()
-        dispatcher.bot_data["user_stats"] = stats
+    if migrate(dispatcher.bot_data, persistence):
         dispatcher.update_persistence()
+    profile.mark("Migrate bot_data")
 
     # >> Setup bot_data
 
     bot_data_defaults = {
+        # Stats from before they were per chat, see quadsbot.user.User
         "user_stats": {},
+        "chat_stats": ChatStats(),
+        "timezones": Timezones(),
         "admin_id": None,
     }
 
@@ -66,6 +134,14 @@ def main() -> None:
     if should_update_persistence:
         dispatcher.update_persistence()
 
+    # Every message's outcome, for /leaderboard week|month. Read after
+    # bot_data, so each user's checks are counted in their own timezone.
+    events.open(
+        os.environ.get("EVENT_LOG", f"{persistence_location}.events"),
+        dispatcher.bot_data["timezones"],
+    )
+    profile.mark("Open the event log")
+
     # >> Create the list of admin users
 
     admin_filter = Filters.user(
@@ -86,7 +162,21 @@ def main() -> None:
     )
 
     dispatcher.add_handler(
-        CommandHandler("stats", stats_handler, Filters.chat_type.private & admin_filter)
+        CommandHandler(
+            "stats", stats_handler, Filters.chat_type.private & admin_filter, run_async=True
+        )
+    )
+
+    dispatcher.add_handler(
+        CommandHandler(
+            "export", export_handler, Filters.chat_type.private & admin_filter, run_async=True
+        )
+    )
+
+    dispatcher.add_handler(
+        CommandHandler(
+            "profile", profile_handler, Filters.chat_type.private & admin_filter, run_async=True
+        )
     )
 
     dispatcher.add_handler(
@@ -99,11 +189,12 @@ def main() -> None:
 
     # >> User Command Handlers
 
-    dispatcher.add_handler(CommandHandler("leaderboard", leaderboard_handler))
+    dispatcher.add_handler(CommandHandler("leaderboard", leaderboard_handler, run_async=True))
+    dispatcher.add_handler(CommandHandler("next", next_handler, run_async=True))
 
     # >> Location Handler
 
-    dispatcher.add_handler(MessageHandler(Filters.location, location_handler))
+    dispatcher.add_handler(MessageHandler(Filters.location, location_handler, run_async=True))
 
     # >> Default Message Handler
 
@@ -111,14 +202,104 @@ def main() -> None:
         MessageHandler(
             ~Filters.update.edited_message & ~Filters.chat_type.private,
             message_handler,
+            run_async=True,
         )
     )
 
+    # >> Catching up after downtime
+
+    # Sees messages before the other handlers, and handles any that are older
+    # than CATCH_UP_AGE seconds, or that arrive while there's a backlog. They're
+    # handled on the dispatcher's thread, so updates behind them wait
+    dispatcher.add_handler(
+        CatchUpHandler(
+            persistence,
+            dispatcher.update_queue,
+            max_age=float(os.environ.get("CATCH_UP_AGE", 60)),
+            max_backlog=int(os.environ.get("CATCH_UP_BACKLOG", 200)),
+        ),
+        group=-1,
+    )
+
+    profile.mark("Register the handlers")
+
+    warm_up()
+
+    # >> Metrics
+
+    # Only recorded when METRICS_PORT is set
+    metrics_server = None
+    if os.environ.get("METRICS_PORT"):
+        from quadsbot.metrics import start_metrics
+
+        metrics_server = start_metrics(
+            dispatcher,
+            persistence,
+            listen=os.environ.get("METRICS_LISTEN", "127.0.0.1"),
+            port=int(os.environ["METRICS_PORT"]),
+        )
+
+    # >> Leaderboard snapshot
+
+    # Every chat's leaderboard, published for quadsbot.dashboard to read
+    # without asking the bot, when SNAPSHOT_FILE is set
+    snapshot_writer = None
+    if os.environ.get("SNAPSHOT_FILE"):
+        from quadsbot.snapshot import RankingPublisher, SnapshotWriter
+
+        snapshot_writer = SnapshotWriter(
+            os.environ["SNAPSHOT_FILE"], int(os.environ.get("SNAPSHOT_SIZE", 4 * 1024 * 1024))
+        )
+        publisher = RankingPublisher(
+            snapshot_writer, persistence, top_n=int(os.environ.get("SNAPSHOT_TOP", 50))
+        )
+        dispatcher.job_queue.run_repeating(
+            publisher.publish,
+            interval=float(os.environ.get("SNAPSHOT_INTERVAL", 10)),
+            first=0,
+        )
+
     # >> Start the Bot
 
-    updater.start_polling()
+    # UPDATE_MODE=webhook has Telegram send us updates rather than polling
+    webhook = None
+    if os.environ.get("UPDATE_MODE", "polling") == "webhook":
+        from quadsbot.webhook import start_webhook
+
+        secret_token = os.environ.get("WEBHOOK_SECRET")
+        if not secret_token:
+            logging.info("No WEBHOOK_SECRET set, generating one")
+            secret_token = secrets.token_urlsafe(32)
+
+        webhook = start_webhook(
+            updater,
+            listen=os.environ.get("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.environ.get("WEBHOOK_PORT", 8080)),
+            secret_token=secret_token,
+            path=os.environ.get("WEBHOOK_PATH", "/telegram"),
+            max_pending=int(os.environ.get("WEBHOOK_MAX_PENDING", 1000)),
+            # The public URL that reaches the server, if not set then the
+            # webhook needs setting some other way
+            url=os.environ.get("WEBHOOK_URL"),
+        )
+    else:
+        updater.start_polling()
+    profile.mark("Start receiving updates")
     updater.idle()
 
+    if webhook is not None:
+        webhook.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+
+    # Send any replies and deletions that are still queued
+    outbound.stop()
+    shadow.stop()
+    if snapshot_writer is not None:
+        snapshot_writer.close()
+    events.close()
+    history.close()
+
 
 if __name__ == "__main__":
     main()
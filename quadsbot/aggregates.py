@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+
+class Aggregates:
+    """
+    Running totals for /stats, kept in bot_data["aggregates"] and updated as
+    each message is handled, so /stats never has to go through every user.
+
+    Only counts messages handled since `since` (epoch seconds), which is
+    None if they started from every user's totals (see
+    `quadsbot.migrations.add_aggregates`).
+    """
+
+    def __init__(self, since: Optional[float] = None):
+        self.since = time.time() if since is None else since
+        # State name -> messages
+        self.states = Counter()
+        # message_re -> checks
+        self.matchers = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_totals(cls, states: Counter) -> "Aggregates":
+        """
+        Starting from state totals that cover every message so far
+        """
+        aggregates = cls()
+        aggregates.since = None
+        aggregates.states = states
+        return aggregates
+
+    def record(self, state_name: str, message_re: Optional[str] = None) -> None:
+        with self._lock:
+            self.states[state_name] += 1
+            if message_re is not None:
+                self.matchers[message_re] += 1
+
+    def top_matchers(self, n: int = 5) -> list[tuple[str, int]]:
+        with self._lock:
+            return self.matchers.most_common(n)
+
+    def state_totals(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self.states)
+
+    def __getstate__(self) -> dict:
+        # Handlers may be recording while it's being saved
+        with self._lock:
+            return {
+                "since": self.since,
+                "states": dict(self.states),
+                "matchers": dict(self.matchers),
+            }
+
+    def __setstate__(self, state: dict) -> None:
+        self.since = state["since"]
+        self.states = Counter(state["states"])
+        self.matchers = Counter(state["matchers"])
+        self._lock = threading.Lock()
@@ -0,0 +1,250 @@
+import calendar
+import itertools
+import re
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pytz
+
+from quadsbot.date_utils import format_strings
+from quadsbot.digit_pattern import DigitPattern, parse_digit_pattern
+from quadsbot.handlers.message import State
+from quadsbot.matchers import april_fools_matcher_engine, matchers
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# The width of each strftime directive used in `format_strings`
+directive_widths = {"Y": 4, "m": 2, "d": 2, "H": 2, "I": 2, "M": 2, "S": 2}
+
+
+def utc_offsets(timestamps: np.ndarray, tz: str) -> np.ndarray:
+    """
+    The UTC offset in seconds of each of the given epoch seconds
+    """
+    tzinfo = pytz.timezone(tz)
+
+    transition_times = getattr(tzinfo, "_utc_transition_times", None)
+    if not transition_times:
+        # A fixed offset timezone
+        offset = tzinfo.utcoffset(datetime(2000, 1, 1))
+        return np.full(timestamps.shape, int(offset.total_seconds()), dtype=np.int64)
+
+    # Same lookup as pytz.DstTzInfo.fromutc, but over the whole array at once
+    transitions = np.array(
+        [calendar.timegm(t.timetuple()) for t in transition_times], dtype=np.int64
+    )
+    offsets = np.array(
+        [int(info[0].total_seconds()) for info in tzinfo._transition_info], dtype=np.int64
+    )
+    idx = np.searchsorted(transitions, timestamps, side="right") - 1
+    return offsets[np.maximum(idx, 0)]
+
+
+def civil_from_days(days: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Days since 1970-01-01 -> (year, month, day)
+    See: http://howardhinnant.github.io/date_algorithms.html#civil_from_days
+    """
+    z = days + 719468
+    era = np.floor_divide(z, 146097)
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def date_digits(timestamps: np.ndarray, tz: str) -> Tuple[list[np.ndarray], np.ndarray]:
+    """
+    The digits of each of the `format_strings`, as a (width, N) uint8 array
+    per format string (so each digit position is contiguous).
+    Also returns whether each date is april fools day.
+    """
+    local = timestamps + utc_offsets(timestamps, tz)
+    days, second = np.divmod(local, SECONDS_PER_DAY)
+    year, month, day = civil_from_days(days)
+    hour, rest = np.divmod(second, 3600)
+    minute, second = np.divmod(rest, 60)
+
+    fields = {
+        "Y": year,
+        "m": month,
+        "d": day,
+        "H": hour,
+        "I": np.where(hour % 12 == 0, 12, hour % 12),
+        "M": minute,
+        "S": second,
+    }
+
+    all_digits = []
+    for format_string in format_strings:
+        columns = []
+        for directive in re.findall(r"%(.)", format_string):
+            value = fields[directive]
+            for power in reversed(range(directive_widths[directive])):
+                columns.append((value // 10**power) % 10)
+        all_digits.append(np.stack(columns).astype(np.uint8))
+
+    return all_digits, (month == 4) & (day == 1)
+
+
+def search(pattern: DigitPattern, digits: np.ndarray) -> np.ndarray:
+    """
+    The vectorized equivalent of `re.search(pattern, date_digits).end()`.
+    Returns the end of the match for each row, or -1 if it doesn't match.
+
+    Tries the same things in the same order as the regex engine: each start
+    position from left to right, then each combination of optionals with
+    present before absent.
+    """
+    width, rows = digits.shape
+    ends = np.full(rows, -1, dtype=np.int64)
+
+    starts = [0] if pattern.anchored else range(width)
+    combinations = list(itertools.product([True, False], repeat=pattern.optionals))
+    for start in starts:
+        for present in combinations:
+            atoms = pattern.atoms(present)
+            end = start + len(atoms)
+            if end > width:
+                continue
+
+            matched = ends == -1
+            groups = {}
+            for position, atom in enumerate(atoms, start):
+                column = digits[position]
+                if atom.kind == "lit":
+                    matched &= column == int(atom.value)
+                elif atom.kind == "ref":
+                    if atom.group not in groups:
+                        raise ValueError(f"Unsupported reference to group {atom.group}")
+                    matched &= column == groups[atom.group]
+                elif atom.group is not None:
+                    groups[atom.group] = column
+
+            ends[matched] = end
+            if not (ends == -1).any():
+                return ends
+
+    return ends
+
+
+def regex_search(date_re: re.Pattern, digits: np.ndarray) -> np.ndarray:
+    """
+    `search` using the regex itself, one row at a time, for date patterns
+    that `parse_digit_pattern` can't handle
+    """
+    width, rows = digits.shape
+    strings = np.ascontiguousarray(digits.T + ord("0"), dtype=np.uint8).view(f"S{width}")
+    ends = np.full(rows, -1, dtype=np.int64)
+    for row, string in enumerate(strings.reshape(-1)):
+        match = date_re.search(string.decode())
+        if match:
+            ends[row] = match.end()
+    return ends
+
+
+def text_matches(matcher_idx: int, texts: np.ndarray) -> np.ndarray:
+    """
+    Whether the text side of the given matcher matches each text.
+    Evaluated once per distinct text.
+    """
+    matcher = april_fools_matcher_engine.matchers[matcher_idx]
+    unique, inverse = np.unique(texts, return_inverse=True)
+    results = np.array([matcher.text_matches(text) for text in unique], dtype=bool)
+    return results[inverse.reshape(-1)]
+
+
+def check_many(
+    timestamps: Sequence[int],
+    tz: str,
+    texts: Optional[Sequence[Optional[str]]] = None,
+    chunk_size: int = 1_000_000,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The batch version of `quadsbot.handlers.message.check`.
+
+    Given arrays of epoch seconds (and optionally message texts), returns:
+    - The `State` value for each message (as an int array)
+    - The check_id for each CHECKED message (None otherwise)
+
+    If no texts are given then the text is assumed to match, so the result is
+    the best that a message sent at that time could do.
+
+    Useful for offline analysis, e.g. counting how many quads windows there
+    are in a year in a given timezone.
+    Works through the input `chunk_size` rows at a time to bound memory use.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if texts is not None:
+        texts = np.array([(text or "").lower() for text in texts], dtype=object)
+
+    states, check_ids = [], []
+    for start in range(0, max(len(timestamps), 1), chunk_size):
+        chunk_states, chunk_check_ids = check_chunk(
+            timestamps[start : start + chunk_size],
+            tz,
+            None if texts is None else texts[start : start + chunk_size],
+        )
+        states.append(chunk_states)
+        check_ids.append(chunk_check_ids)
+
+    return np.concatenate(states), np.concatenate(check_ids)
+
+
+def check_chunk(
+    timestamps: np.ndarray, tz: str, texts: Optional[np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    `check_many` for a single chunk, texts must already be lowercased
+    """
+    rows = len(timestamps)
+    all_digits, april_fools = date_digits(timestamps, tz)
+
+    states = np.full(rows, State.DELETE.value, dtype=np.int8)
+    check_ids = np.full(rows, None, dtype=object)
+    unresolved = np.ones(rows, dtype=bool)
+
+    for matcher_idx, matcher in enumerate(april_fools_matcher_engine.matchers):
+        # Joke matchers only apply on april fools day
+        applies = april_fools if matcher_idx >= len(matchers) else np.ones(rows, dtype=bool)
+        if not applies.any():
+            continue
+
+        try:
+            pattern = parse_digit_pattern(matcher.date_re.pattern)
+            ends = [search(pattern, digits) for digits in all_digits]
+        except ValueError:
+            ends = [regex_search(matcher.date_re, digits) for digits in all_digits]
+        date_hit = applies & np.logical_or.reduce([end != -1 for end in ends])
+        if not date_hit.any():
+            continue
+
+        states[date_hit & unresolved] = State.PASS.value
+
+        if texts is None:
+            text_hit = np.ones(rows, dtype=bool)
+        else:
+            text_hit = np.zeros(rows, dtype=bool)
+            candidates = date_hit & unresolved
+            text_hit[candidates] = text_matches(matcher_idx, texts[candidates])
+
+        for date_idx, end in enumerate(ends):
+            checked = applies & unresolved & text_hit & (end != -1)
+            if not checked.any():
+                continue
+
+            states[checked] = State.CHECKED.value
+            unresolved &= ~checked
+
+            # Only the checked rows need actual strings
+            digits = all_digits[date_idx][:, checked].T
+            for row, row_digits, row_end in zip(np.flatnonzero(checked), digits, end[checked]):
+                prefix = "".join(map(str, row_digits[:row_end]))
+                check_ids[row] = prefix + str(date_idx)
+
+    return states, check_ids
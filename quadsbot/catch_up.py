@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from queue import Queue
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext, DispatcherHandlerStop, Handler
+
+from quadsbot.outbound import outbound
+from quadsbot.user import stats_user
+
+# Write the stats at least this often while catching up, so a crash part
+# way through doesn't lose all of it
+batch_size = 1000
+
+# Caught up once there's been nothing to catch up on for this long
+idle_seconds = 2
+
+
+class CatchUpHandler(Handler):
+    """
+    After some downtime Telegram sends every message we missed at once.
+    Handling them like live messages would reply "Checked" to hours old
+    messages and write the stats after every one.
+
+    So while messages are older than `max_age` seconds, or at least
+    `max_backlog` updates are waiting, this handles them itself:
+    - They're handled one after the other on the dispatcher's thread (with
+      `message_handler`, so they're counted the same) rather than each
+      being given to a worker. So updates behind them in the queue,
+      including fresh ones, wait until they've been handled. That keeps the
+      backlog in order, and it's what the workers would be busy with anyway
+    - The stats are written once every `batch_size` messages, and when
+      caught up, rather than after every message. Only the writes for these
+      messages are put off, the workers write theirs as usual
+    - Stale checks aren't replied to, each chat gets one summary of them
+      when caught up
+    - Deletions are left to `outbound`, which deletes them in bulk
+
+    Must be added in a group before the other handlers. Everything else,
+    including commands however old they are, is left to them.
+    """
+
+    def __init__(self, persistence, update_queue: Queue, max_age: float, max_backlog: int):
+        super().__init__(self.catch_up)
+        self.persistence = persistence
+        self.update_queue = update_queue
+        self.max_age = max_age
+        self.max_backlog = max_backlog
+
+        self.active = False
+        self.bot = None
+        self.handled = 0
+        # chat_id -> username -> stale checks
+        self.stale_checks = {}
+        self._last = 0.0
+        self._waiting = False
+        self._lock = threading.Lock()
+
+    def age(self, update: Update) -> float:
+        return (datetime.now(timezone.utc) - update.message.date).total_seconds()
+
+    def check_update(self, update: object) -> Optional[bool]:
+        if not isinstance(update, Update) or update.message is None:
+            return None
+        message = update.message
+        if message.chat.type == "private" or message.location:
+            return None
+
+        stale = self.age(update) > self.max_age
+        if (message.text or "").startswith("/"):
+            # Left to their handlers (which count the message too), even when
+            # they're stale, so e.g. /stats is still answered
+            if stale:
+                return None
+        elif stale or self.update_queue.qsize() >= self.max_backlog:
+            return True
+
+        # Anything fresh means we've caught up
+        if self.active:
+            self.finish()
+        return None
+
+    def catch_up(self, update: Update, context: CallbackContext) -> None:
+        from quadsbot.handlers.message import State, message_handler
+
+        with self._lock:
+            if not self.active:
+                logging.info("Catching up on missed messages")
+                self.active = True
+                self.bot = context.bot
+            self._last = time.monotonic()
+
+        stale = self.age(update) > self.max_age
+        state = message_handler(update, context, reply=not stale)
+
+        with self._lock:
+            self.handled += 1
+            if stale and state in (State.CHECKED, State.CHECK_THEN_DELETE):
+                user = stats_user(update)
+                chat_checks = self.stale_checks.setdefault(update.message.chat_id, Counter())
+                chat_checks[user.username or user.first_name] += 1
+            write = self.handled % batch_size == 0
+
+            if not self._waiting and context.job_queue is not None:
+                self._waiting = True
+                context.job_queue.run_repeating(self.check_caught_up, idle_seconds)
+
+        # The dispatcher writes bot_data straight after, on this thread
+        if not write:
+            self.persistence.defer_write()
+        # Nothing else needs to see it
+        raise DispatcherHandlerStop()
+
+    def check_caught_up(self, context: CallbackContext) -> None:
+        """
+        Finish once nothing has needed catching up for a while, so it doesn't
+        wait for the next live message
+        """
+        with self._lock:
+            if self.active and time.monotonic() - self._last < idle_seconds:
+                return
+            self._waiting = False
+        context.job.schedule_removal()
+        self.finish()
+
+    def finish(self) -> None:
+        with self._lock:
+            if not self.active:
+                return
+            self.active = False
+            self.persistence.write_deferred()
+            handled, self.handled = self.handled, 0
+            stale_checks, self.stale_checks = self.stale_checks, {}
+        logging.info(f"Caught up on {handled} messages")
+
+        for chat_id, checks in stale_checks.items():
+            outbound.send(self.bot, chat_id, summary(checks))
+
+
+def summary(checks: Counter) -> str:
+    lines = [f"Caught up on {sum(checks.values())} checks from while I was away:"]
+    for username, count in checks.most_common():
+        lines.append(f"{username}: {count}")
+    return "\n".join(lines)
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import pytz
+
+# Checks older than this are forgotten, and aren't counted as unique
+# (e.g. forwarding an old check), since we can't know whether they were.
+horizon = timedelta(days=7)
+
+
+def pack_check_id(check_id: str) -> int:
+    """
+    Pack a check_id from `MatcherEngine.first_check` into an int.
+
+    The check_id is a prefix of the date digits followed by the date index,
+    e.g. "2022030122220". The prefix is kept as a number, and its length
+    (so leading digits can't be lost) and the date index in the last two
+    decimal digits.
+    """
+    prefix, date_idx = check_id[:-1], int(check_id[-1])
+    return int(prefix) * 100 + len(prefix) * 2 + date_idx
+
+
+def unpack_check_id(packed: int) -> str:
+    prefix, rest = divmod(packed, 100)
+    length, date_idx = divmod(rest, 2)
+    return str(prefix).zfill(length) + str(date_idx)
+
+
+def check_day(packed: int) -> int:
+    """
+    The (local) day a packed check_id is from, as YYYYMMDD.
+    Prefixes too short to include the whole day are padded with nines, the
+    last day they could be from, so they're kept as long as any of them.
+    """
+    prefix, rest = divmod(packed, 100)
+    length = rest // 2
+    if length >= 8:
+        return prefix // 10 ** (length - 8)
+    return (prefix + 1) * 10 ** (8 - length) - 1
+
+
+def oldest_day(date: datetime, tz: str) -> int:
+    """
+    The oldest day (as YYYYMMDD) that a check still counts for at `date`,
+    for a user in `tz`. Check ids are from local dates, so this is too.
+    """
+    local = date.astimezone(pytz.timezone(tz)).date()
+    return int((local - horizon).strftime("%Y%m%d"))
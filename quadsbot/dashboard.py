@@ -0,0 +1,125 @@
+"""
+A read-only web dashboard of every chat's leaderboard, served from the
+snapshot the bot publishes to SNAPSHOT_FILE (see `quadsbot.snapshot`).
+
+It runs as its own process and never talks to the bot or its database:
+
+```bash
+$ poetry run python -m quadsbot.dashboard /data/stats.snapshot --port 8080
+```
+"""
+
+import argparse
+import html
+import json
+import logging
+from datetime import datetime, timezone
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from quadsbot.snapshot import SnapshotReader
+
+
+class DashboardServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, reader: SnapshotReader):
+        super().__init__(address, DashboardRequestHandler)
+        self.reader = reader
+
+
+def render_page(title: str, body: list[str], published: float) -> str:
+    published_at = datetime.fromtimestamp(published, timezone.utc)
+    return "\n".join(
+        [
+            "<!doctype html>",
+            f"<title>{html.escape(title)}</title>",
+            f"<h1>{html.escape(title)}</h1>",
+            *body,
+            f"<p><small>As of {published_at:%Y-%m-%d %H:%M:%S} UTC</small></p>",
+        ]
+    )
+
+
+class DashboardRequestHandler(BaseHTTPRequestHandler):
+    """
+    - `/` every chat, `/chats.json` the same as JSON
+    - `/chat/<chat_id>` a chat's leaderboard, `/chat/<chat_id>.json` the
+      same as JSON
+    """
+
+    server: DashboardServer
+
+    def do_GET(self) -> None:
+        reader = self.server.reader
+        path = self.path.split("?")[0]
+
+        if path in ("/", "/chats.json"):
+            chats = reader.chats()
+            if path.endswith(".json"):
+                return self.send_json([chat._asdict() for chat in chats])
+            rows = [
+                f'<tr><td><a href="/chat/{chat.chat_id}">{chat.chat_id}</a></td>'
+                f"<td>{chat.users}</td><td>{chat.checks}</td></tr>"
+                for chat in chats
+            ]
+            body = ["<table>", "<tr><th>Chat</th><th>Users</th><th>Checks</th></tr>", *rows]
+            return self.send_html(render_page("Chats", body + ["</table>"], reader.published()))
+
+        if path.startswith("/chat/"):
+            name = path[len("/chat/") :]
+            as_json = name.endswith(".json")
+            try:
+                chat_id = int(name[: -len(".json")] if as_json else name)
+            except ValueError:
+                chat_id = None
+            top = reader.leaderboard(chat_id) if chat_id is not None else None
+            if top is not None:
+                if as_json:
+                    return self.send_json([{"score": s, "username": u} for s, u in top])
+                rows = [
+                    f"<li>{score} - {html.escape(username)}</li>" for score, username in top
+                ]
+                body = ["<ol>", *rows, "</ol>", '<p><a href="/">All chats</a></p>']
+                title = f"Leaderboard for {chat_id}"
+                return self.send_html(render_page(title, body, reader.published()))
+
+        self.send_body(HTTPStatus.NOT_FOUND, "text/plain", b"Not found")
+
+    def send_html(self, page: str) -> None:
+        self.send_body(HTTPStatus.OK, "text/html; charset=utf-8", page.encode())
+
+    def send_json(self, data) -> None:
+        self.send_body(HTTPStatus.OK, "application/json", json.dumps(data).encode())
+
+    def send_body(self, status: HTTPStatus, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(f"Dashboard {self.client_address[0]}: {format % args}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("snapshot", help="The snapshot the bot publishes, from SNAPSHOT_FILE")
+    parser.add_argument("--listen", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = DashboardServer((args.listen, args.port), SnapshotReader(args.snapshot))
+    logging.info(f"Serving the dashboard on {server.server_address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
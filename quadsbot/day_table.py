@@ -0,0 +1,291 @@
+import calendar
+import itertools
+import math
+import threading
+import time
+from array import array
+from datetime import datetime
+from typing import Optional, Tuple
+
+import pytz
+
+from quadsbot.digit_pattern import Atom, DigitPattern, parse_digit_pattern
+from quadsbot.matcher_engine import MatcherEngine
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# The time fields after the date prefix, as (seconds per unit, units)
+time_fields = [(3600, 24), (60, 60), (1, 60)]
+
+
+def time_digits(second: int) -> str:
+    h, rest = divmod(second, 3600)
+    m, s = divmod(rest, 60)
+    return f"{h:02}{m:02}{s:02}"
+
+
+def bind(atoms: list[Atom], start: int, position: int, digits: str, groups: dict) -> Optional[dict]:
+    """
+    Check `digits` (at `position` in the date string) against the atoms of a
+    match that starts at `start`.
+    Returns the updated group captures, or None if they don't match.
+    """
+    for offset, digit in enumerate(digits, position - start):
+        if not 0 <= offset < len(atoms):
+            continue
+        atom = atoms[offset]
+        if atom.kind == "lit" and digit != atom.value:
+            return None
+        if atom.kind == "ref" and groups.get(atom.group) != digit:
+            return None
+        if atom.kind == "any" and atom.group is not None:
+            groups = {**groups, atom.group: digit}
+    return groups
+
+
+def matching_seconds(pattern: DigitPattern, date_prefix: str) -> set[int]:
+    """
+    The seconds of the day where the pattern matches the date digits.
+
+    Only tries the hours, then minutes, then seconds whose digits fit the
+    atoms, for every place a match could start. Once a match has run out of
+    atoms the rest of the fields are free.
+    """
+    width = len(date_prefix) + 6
+    seconds = set()
+
+    def search(atoms: list[Atom], start: int, k: int, second: int, groups: dict) -> None:
+        position = len(date_prefix) + 2 * k
+        unit, units = time_fields[k] if k < len(time_fields) else (1, 1)
+        if position >= start + len(atoms):
+            seconds.update(range(second, second + unit * units))
+            return
+        for value in range(units):
+            new_groups = bind(atoms, start, position, f"{value:02}", groups)
+            if new_groups is not None:
+                search(atoms, start, k + 1, second + value * unit, new_groups)
+
+    for present in itertools.product((False, True), repeat=pattern.optionals):
+        atoms = pattern.atoms(present)
+        starts = range(max(width - len(atoms) + 1, 0))
+        for start in starts[:1] if pattern.anchored else starts:
+            groups = bind(atoms, start, 0, date_prefix, {})
+            if groups is not None:
+                search(atoms, start, 0, 0, groups)
+    return seconds
+
+
+class DayTable:
+    """
+    For a single local date, which matchers' date side hits at each of the
+    86,400 wall-clock seconds.
+
+    `masks[second]` has bit `i` set if matcher `i` matches the 24 hour digits.
+    We don't need a separate table for the 12 hour digits because they're
+    always the same as the 24 hour digits of some other second in the same day
+    (e.g. 13:05:00 -> 01:05:00).
+    """
+
+    def __init__(self, date_prefix: str, engine: MatcherEngine):
+        self.date_prefix = date_prefix
+        self.engine = engine
+
+        self.masks = array("Q", bytes(8 * SECONDS_PER_DAY))
+        for matcher_idx, matcher in enumerate(engine.matchers):
+            bit = 1 << matcher_idx
+            try:
+                pattern = parse_digit_pattern(matcher.date_re.pattern)
+                seconds = matching_seconds(pattern, date_prefix)
+            except ValueError:
+                # Otherwise run the regex on every second
+                seconds = (
+                    second
+                    for second in range(SECONDS_PER_DAY)
+                    if matcher.date_re.search(f"{date_prefix}{time_digits(second)}")
+                )
+            for second in seconds:
+                self.masks[second] |= bit
+
+    def lookup(self, second: int) -> Tuple[list[str], list[Tuple[int, int, int]]]:
+        """
+        Returns the date strings (in `date_utils.format_strings` order) and the
+        `MatcherEngine.date_hits` for the given second of the day
+        """
+        h, rest = divmod(second, 3600)
+        h12 = h % 12 or 12
+
+        dates = [
+            f"{self.date_prefix}{time_digits(second)}",  # 24 hour
+            f"{self.date_prefix}{time_digits(h12 * 3600 + rest)}",  # 12 hour
+        ]
+        masks = [self.masks[second], self.masks[h12 * 3600 + rest]]
+
+        hits = []
+        if masks[0] or masks[1]:
+            matchers = self.engine.matchers
+            for matcher_idx in range(len(matchers)):
+                for date_idx, mask in enumerate(masks):
+                    if mask >> matcher_idx & 1:
+                        # Only hits need the actual match, for the check_id
+                        date_match = matchers[matcher_idx].date_re.search(dates[date_idx])
+                        hits.append((matcher_idx, date_idx, date_match.end()))
+        return dates, hits
+
+
+class Segment:
+    """
+    A span of UTC time `[start, end)` in a timezone where both the UTC offset
+    and the local date stay the same.
+    A DST transition splits a day into two segments that share a `DayTable`.
+    """
+
+    def __init__(self, start: int, end: int, offset: int, wall_midnight: int, table: DayTable):
+        self.start = start
+        self.end = end
+        self.offset = offset
+        self.wall_midnight = wall_midnight
+        self.table = table
+
+
+def utc_offset(tz: pytz.BaseTzInfo, timestamp: int) -> int:
+    return int(datetime.fromtimestamp(timestamp, tz).utcoffset().total_seconds())
+
+
+class DayTables:
+    """
+    Lazily built `DayTable`s for the current local date of every timezone we've
+    seen, so checking a message is an index lookup instead of a timezone
+    conversion plus running every date regex.
+
+    Only the latest date per timezone is kept. When a timezone rolls over to a
+    new day, the old segments are evicted along with any table that no other
+    timezone still uses. Dates that aren't close to now, or are older than the
+    cached date (e.g. forwarded messages), are evaluated directly instead of
+    building a table.
+    """
+
+    def __init__(self, engine: MatcherEngine, april_fools_engine: MatcherEngine):
+        self.engine = engine
+        self.april_fools_engine = april_fools_engine
+
+        # tz -> [Segment]
+        self._segments = {}
+        # date_prefix -> DayTable
+        self._tables = {}
+        # Held while adding segments and tables
+        self._lock = threading.Lock()
+
+    def date_hits(self, date: datetime, tz: str) -> Tuple[list[str], list[Tuple[int, int, int]]]:
+        """
+        Returns the date strings and `MatcherEngine.date_hits` for the given
+        date in the given timezone
+        """
+        timestamp = math.floor(date.timestamp())
+
+        for segment in self._segments.get(tz, []):
+            if segment.start <= timestamp < segment.end:
+                return segment.table.lookup(timestamp + segment.offset - segment.wall_midnight)
+
+        tzinfo = pytz.timezone(tz)
+        local = datetime.fromtimestamp(timestamp, tzinfo)
+        if abs(timestamp - time.time()) > SECONDS_PER_DAY:
+            return self.direct_date_hits(local)
+
+        date_prefix = local.strftime("%Y%m%d")
+        if self._is_past(tz, date_prefix):
+            # Looking into the past, don't cache it
+            return self.direct_date_hits(local)
+
+        # Building the table is the slow part, so it's done before taking the
+        # lock. If two threads race to build the same day the first one wins.
+        table = self._tables.get(date_prefix)
+        if table is None:
+            table = DayTable(date_prefix, self._engine_for(local))
+
+        # Only one thread adds segments at a time, the lookup above doesn't
+        # need the lock because segment lists are only ever appended to or
+        # replaced
+        with self._lock:
+            return self._date_hits_slow(timestamp, tz, tzinfo, local, table)
+
+    def _is_past(self, tz: str, date_prefix: str) -> bool:
+        segments = self._segments.get(tz)
+        return bool(segments) and date_prefix < segments[0].table.date_prefix
+
+    def _date_hits_slow(
+        self, timestamp: int, tz: str, tzinfo: pytz.BaseTzInfo, local: datetime, table: DayTable
+    ) -> Tuple[list[str], list[Tuple[int, int, int]]]:
+        segments = self._segments.get(tz, [])
+        for segment in segments:
+            if segment.start <= timestamp < segment.end:
+                # Another thread added it while we waited
+                return segment.table.lookup(timestamp + segment.offset - segment.wall_midnight)
+
+        if self._is_past(tz, table.date_prefix):
+            # Another thread moved on to the next day while we waited
+            return self.direct_date_hits(local)
+
+        table = self._tables.setdefault(table.date_prefix, table)
+        segment = self._build_segment(tzinfo, local, timestamp, table)
+        if segments and table.date_prefix == segments[0].table.date_prefix:
+            # The other side of a DST transition
+            segments.append(segment)
+        else:
+            self._segments[tz] = [segment]
+            self._evict_tables()
+
+        return segment.table.lookup(timestamp + segment.offset - segment.wall_midnight)
+
+    def direct_date_hits(self, local: datetime) -> Tuple[list[str], list[Tuple[int, int, int]]]:
+        """
+        The uncached path, `local` must already be in the right timezone
+        """
+        dates = [local.strftime("%Y%m%d%H%M%S"), local.strftime("%Y%m%d%I%M%S")]
+        return dates, self._engine_for(local).date_hits(dates)
+
+    def _engine_for(self, local: datetime) -> MatcherEngine:
+        if local.month == 4 and local.day == 1:
+            return self.april_fools_engine
+        return self.engine
+
+    def _build_segment(
+        self, tzinfo: pytz.BaseTzInfo, local: datetime, timestamp: int, table: DayTable
+    ) -> Segment:
+        offset = int(local.utcoffset().total_seconds())
+        wall_midnight = calendar.timegm(local.date().timetuple())
+
+        # The local day, assuming the offset doesn't change
+        start = wall_midnight - offset
+        end = wall_midnight + SECONDS_PER_DAY - offset
+
+        # Otherwise shrink to the side of the transition we're on
+        if utc_offset(tzinfo, start) != offset:
+            lo, hi = start, timestamp
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if utc_offset(tzinfo, mid) == offset:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            start = lo
+        if utc_offset(tzinfo, end - 1) != offset:
+            lo, hi = timestamp, end - 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if utc_offset(tzinfo, mid) != offset:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            end = lo
+
+        return Segment(start, end, offset, wall_midnight, table)
+
+    def _evict_tables(self) -> None:
+        in_use = {
+            segment.table.date_prefix
+            for segments in self._segments.values()
+            for segment in segments
+        }
+        for date_prefix in list(self._tables):
+            if date_prefix not in in_use:
+                del self._tables[date_prefix]
@@ -0,0 +1,131 @@
+import re
+from typing import NamedTuple, Optional, Tuple
+
+from quadsbot.matcher_engine import sre_parse, sre_constants
+
+
+class Atom(NamedTuple):
+    """
+    A single digit position within a date pattern
+
+    kind is one of:
+    - "lit": Must be the digit `value`
+    - "any": Any digit, if `group` is set then the digit is captured as that group
+    - "ref": Must equal the digit captured as `group`
+    """
+
+    kind: str
+    value: Optional[str] = None
+    group: Optional[int] = None
+
+
+class Unit(NamedTuple):
+    """
+    A run of atoms that are either all present, or (if optional) all absent
+    """
+
+    atoms: Tuple[Atom, ...]
+    optional: bool = False
+
+
+class DigitPattern(NamedTuple):
+    """
+    The structure of a date regex from `matchers`, in terms of digit positions.
+
+    `r"^........(.)\\1{3}"` becomes an anchored pattern of 8 "any" atoms,
+    an "any" atom captured as group 1, then 3 "ref" atoms to group 1.
+
+    This lets us evaluate the date side of a matcher without the regex
+    engine, e.g. on arrays of digits or by enumerating the digits directly.
+    """
+
+    anchored: bool
+    units: Tuple[Unit, ...]
+
+    @property
+    def optionals(self) -> int:
+        return sum(unit.optional for unit in self.units)
+
+    @property
+    def fixed_width(self) -> bool:
+        return self.optionals == 0
+
+    def atoms(self, present: Tuple[bool, ...] = ()) -> list[Atom]:
+        """
+        The flat list of atoms given which optional units are present
+        """
+        present = iter(present)
+        atoms = []
+        for unit in self.units:
+            if not unit.optional or next(present):
+                atoms += unit.atoms
+        return atoms
+
+
+def parse_digit_pattern(pattern: str) -> DigitPattern:
+    """
+    Parse a date regex into a `DigitPattern`.
+
+    Only supports the subset of regex used by the date side of the matchers:
+    `^`, `.`, literal digits, `(.)` groups, backreferences, fixed repeats and
+    `?` on literals or groups of literals.
+    Raises ValueError for anything else, including when Python's (private)
+    regex parser isn't available or doesn't look the way we expect. Callers
+    fall back to the regex itself.
+    """
+    if sre_parse is None:
+        raise ValueError(f"Can't parse date pattern `{pattern}` without the regex parser")
+    try:
+        return _parse_digit_pattern(pattern)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Can't parse date pattern `{pattern}`") from e
+
+
+def _parse_digit_pattern(pattern: str) -> DigitPattern:
+
+    def single(op, av) -> Tuple[Atom, ...]:
+        if op is sre_constants.LITERAL and chr(av).isdigit():
+            return (Atom("lit", value=chr(av)),)
+        if op is sre_constants.ANY:
+            return (Atom("any"),)
+        if op is sre_constants.GROUPREF:
+            return (Atom("ref", group=av),)
+        if op is sre_constants.SUBPATTERN:
+            group, inner = av[0], list(av[-1])
+            if len(inner) == 1 and inner[0][0] is sre_constants.ANY:
+                return (Atom("any", group=group),)
+            if all(op is sre_constants.LITERAL for op, _ in inner):
+                # A group of literals e.g. `(13)`, nothing may refer to it
+                return tuple(atom for op, av in inner for atom in single(op, av))
+        raise ValueError(f"Unsupported date pattern `{pattern}`")
+
+    try:
+        parsed = list(sre_parse.parse(pattern))
+    except re.error as e:
+        raise ValueError(f"Invalid date pattern `{pattern}`") from e
+
+    anchored = False
+    if parsed and parsed[0] == (sre_constants.AT, sre_constants.AT_BEGINNING):
+        anchored = True
+        parsed = parsed[1:]
+
+    units = []
+    for op, av in parsed:
+        if op is sre_constants.MAX_REPEAT:
+            min_repeat, max_repeat, item = av
+            item = list(item)
+            if len(item) != 1:
+                raise ValueError(f"Unsupported date pattern `{pattern}`")
+            atoms = single(*item[0])
+            if min_repeat == max_repeat:
+                units += [Unit(atoms)] * min_repeat
+            elif (min_repeat, max_repeat) == (0, 1) and all(a.kind == "lit" for a in atoms):
+                units.append(Unit(atoms, optional=True))
+            else:
+                raise ValueError(f"Unsupported date pattern `{pattern}`")
+        else:
+            units.append(Unit(single(op, av)))
+
+    return DigitPattern(anchored, tuple(units))
@@ -0,0 +1,212 @@
+import logging
+import os
+import struct
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Iterator, Mapping, NamedTuple, Optional
+
+import pytz
+
+from quadsbot.user import default_tz
+
+# timestamp, chat_id, user_id, check_id (packed, 0 if none), matcher (-1 if
+# none), state, unique
+record = struct.Struct("<qqqqhBB")
+
+# Days of unique checks kept in memory, enough for the longest window
+window_days = 31
+
+# Events are appended as they're handled, so they're out of order by as old
+# as a handled message can be: catch-up handles what was sent while the bot
+# was down, and Telegram keeps undelivered updates for a day. Reading from a
+# time starts this much earlier to be sure.
+max_disorder = 25 * 60 * 60
+
+
+class Event(NamedTuple):
+    timestamp: int
+    chat_id: int
+    user_id: int
+    check_id: int
+    matcher: int
+    state: int
+    unique: bool
+
+
+def read_events(filename: str, since: Optional[float] = None) -> Iterator[Event]:
+    """
+    The events in the log, from roughly `since` (epoch seconds) if given.
+
+    The records are a fixed size, so the start is found by binary search
+    rather than reading the whole log.
+    """
+    with open(filename, "rb") as f:
+        count = os.fstat(f.fileno()).st_size // record.size
+
+        start = 0
+        if since is not None:
+            since -= max_disorder
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                f.seek(middle * record.size)
+                if record.unpack(f.read(record.size))[0] < since:
+                    low = middle + 1
+                else:
+                    high = middle
+            start = low
+
+        f.seek(start * record.size)
+        chunk_records = 4096
+        remaining = count - start
+        while remaining > 0:
+            data = f.read(min(remaining, chunk_records) * record.size)
+            remaining -= len(data) // record.size
+            for values in record.iter_unpack(data):
+                yield Event(*values[:-1], bool(values[-1]))
+
+
+class EventLog:
+    """
+    An append-only binary log of every message outcome, see `record`.
+
+    Also keeps the unique checks of the last `window_days` days in memory,
+    counted per chat, per day, per user. So a leaderboard for a window only
+    adds up a month of daily counts at most, rather than going through the
+    log.
+
+    Each check is counted on the day it was in the user's own timezone, the
+    same day it was checked against. The log doesn't store timezones, so
+    when it's read back in `open` each user's current timezone is used,
+    which only differs for users who've moved in the last month.
+
+    Does nothing until `open` is called.
+    """
+
+    def __init__(self, tz: str = default_tz):
+        # For users without a timezone
+        self.tz = tz
+        self._file = None
+        self._lock = threading.Lock()
+        # chat_id -> day ordinal -> user_id -> unique checks
+        self.days = {}
+        # (chat_id, since) -> [(score, user_id)], thrown away on a unique check
+        self.rankings = {}
+
+    def open(self, filename: str, timezones: Optional[Mapping[int, str]] = None) -> None:
+        """
+        Start appending to `filename`, and read its recent unique checks.
+        `timezones` is user_id -> timezone, for the users who've set one.
+        """
+        timezones = timezones or {}
+        with self._lock:
+            if os.path.exists(filename):
+                # A crash part way through a write leaves part of a record,
+                # the rest would be misaligned after it
+                size = os.path.getsize(filename)
+                if size % record.size:
+                    logging.warning(f"Removing a partly written event from {filename}")
+                    os.truncate(filename, size - size % record.size)
+
+                since = time.time() - (window_days + 1) * 24 * 60 * 60
+                for event in read_events(filename, since):
+                    self._index(event, timezones.get(event.user_id, self.tz))
+
+            self._file = open(filename, "ab", buffering=0)
+        logging.info(f"Logging events to {filename}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def clear(self) -> None:
+        """
+        Forget every event, both in memory and in the log
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.truncate(0)
+            self.days.clear()
+            self.rankings.clear()
+
+    def record(
+        self,
+        timestamp: datetime,
+        chat_id: int,
+        user_id: int,
+        state: int,
+        matcher: int = -1,
+        check_id: int = 0,
+        unique: bool = False,
+        tz: Optional[str] = None,
+    ) -> None:
+        """
+        Log a message's outcome, `tz` is the user's timezone
+        """
+        if self._file is None:
+            return
+        event = Event(
+            int(timestamp.timestamp()), chat_id, user_id, check_id, matcher, state, unique
+        )
+        data = record.pack(*event)
+        with self._lock:
+            self._file.write(data)
+            self._index(event, tz or self.tz)
+
+    def _index(self, event: Event, tz: str) -> None:
+        """
+        Count a unique check on its day in `tz`, must hold the lock
+        """
+        if not event.unique:
+            return
+        day = datetime.fromtimestamp(event.timestamp, pytz.timezone(tz)).toordinal()
+        chat_days = self.days.setdefault(event.chat_id, {})
+        if day not in chat_days:
+            # Forget the days that are too old for any window
+            for old in [old for old in chat_days if old <= day - window_days]:
+                del chat_days[old]
+            chat_days[day] = Counter()
+        chat_days[day][event.user_id] += 1
+
+        for key in [key for key in self.rankings if key[0] == event.chat_id]:
+            del self.rankings[key]
+
+    def today(self, tz: Optional[str] = None) -> date:
+        return datetime.now(pytz.timezone(tz or self.tz)).date()
+
+    def ranking(self, chat_id: int, since: date) -> list[tuple[int, int]]:
+        """
+        The (score, user_id) of everyone with unique checks in the chat since
+        the start of `since` (up to `window_days` ago), highest first.
+        Ties are ordered by user id.
+        """
+        key = (chat_id, since.toordinal())
+        with self._lock:
+            if key not in self.rankings:
+                scores = Counter()
+                for day, counts in self.days.get(chat_id, {}).items():
+                    if day >= key[1]:
+                        scores.update(counts)
+                self.rankings[key] = sorted(
+                    ((score, user_id) for user_id, score in scores.items()),
+                    key=lambda entry: (-entry[0], entry[1]),
+                )
+            return self.rankings[key]
+
+
+def window_start(window: str, today: date) -> date:
+    """
+    The first day of a leaderboard window, "week" (from Monday) or "month"
+    """
+    if window == "week":
+        return today - timedelta(days=today.weekday())
+    if window == "month":
+        return today.replace(day=1)
+    raise ValueError(f"Unknown window: {window}")
+
+
+events = EventLog()
@@ -4,12 +4,18 @@ import json
 from telegram import Update
 from telegram.ext import CallbackContext
 
+from quadsbot.aggregates import Aggregates
+from quadsbot.event_log import events
+
 
 def clear_handler(update: Update, context: CallbackContext) -> None:
     """
     Clears the stored stats
     """
     logging.info("/clear call")
+    context.bot_data["chat_stats"].clear()
     context.bot_data["user_stats"].clear()
-    user_stats = json.dumps(context.bot_data["user_stats"])
-    update.message.reply_text(f"Stats: {user_stats}")
+    context.bot_data["aggregates"] = Aggregates()
+    events.clear()
+    chat_stats = json.dumps(context.bot_data["chat_stats"])
+    update.message.reply_text(f"Stats: {chat_stats}")
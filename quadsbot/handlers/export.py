@@ -0,0 +1,71 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import tempfile
+from datetime import datetime
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from quadsbot.user import UserRecord
+
+formats = ("csv", "jsonl")
+# Users read from the database at a time
+chunk_size = 500
+
+
+def write_csv(text: io.TextIOBase, records) -> None:
+    columns = ["chat_id", "user_id", *UserRecord.fields, "checks", "extra"]
+    writer = csv.DictWriter(text, columns)
+    writer.writeheader()
+    for chat_id, user_id, user_info in records:
+        row = {"chat_id": chat_id, "user_id": user_id}
+        for field in (*UserRecord.fields, "checks"):
+            row[field] = user_info.pop(field, None)
+        row["checks"] = " ".join(row["checks"] or [])
+        # Any other keys, e.g. from very old records
+        row["extra"] = json.dumps(user_info) if user_info else ""
+        writer.writerow(row)
+
+
+def write_jsonl(text: io.TextIOBase, records) -> None:
+    for chat_id, user_id, user_info in records:
+        text.write(json.dumps({"chat_id": chat_id, "user_id": user_id, **user_info}) + "\n")
+
+
+def export_handler(update: Update, context: CallbackContext) -> None:
+    """
+    Send all of the user stats as a gzipped CSV (the default) or JSONL file:
+    /export [csv|jsonl]
+
+    The users are read from the database a chunk at a time and written
+    straight to a temporary file, so it never has all of them in memory.
+    """
+    logging.info("/export call")
+
+    export_format = context.args[0].lower() if context.args else "csv"
+    if export_format not in formats:
+        update.message.reply_text(f"Usage: /export [{'|'.join(formats)}]")
+        return
+
+    # Export what's been written, so write everything first
+    persistence = context.dispatcher.persistence
+    context.dispatcher.update_persistence()
+    records = persistence.iter_records(chunk_size)
+
+    filename = f"quadsbot-{datetime.utcnow():%Y%m%d-%H%M%S}.{export_format}.gz"
+    with tempfile.TemporaryFile() as f:
+        with gzip.GzipFile(fileobj=f, mode="wb") as compressed:
+            text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+            if export_format == "csv":
+                write_csv(text, records)
+            else:
+                write_jsonl(text, records)
+            text.flush()
+            text.detach()
+
+        logging.info(f"Exported {f.tell()} bytes as {filename}")
+        f.seek(0)
+        update.message.reply_document(document=f, filename=filename)
@@ -1,44 +1,134 @@
 import logging
+import threading
+from typing import Optional, Tuple
 
 from telegram import Update
 from telegram.ext import CallbackContext
 
+from quadsbot.event_log import events, window_start
 from quadsbot.handlers.message import message_handler, State
+from quadsbot.rank_index import RankIndex, score_field
+from quadsbot.user import user_lock, user_tz
 
+# How many places to show, everyone else only sees their own place
+top_n = 10
 
-def leaderboard(user_stats) -> str:
-    # Get user objects, sorted by score
-    score_field = "checked_unique"
-    scores = [score for _, score in user_stats.items()]
-    scores = sorted(scores, key=lambda s: s[score_field], reverse=True)
+# /leaderboard <window>, "all" is every check ever
+windows = {
+    "all": "Leaderboard",
+    "week": "Leaderboard this week",
+    "month": "Leaderboard this month",
+}
 
+
+# Held while building a RankIndex, so a chat only builds one
+build_lock = threading.Lock()
+
+
+def rank_index_for(user_stats, chat_id: Optional[int] = None) -> RankIndex:
+    """
+    Get the chat's RankIndex, building it the first time
+    """
+    rank_index = getattr(user_stats, "rank_index", None)
+    if rank_index is not None:
+        return rank_index
+
+    with build_lock:
+        rank_index = getattr(user_stats, "rank_index", None)
+        if rank_index is not None:
+            return rank_index
+
+        # Most of the chat may only be on disk
+        cold = getattr(user_stats, "cold", None)
+        rank_index = RankIndex(dict(user_stats), cold.summary() if cold else None)
+        if not hasattr(user_stats, "rank_index"):
+            return rank_index
+        user_stats.rank_index = rank_index
+
+        # Users that changed while we were building didn't know to update the
+        # index, so catch up with them (holding their lock, like `User` does)
+        if chat_id is not None:
+            for user_id, user_info in list(user_stats.items()):
+                with user_lock(chat_id, user_id):
+                    rank_index.update(
+                        user_id, user_info.get(score_field, 0), user_info.get("username")
+                    )
+    return rank_index
+
+
+def render_top(scores: list[Tuple[int, str]], title: str = "Leaderboard") -> str:
     # Create message w/ Header
-    message = "<b>Leaderboard</b>\n"
+    lines = [f"<b>{title}</b>"]
 
     if len(scores) >= 1:
         # Format top scorer specially
-        top = scores[0]
-        top_score = top[score_field]
-        top_user = top["username"]
-
-        message += f"1. {top_score} - 👑 <b>{top_user}</b> 👑"
+        top_score, top_user = scores[0]
+        lines.append(f"1. {top_score} - 👑 <b>{top_user}</b> 👑")
 
         # Add the rest of the scorers
-        for idx, entry in enumerate(scores[1:]):
-            # Convert to correct numbering
-            place = idx + 2
-            score = entry[score_field]
-            username = entry["username"]
-            message += f"\n{place}. {score} - {username}"
+        for place, (score, username) in enumerate(scores[1:], 2):
+            lines.append(f"{place}. {score} - {username}")
     else:
-        message += "<i>Empty...</i>"
+        lines.append("<i>Empty...</i>")
+
+    return "\n".join(lines)
+
+
+def window_leaderboard(
+    user_stats,
+    window: str,
+    user_id: Optional[int] = None,
+    chat_id: Optional[int] = None,
+    tz: Optional[str] = None,
+) -> str:
+    """
+    The leaderboard of unique checks in a window of time, see
+    `quadsbot.event_log`. The window starts from today in `tz`.
+    """
+    ranking = events.ranking(chat_id, window_start(window, events.today(tz)))
+
+    def username(user_id: int) -> str:
+        user_info = user_stats.get(user_id)
+        return user_info.get("username") if user_info else None
+
+    top = [(score, username(ranked_id)) for score, ranked_id in ranking[:top_n]]
+    message = render_top(top, windows[window])
+
+    # Show the user where they are if they didn't make the cut
+    for place, (score, ranked_id) in enumerate(ranking[top_n:], top_n + 1):
+        if ranked_id == user_id:
+            message += f"\n...\n{place}. {score} - {username(user_id)}"
+            break
+
+    return message
+
+
+def leaderboard(
+    user_stats,
+    user_id: Optional[int] = None,
+    chat_id: Optional[int] = None,
+    window: str = "all",
+    tz: Optional[str] = None,
+) -> str:
+    if window != "all":
+        return window_leaderboard(user_stats, window, user_id, chat_id, tz)
+
+    rank_index = rank_index_for(user_stats, chat_id)
+    message = rank_index.render(top_n, render_top)
+
+    # Show the user where they are if they didn't make the cut
+    place = rank_index.rank(user_id)
+    if place is not None and place > top_n:
+        score, username = rank_index.entries[user_id]
+        message += f"\n...\n{place}. {score} - {username}"
 
     return message
 
 
 def leaderboard_handler(update: Update, context: CallbackContext) -> None:
     """
-    Display a leaderboard of scores
+    Display a leaderboard of scores:
+    /leaderboard [all|week|month]
     """
     logging.info("/leaderboard call")
 
@@ -50,6 +140,14 @@ def leaderboard_handler(update: Update, context: CallbackContext) -> None:
         if state in [State.DELETE, State.CHECK_THEN_DELETE]:
             return
 
-    # Reply with the leaderboard
-    message = leaderboard(context.bot_data["user_stats"])
+    window = context.args[0].lower() if context.args else "all"
+    if window not in windows:
+        update.message.reply_text(f"Usage: /leaderboard [{'|'.join(windows)}]")
+        return
+
+    # Reply with the leaderboard for this chat
+    chat_id = update.message.chat_id
+    user_id = update.message.from_user.id
+    user_stats = context.bot_data["chat_stats"][chat_id]
+    message = leaderboard(user_stats, user_id, chat_id, window, user_tz(context, user_id))
     update.message.reply_html(message)
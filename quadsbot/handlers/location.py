@@ -1,15 +1,22 @@
 import logging
+from typing import Optional
 
 from telegram import Update
 from telegram.ext import CallbackContext
 
-from timezonefinder import TimezoneFinder
-
-from quadsbot.user import User
+from quadsbot.user import stats_user
 from quadsbot.message_utils import delete_message
+from quadsbot.outbound import outbound
+from quadsbot.timezones import live_locations, timezones
 from quadsbot.handlers.message import message_handler
 
-tzf = TimezoneFinder()
+
+def stored_timezone(update: Update, context: CallbackContext) -> Optional[str]:
+    """
+    The timezone the user (the same user as `User`) has set, if they have,
+    see `quadsbot.persistence.Timezones`
+    """
+    return context.bot_data["timezones"].get(stats_user(update).id)
 
 
 def location_handler(update: Update, context: CallbackContext) -> None:
@@ -20,30 +27,50 @@ def location_handler(update: Update, context: CallbackContext) -> None:
     """
     logging.info("Handling Location")
 
-    if update.message.location.live_period:
+    # Live locations keep coming as edits to the original message
+    message = update.effective_message
+    is_edit = update.edited_message is not None
+
+    if message.location.live_period:
         logging.info("Got Live Location")
 
         # Calculate Timezone
-        latitude = update.message.location.latitude
-        longitude = update.message.location.longitude
-        user_timezone = tzf.timezone_at(lat=latitude, lng=longitude)
-
-        # Set the timezone in user_info
-        with User(update, context) as user_info:
-            user_info['tz'] = user_timezone
-
-        # Send Confirmation & delete after 2 seconds
-        confirm_message = update.message.chat.send_message(
-                f"Set your timezone to {user_timezone}"
-        )
-        context.job_queue.run_once(delete_message, 2, context={
-            "chat_id": confirm_message.chat_id,
-            "message_id": confirm_message.message_id,
-        })
+        latitude = message.location.latitude
+        longitude = message.location.longitude
+        if not live_locations.due(stats_user(update).id, latitude, longitude, first=not is_edit):
+            logging.info("Live location hasn't moved enough to look up again")
+            return
+        user_timezone = timezones.timezone_at(latitude, longitude)
+
+        if user_timezone is None:
+            outbound.send(
+                context.bot,
+                message.chat_id,
+                "Couldn't find a timezone for that location",
+                delete_after=2,
+            )
+        else:
+            if user_timezone == stored_timezone(update, context):
+                # Nothing has changed, so don't rewrite the user
+                logging.info("Timezone unchanged")
+            else:
+                # Set the timezone for every chat they're in
+                context.bot_data["timezones"][stats_user(update).id] = user_timezone
+
+            # Send Confirmation & delete after 2 seconds
+            # (Only for the first update, not every time a live location moves)
+            if not is_edit:
+                outbound.send(
+                    context.bot,
+                    message.chat_id,
+                    f"Set your timezone to {user_timezone}",
+                    delete_after=2,
+                )
 
         # Always delete message
-        update.message.delete()
-    else:
+        if not is_edit:
+            delete_message(context.bot, message.chat_id, message.message_id)
+    elif not is_edit:
         logging.info("Got Normal Location -- Doing nothing")
 
         # Handle message like normal
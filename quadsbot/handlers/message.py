@@ -1,5 +1,3 @@
-import re
-import logging
 from enum import Enum
 from typing import Tuple, Optional
 from datetime import datetime
@@ -7,40 +5,25 @@ from datetime import datetime
 from telegram import Update
 from telegram.ext import CallbackContext
 
-from quadsbot.date_utils import get_date_strings, is_april_fools_day
-from quadsbot.user import User
+from quadsbot.check_ids import oldest_day, pack_check_id
+from quadsbot.day_table import DayTables
+from quadsbot.event_log import events
+from quadsbot.history import history
+from quadsbot.logs import message_log
+from quadsbot.matchers import day_tables, matcher_ids
+from quadsbot.metrics import message_states
+from quadsbot.tracing import tracer
+from quadsbot.user import User, stats_user, user_tz
 from quadsbot.message_utils import delete_message
-
-# A list of tuples
-# The first value is a regex matcher for the above time format
-# The second value is either a regex matcher for text contents
-#
-# The first one that matches is replied to with "Checked"
-matchers = [
-    (r"^........(.)\1{3}", "quads"),  # 2022-03-01T22:22:00
-    (r"^........(.)\1{5}", "sexts"),  # 2022-03-01T22:22:22
-    (r"^......(.)\1{7}", "octs"),  # 2022-03-22T22:22:22
-    (r"^....(.)\1{9}", "decs"),  # 2022-11-11T11:11:11
-    (r"^..(.)\1{11}", "dodecs"),  # 2011-11-11T11:11:11
-]
-
-# TODO: Remove after april fools
-joke_matchers = [
-    (r"11235?8?(13)?", "fibs"),  # 2022-03-11T23:58:13
-    (r"12345?", "incs"),  # 2022-03-11T23:45:31
-    (r"69", "sixty nine"),  # Not possible I think?
-    (r"^........0420", r"(blaze it|blazeit)"),  # 2022-03-01T04:20:00
-    (r"^........1337", r"(leet|l33t|1337)"),  # 2022-03-01T13:37:00
-    (r"^........0230", r"(tooth hurty|ow)"),  # 2022-03-01T02:30:00
-    (r"^........0002", r"(poop|poopie|number 2|no\. 2)"),  # 2022-03-01T00:02:00
-    (r"^........0001", r"(peepee|pee pee|number 1|no\. 1)"),  # 2022-03-01T00:01:00
-    (r"^........0314", r"(pi|pie)"),  # 2022-03-01T03:14:00
-]
+from quadsbot.outbound import outbound
+from quadsbot.shadow import shadow
 
 State = Enum("State", "DELETE PASS CHECKED CHECK_THEN_DELETE")
 
 
-def check(date: datetime, tz: str, message_text: Optional[str]) -> Tuple[State, Optional[Tuple[str, str]]]:
+def check(
+    date: datetime, tz: str, message_text: Optional[str], tables: DayTables = day_tables
+) -> Tuple[State, Optional[Tuple[str, str]]]:
     """
     Calculate what to do with the given message.
 
@@ -55,47 +38,31 @@ def check(date: datetime, tz: str, message_text: Optional[str]) -> Tuple[State,
     message.
 
     This is reflected in the output state as CHECKED, PASS and DELETE.
-    """
-    delete_message = True
 
-    dates = get_date_strings(date, tz)
+    `tables` are the matchers to check with, see `quadsbot.shadow`.
+    """
+    dates, hits = tables.date_hits(date, tz)
     if not message_text:
         message_text = ""
     message_text = message_text.lower()
 
-    more_matchers = matchers
-    if is_april_fools_day(date, tz):
-        more_matchers = matchers + joke_matchers
-
-    for (date_re, message_re) in more_matchers:
-        for date_idx, date_digits in enumerate(dates):
-            date_match = re.search(date_re, date_digits)
-            if date_match:
-                delete_message = False
-                if re.search(message_re, message_text):
-                    # The string upto the end of the match
-                    date_prefix = date_digits[: date_match.end()]
-
-                    # The id for this specific check
-                    # We use the date prefix to identify when the match happened
-                    # (it includes the match itself so we don't id other matches)
-                    # We use the index of the date_digits to differentiate between 24
-                    # and 12 hour dates
-                    check_id = date_prefix + str(date_idx)
-
-                    # Return:
-                    # - The message_re as a key
-                    # - The check_id to help dedupe checks in the stats
-                    logging.info(
-                        f"Checked `{dates}` with `{message_text}` using `{message_re}`")
-                    return State.CHECKED, (message_re, check_id)
-
-    if delete_message:
-        logging.info(f"Deleted `{dates}` with `{message_text}`")
-        return State.DELETE, None
-    else:
-        logging.info(f"Passed `{dates}` with `{message_text}`")
+    if hits:
+        # NOTE: The hits can only contain joke matchers on april fools day
+        check_info = tables.april_fools_engine.first_check(dates, hits, message_text)
+        if check_info:
+            # Return:
+            # - The message_re as a key
+            # - The check_id to help dedupe checks in the stats
+            message_log.info(
+                "Checked `%s` with `%s` using `%s`", dates, message_text, check_info[0]
+            )
+            return State.CHECKED, check_info
+
+        message_log.info("Passed `%s` with `%s`", dates, message_text)
         return State.PASS, None
+    else:
+        message_log.info("Deleted `%s` with `%s`", dates, message_text)
+        return State.DELETE, None
 
 
 def calculate_forwarded_state(message_state: State, forward_state: State) -> State:
@@ -122,69 +89,106 @@ def calculate_forwarded_state(message_state: State, forward_state: State) -> Sta
     return state_transform[(message_state, forward_state)]
 
 
-def message_handler(update: Update, context: CallbackContext) -> State:
+def plan(
+    date: datetime,
+    forward_date: Optional[datetime],
+    tz: str,
+    message_text: Optional[str],
+    tables: DayTables = day_tables,
+) -> Tuple[State, Optional[Tuple[str, str]]]:
     """
-    Given a text message, plans what to do with it. Then executes that plan.
+    `check` a message, using `calculate_forwarded_state` if it was forwarded
+    (from `forward_date`)
     """
-    with User(update, context) as user_info:
-        logging.info(f"Handling Message from {user_info['username']}")
-
-        is_forwarded = update.effective_message.forward_date is not None
-        if is_forwarded:
-            logging.info("Detected Forwarded Message")
-            logging.info("Current message check:")
-            message_state, _ = check(
-                update.effective_message.date,
-                user_info["tz"],
-                update.effective_message.text
-            )
+    if forward_date is None:
+        return check(date, tz, message_text, tables)
 
-            # NOTE: We want the check_info using the time the message was originally sent
-            logging.info("Original message check:")
-            forward_state, check_info = check(
-                update.effective_message.forward_date,
-                user_info["tz"],
-                update.effective_message.text
-            )
+    message_log.info("Detected Forwarded Message")
+    message_log.info("Current message check:")
+    message_state, _ = check(date, tz, message_text, tables)
 
-            state = calculate_forwarded_state(message_state, forward_state)
-            logging.info(f"Calculated State: {state}")
-        else:
-            state, check_info = check(
-                update.effective_message.date,
-                user_info["tz"],
-                update.effective_message.text
-            )
+    # NOTE: We want the check_info using the time the message was originally sent
+    message_log.info("Original message check:")
+    forward_state, check_info = check(forward_date, tz, message_text, tables)
+
+    state = calculate_forwarded_state(message_state, forward_state)
+    message_log.info("Calculated State: %s", state)
+    return state, check_info
 
-        if state == State.CHECKED or state == State.CHECK_THEN_DELETE:
-            user_info["checked_total"] += 1
-
-            # Unpack check_info
-            (matcher, check_id) = check_info
-
-            # Dedupe checks
-            if check_id not in user_info["check_id_cache"]:
-                logging.info("Check identified as unique")
-                user_info["checked_unique"] += 1
-
-                user_info["check_id_cache"].append(check_id)
-            if state == State.CHECKED:
-                update.message.reply_text("Checked", quote=True)
-            elif state == State.CHECK_THEN_DELETE:
-                user_info["deleted"] += 1
-                context.job_queue.run_once(delete_message, 2, context={
-                    "chat_id": update.message.chat_id,
-                    "message_id": update.message.message_id,
-                })
-        elif state == State.DELETE:
+
+def count(
+    user_info, state: State, check_info: Optional[Tuple[str, str]], date: datetime, tz: str
+) -> bool:
+    """
+    Add the outcome of a message sent at `date` (by a user in `tz`) to the
+    user's stats.
+    Returns whether it was a unique check.
+    """
+    unique = False
+    if state == State.CHECKED or state == State.CHECK_THEN_DELETE:
+        user_info["checked_total"] += 1
+
+        # Unpack check_info
+        (matcher, check_id) = check_info
+
+        # Dedupe checks
+        if user_info.add_check(pack_check_id(check_id), oldest_day(date, tz)):
+            message_log.info("Check identified as unique")
+            user_info["checked_unique"] += 1
+            unique = True
+        if state == State.CHECK_THEN_DELETE:
             user_info["deleted"] += 1
-            context.job_queue.run_once(delete_message, 2, context={
-                "chat_id": update.message.chat_id,
-                "message_id": update.message.message_id,
-            })
-        elif state == State.PASS:
-            user_info["passed"] += 1
-            pass
-
-        user_info["messages_total"] += 1
-        return state
+    elif state == State.DELETE:
+        user_info["deleted"] += 1
+    elif state == State.PASS:
+        user_info["passed"] += 1
+
+    user_info["messages_total"] += 1
+    return unique
+
+
+def message_handler(update: Update, context: CallbackContext, reply: bool = True) -> State:
+    """
+    Given a text message, plans what to do with it. Then executes that plan.
+
+    `reply=False` counts a check without replying, see `quadsbot.catch_up`.
+    """
+    message = update.effective_message
+    user_id = stats_user(update).id
+    tz = user_tz(context, user_id)
+    with User(update, context) as user_info:
+        message_log.info("Handling Message from %s", user_info["username"])
+
+        with tracer.span("check"):
+            state, check_info = plan(message.date, message.forward_date, tz, message.text)
+        unique = count(user_info, state, check_info, message.date, tz)
+
+        if state == State.CHECKED and reply:
+            outbound.reply(context.bot, update.message, "Checked")
+        elif state == State.CHECK_THEN_DELETE or state == State.DELETE:
+            delete_message(context.bot, update.message.chat_id, update.message.message_id, delay=2)
+
+    history.record(message, update.effective_chat.id, user_id, user_info["username"], tz)
+
+    message_states.inc(state.name)
+    checked = state in (State.CHECKED, State.CHECK_THEN_DELETE)
+    shadow.submit(
+        message.date,
+        message.forward_date,
+        tz,
+        message.text,
+        state.name,
+        check_info[0] if checked else None,
+    )
+    context.bot_data["aggregates"].record(state.name, check_info[0] if checked else None)
+    events.record(
+        message.date,
+        update.effective_chat.id,
+        user_id,
+        state.value,
+        matcher=matcher_ids[check_info[0]] if checked else -1,
+        check_id=pack_check_id(check_info[1]) if checked else 0,
+        unique=unique,
+        tz=tz,
+    )
+    return state
@@ -0,0 +1,51 @@
+import itertools
+import logging
+from datetime import timedelta
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from quadsbot.user import stats_user, user_tz
+from quadsbot.upcoming import upcoming
+from quadsbot.handlers.message import message_handler, State
+from quadsbot.matchers import matchers
+
+default_count = 5
+max_count = 20
+
+
+def next_handler(update: Update, context: CallbackContext) -> None:
+    """
+    List the next few moments that can be checked, in the user's timezone
+    /next [n]
+    """
+    logging.info("/next call")
+
+    if update.message.chat.type != "private":
+        # Process the message as normal in a channel
+        state = message_handler(update, context)
+
+        # Only reply if the messages wouldn't be deleted
+        if state in [State.DELETE, State.CHECK_THEN_DELETE]:
+            return
+
+    count = default_count
+    if len(context.args) >= 1:
+        try:
+            count = max(1, min(int(context.args[0]), max_count))
+        except ValueError:
+            update.message.reply_text(f"Failed to parse count `{context.args[0]}`")
+            return
+
+    user_timezone = user_tz(context, stats_user(update).id)
+
+    moments = itertools.islice(upcoming(update.message.date, user_timezone, matchers), count)
+
+    message = f"<b>Next up</b> ({user_timezone})"
+    for moment in moments:
+        if moment.end - moment.start > timedelta(seconds=1):
+            when = moment.start.strftime("%a %d %b %Y %H:%M")
+        else:
+            when = moment.start.strftime("%a %d %b %Y %H:%M:%S")
+        message += f"\n{when} - {moment.message_re}"
+    update.message.reply_html(message)
@@ -0,0 +1,45 @@
+import logging
+import threading
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from quadsbot.sampler import profile_for
+
+default_seconds = 10
+max_seconds = 60
+
+# Held while profiling, so only one runs at a time
+profiling = threading.Lock()
+
+
+def profile_handler(update: Update, context: CallbackContext) -> None:
+    """
+    Profile the whole bot for a while, then reply with where the time went:
+    /profile [seconds]
+    """
+    logging.info("/profile call")
+
+    try:
+        seconds = int(context.args[0]) if context.args else default_seconds
+    except ValueError:
+        seconds = 0
+    if not 1 <= seconds <= max_seconds:
+        update.message.reply_text(f"Usage: /profile [seconds, up to {max_seconds}]")
+        return
+
+    if not profiling.acquire(blocking=False):
+        update.message.reply_text("Already profiling")
+        return
+
+    # On its own thread, so it doesn't hold up a worker while it waits
+    def run():
+        try:
+            report = profile_for(seconds)
+        finally:
+            profiling.release()
+        logging.info(report)
+        update.message.reply_text(report[:4096])
+
+    update.message.reply_text(f"Profiling for {seconds}s...")
+    threading.Thread(target=run, name="profile", daemon=True).start()
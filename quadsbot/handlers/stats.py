@@ -1,13 +1,14 @@
 import logging
-import json
 import pkgutil
 import re
+from datetime import datetime, timezone
 
 from telegram import Update
 from telegram.ext import CallbackContext
 
 from quadsbot.date_utils import get_date_strings
-from quadsbot.user import User
+from quadsbot.shadow import shadow
+from quadsbot.user import stats_user, user_tz
 
 
 version_regex = re.compile(r'''^version = "([^"]*)"''', re.MULTILINE)
@@ -24,21 +25,55 @@ def version() -> str:
         return match.group(1)
 
 
+def format_size(size: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GiB"
+
+
 def stats_handler(update: Update, context: CallbackContext) -> None:
     """
-    Output some stats
+    Output some stats.
+
+    Everything here is kept up to date as messages are handled (see
+    `quadsbot.aggregates`) or as users are written (see
+    `SQLitePersistence.count_users`), so it's quick however many users there
+    are. Use /export for all of the data.
     """
     logging.info("/stats call")
 
-    with User(update, context) as user_info:
-        user_timezone = user_info["tz"]
-        date_strings = get_date_strings(update.message.date, user_timezone)
-        bot_data = json.dumps(context.bot_data, indent=4, sort_keys=True)
+    user_timezone = user_tz(context, stats_user(update).id)
+    date_strings = get_date_strings(update.message.date, user_timezone)
+
+    aggregates = context.bot_data["aggregates"]
+
+    message_text = f"Version: {version()}"
+    message_text += f"\nDate strings: {date_strings}"
+    if aggregates.since is None:
+        message_text += "\n\nMessages:"
+    else:
+        since = datetime.fromtimestamp(aggregates.since, timezone.utc)
+        message_text += f"\n\nMessages since {since:%Y-%m-%d %H:%M} UTC:"
+    totals = aggregates.state_totals()
+    for state, total in sorted(totals.items(), key=lambda item: -item[1]):
+        message_text += f"\n  {state}: {total}"
+    if not totals:
+        message_text += " None"
+
+    message_text += "\n\nTop matchers:"
+    for message_re, total in aggregates.top_matchers(5):
+        message_text += f"\n  {total}  {message_re}"
+
+    if shadow.enabled:
+        message_text += f"\n\nCandidate matchers: {shadow.summary()}"
 
-        message_text = f"Version: {version()}"
-        message_text += f"\nDate strings: {date_strings}"
-        message_text += f"\nBot Data: {bot_data}"
+    # Count what's been written, so write everything first
+    persistence = context.dispatcher.persistence
+    context.dispatcher.update_persistence()
+    users, chats = persistence.count_users()
+    message_text += f"\n\nUsers: {users} in {chats} chats"
+    message_text += f"\nStorage: {format_size(persistence.storage_size())}"
 
-        msgs = [message_text[i : i + 4096] for i in range(0, len(message_text), 4096)]
-        for text in msgs:
-            update.message.reply_text(text)
+    update.message.reply_text(message_text)
@@ -0,0 +1,90 @@
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Iterator, NamedTuple, Optional
+
+from telegram import Message
+
+
+class HistoryMessage(NamedTuple):
+    chat_id: int
+    user_id: int
+    username: Optional[str]
+    date: datetime
+    forward_date: Optional[datetime]
+    tz: str
+    text: Optional[str]
+
+
+def from_timestamp(timestamp: Optional[int]) -> Optional[datetime]:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def read_history(filename: str) -> Iterator[HistoryMessage]:
+    """
+    The messages in a history file, one JSON object per line
+    """
+    with open(filename, encoding="utf-8") as f:
+        for line in f:
+            data = json.loads(line)
+            yield HistoryMessage(
+                data["chat_id"],
+                data["user_id"],
+                data.get("username"),
+                from_timestamp(data["date"]),
+                from_timestamp(data.get("forward_date")),
+                data["tz"],
+                data.get("text"),
+            )
+
+
+class HistoryLog:
+    """
+    Records every message that's checked, with what it was checked with (the
+    dates, the user's timezone and the text), so the stats can be rebuilt
+    from them after the matchers change, see `quadsbot.rebuild`.
+
+    This stores what people say, so does nothing unless `open` is called
+    (when HISTORY_LOG is set).
+    """
+
+    def __init__(self):
+        self._file = None
+        self._lock = threading.Lock()
+
+    def open(self, filename: str) -> None:
+        self._file = open(filename, "a", encoding="utf-8")
+        logging.info(f"Recording message history to {filename}")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def record(
+        self, message: Message, chat_id: int, user_id: int, username: Optional[str], tz: str
+    ) -> None:
+        if self._file is None:
+            return
+        forward_date = message.forward_date
+        line = json.dumps(
+            {
+                "chat_id": chat_id,
+                "user_id": user_id,
+                "username": username,
+                "date": int(message.date.timestamp()),
+                "forward_date": int(forward_date.timestamp()) if forward_date else None,
+                "tz": tz,
+                "text": message.text,
+            }
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+
+history = HistoryLog()
@@ -0,0 +1,124 @@
+import atexit
+import logging
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from typing import Optional
+
+log_format = "%(levelname)-7s %(asctime)s %(name)s %(message)s"
+
+# Records waiting to be written, past this (below WARNING) they're dropped
+# rather than making handlers wait
+max_queued = 10_000
+
+# The per-message lines (what each message was checked as etc.), these are
+# the ones worth sampling when it's busy
+message_log = logging.getLogger("quadsbot.messages")
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """
+    Puts records on a queue for a `QueueListener` thread to format and write,
+    so the handler threads never wait on the log output.
+
+    The standard `QueueHandler` formats the message before queueing it (so
+    it can be pickled to another process), this leaves it to the listener.
+    The arguments of a record mustn't be changed after logging it.
+    """
+
+    def __init__(self, queue: Queue):
+        super().__init__(queue)
+        self.dropped = 0
+        self._reported = 0.0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        # Warnings and errors are never dropped
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+            return
+
+        # Say how many were dropped, but not so often it fills the queue again
+        if self.dropped and time.monotonic() - self._reported >= 1:
+            self._reported = time.monotonic()
+            dropped, self.dropped = self.dropped, 0
+            warning = logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0, "Dropped %d log records", (dropped,), None
+            )
+            try:
+                self.queue.put_nowait(warning)
+            except Full:
+                self.dropped += dropped
+
+
+class BackgroundListener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        # Wait for room rather than failing if the queue is full when stopping
+        self.queue.put(self._sentinel)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Lets through a `sample` fraction of records below WARNING, and at most
+    `rate` of them a second (if set). Warnings and errors always get through.
+    """
+
+    def __init__(self, sample: float = 1.0, rate: Optional[float] = None):
+        super().__init__()
+        self.sample = sample
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._tokens = rate or 0.0
+        self._updated = time.monotonic()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.sample < 1 and random.random() >= self.sample:
+            return False
+        if self.rate is None:
+            return True
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+def setup_logging(
+    level: int = logging.INFO, sample: float = 1.0, rate: Optional[float] = None
+) -> BackgroundListener:
+    """
+    Log to stderr from a background thread. The per-message lines are
+    sampled, see `SampleFilter`.
+
+    The listener is stopped (writing anything still queued) on exit.
+    """
+    queue = Queue(max_queued)
+    output = logging.StreamHandler()
+    output.setFormatter(logging.Formatter(log_format))
+    listener = BackgroundListener(queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(BackgroundQueueHandler(queue))
+
+    if sample < 1 or rate is not None:
+        message_log.addFilter(SampleFilter(sample, rate))
+    return listener
@@ -0,0 +1,239 @@
+import re
+import warnings
+from typing import Optional, Tuple
+
+# The regex parser is private, so it may move or change between Python
+# versions. Without it (or if it doesn't parse a pattern the way we expect)
+# the matchers just use the regex engine, see `literal_keywords` and
+# `quadsbot.digit_pattern`.
+try:
+    # Python 3.11+ moved the regex parser under `re`
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    try:
+        with warnings.catch_warnings():
+            # The old modules are deprecated
+            warnings.simplefilter("ignore", DeprecationWarning)
+            import sre_parse
+            import sre_constants
+    except ImportError:
+        sre_parse = sre_constants = None
+
+
+def literal_keywords(pattern: str) -> Optional[Tuple[str, ...]]:
+    """
+    If the given regex only matches a fixed set of literal strings then return
+    them, otherwise return None.
+
+    "quads"                -> ("quads",)
+    r"(blaze it|blazeit)"  -> ("blaze it", "blazeit")
+    r"(pi|pie)"            -> ("pi", "pie")
+
+    Because `re.search` of such a pattern is the same as checking whether any of
+    the strings is a substring, we can skip the regex engine entirely.
+    """
+
+    def literals(parsed) -> Optional[list[str]]:
+        # Returns every string the (sub)pattern can match
+        out = [""]
+        for op, av in parsed:
+            if op is sre_constants.LITERAL:
+                out = [s + chr(av) for s in out]
+            elif op is sre_constants.SUBPATTERN:
+                inner = literals(av[-1])
+                if inner is None:
+                    return None
+                out = [s + i for s in out for i in inner]
+            elif op is sre_constants.BRANCH:
+                options = []
+                for branch in av[1]:
+                    inner = literals(branch)
+                    if inner is None:
+                        return None
+                    options += inner
+                out = [s + o for s in out for o in options]
+            else:
+                return None
+        return out
+
+    if sre_parse is None:
+        return None
+    try:
+        found = literals(sre_parse.parse(pattern))
+    except Exception:
+        # Anything from an invalid pattern to a parser that's changed shape
+        return None
+    if not found or "" in found:
+        return None
+    return tuple(found)
+
+
+def keyword_trie(keywords: set[str]) -> str:
+    """
+    A regex matching any of the keywords, the longest one where several
+    start at the same place. Shared prefixes are only matched once, e.g.
+    {"pi", "pie", "poop"} -> "p(?:i(?:e)?|oop)"
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        # Marks the end of a keyword
+        node[""] = {}
+
+    def pattern(node: dict) -> str:
+        branches = [
+            re.escape(char) + pattern(child) for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ""
+        inner = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{inner})?" if "" in node else inner
+
+    return pattern(trie)
+
+
+class KeywordScan:
+    """
+    Finds which of some matchers (matcher index -> `literal_keywords`) match
+    a text, with one scan of the text for all of their keywords
+    """
+
+    def __init__(self, matchers: dict[int, Tuple[str, ...]]):
+        keywords = {keyword for keywords in matchers.values() for keyword in keywords}
+        # The scan finds the longest keyword at each place, so each keyword
+        # found stands for the matchers of every keyword inside it too
+        self.keyword_matchers = {
+            found: frozenset(
+                matcher_idx
+                for matcher_idx, keywords in matchers.items()
+                if any(keyword in found for keyword in keywords)
+            )
+            for found in keywords
+        }
+        # The scan carries on after the end of each keyword it finds, so it
+        # can miss one that starts inside it and carries on past its end
+        # (e.g. "sexts" in "quadsexts"). found -> those keywords, when they're
+        # for other matchers, to look for separately.
+        self.overlaps = {}
+        for found, covered in self.keyword_matchers.items():
+            overlapping = tuple(
+                keyword
+                for keyword, matcher_idxs in self.keyword_matchers.items()
+                if not matcher_idxs <= covered
+                and any(keyword.startswith(found[start:]) for start in range(1, len(found)))
+            )
+            if overlapping:
+                self.overlaps[found] = overlapping
+        self.scan = re.compile(keyword_trie(keywords)) if keywords else None
+
+    def matches(self, message_text: str) -> frozenset[int]:
+        found = self.scan.findall(message_text) if self.scan is not None else None
+        if not found:
+            return frozenset()
+        matched = frozenset().union(*map(self.keyword_matchers.__getitem__, found))
+        for keyword in found:
+            for overlapping in self.overlaps.get(keyword, ()):
+                if overlapping in message_text:
+                    matched |= self.keyword_matchers[overlapping]
+        return matched
+
+
+class Matcher:
+    """
+    A single compiled entry from a matcher list
+    """
+
+    def __init__(self, date_re: str, message_re: str):
+        self.date_re = re.compile(date_re)
+        self.message_re = message_re
+        self.text_re = re.compile(message_re)
+        self.keywords = literal_keywords(message_re)
+
+    def text_matches(self, message_text: str) -> bool:
+        if self.keywords is not None:
+            return any(keyword in message_text for keyword in self.keywords)
+        return self.text_re.search(message_text) is not None
+
+
+class MatcherEngine:
+    """
+    Evaluates a list of `(date_re, message_re)` matchers against a message.
+
+    Compiles everything once up front, then per message:
+    - Makes one pass over the date digit strings to find which matchers hit
+    - Only looks at the text of the matchers whose date side hit, at most once
+      each. The matchers whose text regex is just literals are found together
+      with one scan of the text for all of their keywords (see
+      `keyword_matches`)
+
+    The result is the same as trying each matcher in order against each date
+    string in order, and taking the first one where both sides match.
+    """
+
+    def __init__(self, matchers: list[Tuple[str, str]]):
+        self.matchers = [Matcher(date_re, message_re) for (date_re, message_re) in matchers]
+
+        self.keyword_scan = KeywordScan(
+            {
+                matcher_idx: matcher.keywords
+                for matcher_idx, matcher in enumerate(self.matchers)
+                if matcher.keywords is not None
+            }
+        )
+
+    def keyword_matches(self, message_text: str) -> frozenset[int]:
+        """
+        The matchers with literal keywords whose text side matches, in one
+        pass over the text
+        """
+        return self.keyword_scan.matches(message_text)
+
+    def date_hits(self, dates: list[str]) -> list[Tuple[int, int, int]]:
+        """
+        Find every `(matcher_idx, date_idx, match_end)` where the date side of
+        the matcher matches. Ordered by matcher, then date.
+        """
+        hits = []
+        for date_idx, date_digits in enumerate(dates):
+            for matcher_idx, matcher in enumerate(self.matchers):
+                date_match = matcher.date_re.search(date_digits)
+                if date_match:
+                    hits.append((matcher_idx, date_idx, date_match.end()))
+        hits.sort()
+        return hits
+
+    def first_check(
+        self, dates: list[str], hits: list[Tuple[int, int, int]], message_text: str
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Given the `date_hits`, find the first one where the text also matches.
+        Returns `(message_re, check_id)` or None.
+
+        `message_text` must already be lowercased.
+        """
+        text_results = {}
+        # Found the first time a matcher with keywords needs it
+        keyword_matches = None
+        for (matcher_idx, date_idx, match_end) in hits:
+            matcher = self.matchers[matcher_idx]
+
+            if matcher_idx not in text_results:
+                if matcher.keywords is None:
+                    text_results[matcher_idx] = matcher.text_re.search(message_text) is not None
+                else:
+                    if keyword_matches is None:
+                        keyword_matches = self.keyword_scan.matches(message_text)
+                    text_results[matcher_idx] = matcher_idx in keyword_matches
+
+            if text_results[matcher_idx]:
+                # The id for this specific check
+                # We use the date prefix to identify when the match happened
+                # (it includes the match itself so we don't id other matches)
+                # We use the index of the date_digits to differentiate between 24
+                # and 12 hour dates
+                check_id = dates[date_idx][:match_end] + str(date_idx)
+                return matcher.message_re, check_id
+        return None
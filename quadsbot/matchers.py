@@ -0,0 +1,44 @@
+from quadsbot.day_table import DayTables
+from quadsbot.matcher_engine import MatcherEngine
+
+# Kept apart from `quadsbot.handlers.message`, so the day tables can be built
+# (see `quadsbot.startup.warm_up`) without importing the handler
+
+# A list of tuples
+# The first value is a regex matcher for the time format in `quadsbot.date_utils`
+# The second value is either a regex matcher for text contents
+#
+# The first one that matches is replied to with "Checked"
+matchers = [
+    (r"^........(.)\1{3}", "quads"),  # 2022-03-01T22:22:00
+    (r"^........(.)\1{5}", "sexts"),  # 2022-03-01T22:22:22
+    (r"^......(.)\1{7}", "octs"),  # 2022-03-22T22:22:22
+    (r"^....(.)\1{9}", "decs"),  # 2022-11-11T11:11:11
+    (r"^..(.)\1{11}", "dodecs"),  # 2011-11-11T11:11:11
+]
+
+# TODO: Remove after april fools
+joke_matchers = [
+    (r"11235?8?(13)?", "fibs"),  # 2022-03-11T23:58:13
+    (r"12345?", "incs"),  # 2022-03-11T23:45:31
+    (r"69", "sixty nine"),  # Not possible I think?
+    (r"^........0420", r"(blaze it|blazeit)"),  # 2022-03-01T04:20:00
+    (r"^........1337", r"(leet|l33t|1337)"),  # 2022-03-01T13:37:00
+    (r"^........0230", r"(tooth hurty|ow)"),  # 2022-03-01T02:30:00
+    (r"^........0002", r"(poop|poopie|number 2|no\. 2)"),  # 2022-03-01T00:02:00
+    (r"^........0001", r"(peepee|pee pee|number 1|no\. 1)"),  # 2022-03-01T00:01:00
+    (r"^........0314", r"(pi|pie)"),  # 2022-03-01T03:14:00
+]
+
+# The index of each matcher in the event log, see `quadsbot.event_log`
+matcher_ids = {
+    message_re: matcher_id
+    for matcher_id, (_, message_re) in enumerate(matchers + joke_matchers)
+}
+
+# Compiled once, see `quadsbot.matcher_engine`
+matcher_engine = MatcherEngine(matchers)
+april_fools_matcher_engine = MatcherEngine(matchers + joke_matchers)
+
+# Which matchers hit at each second of the day, see `quadsbot.day_table`
+day_tables = DayTables(matcher_engine, april_fools_matcher_engine)
@@ -1,22 +1,13 @@
-import logging
+from telegram import Bot
 
-from telegram.ext import CallbackContext
+from quadsbot.outbound import outbound
 
 
-def delete_message(context: CallbackContext) -> None:
+def delete_message(bot: Bot, chat_id: int, message_id: int, delay: float = 0) -> None:
     """
-    A job which will delete the given message
-    The context (in context.job.context) is a dict that looks like this:
-    {
-        "chat_id": 1234,
-        "message_id": 1234,
-    }
-    """
-    logging.info("Deleting delayed message")
-
-    chat_id = context.job.context["chat_id"]
-    message_id = context.job.context["message_id"]
-    logging.info(f"Chat ID: {chat_id}")
-    logging.info(f"Message ID: {message_id}")
+    Delete the given message after `delay` seconds
 
-    context.bot.delete_message(chat_id, message_id)
+    Goes through the outbound scheduler, so deletions that are due at the same
+    time are batched and this never waits on the network.
+    """
+    outbound.delete(bot, chat_id, message_id, delay)
@@ -0,0 +1,279 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+# Upper bounds (in seconds) of the latency histogram buckets
+default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Registry:
+    """
+    Metrics in the Prometheus text format.
+
+    Disabled until `enable()` is called (when METRICS_PORT is set), until
+    then recording a metric is just a check of `enabled`, and timing doesn't
+    even read the clock.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.metrics = []
+        # name -> (help, fn) read when scraped
+        self.gauges = {}
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> "Counter":
+        metric = Counter(self, name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, labels: tuple = (), buckets: tuple = default_buckets
+    ) -> "Histogram":
+        metric = Histogram(self, name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> None:
+        """
+        A gauge that's read by calling `fn` whenever it's scraped
+        """
+        self.gauges[name] = (help, fn)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for name, (help, fn) in self.gauges.items():
+            try:
+                value = fn()
+            except Exception:
+                logging.exception(f"Failed to read the {name} gauge")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, registry: Registry, name: str, help: str, labels: tuple):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # label values -> count
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, registry: Registry, name: str, help: str, labels: tuple, buckets: tuple):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count per bucket (the last is +Inf), sum]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *label_values, value: float) -> None:
+        if not self.registry.enabled:
+            return
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+
+    def time(self, *label_values):
+        """
+        Context manager observing how long its body takes
+        """
+        if not self.registry.enabled:
+            return nullcontext()
+        return self._time(label_values)
+
+    @contextmanager
+    def _time(self, label_values: tuple):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(*label_values, value=time.perf_counter() - start)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self.values.items())
+        for label_values, counts in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+metrics = Registry()
+
+# >> The bot's metrics
+
+updates = metrics.counter("quadsbot_updates_total", "Updates received")
+handler_seconds = metrics.histogram(
+    "quadsbot_handler_seconds", "Time taken to handle an update", ("handler",)
+)
+message_states = metrics.counter(
+    "quadsbot_message_states_total", "Messages handled by outcome", ("state",)
+)
+outbound_seconds = metrics.histogram(
+    "quadsbot_outbound_seconds", "Time taken by Bot API calls", ("method",)
+)
+outbound_errors = metrics.counter(
+    "quadsbot_outbound_errors_total", "Failed Bot API calls", ("method", "error")
+)
+persistence_seconds = metrics.histogram(
+    "quadsbot_persistence_write_seconds", "Time taken to write bot_data"
+)
+shadow_messages = metrics.counter(
+    "quadsbot_shadow_messages_total",
+    "Messages checked with the candidate matchers, by whether they agreed",
+    ("outcome",),
+)
+
+
+# >> Server
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    Serves the metrics at /metrics for Prometheus to scrape
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, registry: Registry = metrics):
+        super().__init__(address, MetricsRequestHandler)
+        self.registry = registry
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        logging.info(f"Serving metrics on {self.server_address}")
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    server: MetricsServer
+
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_response(HTTPStatus.NOT_FOUND)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = self.server.registry.render().encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(f"Metrics {self.client_address[0]}: {format % args}")
+
+
+def start_metrics(dispatcher, persistence, listen: str, port: int) -> MetricsServer:
+    """
+    Enable the metrics, with gauges reading from the running bot, and serve
+    them. The returned server needs stopping.
+    """
+    from telegram.ext import Handler
+
+    from quadsbot.outbound import outbound
+
+    class UpdateCounter(Handler):
+        """
+        Counts every update without handling it, handling it would make the
+        dispatcher write the persistence on its own thread
+        """
+
+        def check_update(self, update: object) -> None:
+            updates.inc()
+
+    metrics.enable()
+
+    # Sees every update before the other handlers do
+    dispatcher.add_handler(UpdateCounter(None), group=-2)
+
+    metrics.gauge(
+        "quadsbot_update_queue_depth",
+        "Updates waiting to be handled",
+        dispatcher.update_queue.qsize,
+    )
+    metrics.gauge(
+        "quadsbot_outbound_queue_depth",
+        "Replies and deletions waiting to be sent",
+        outbound.queue_depth,
+    )
+    metrics.gauge(
+        "quadsbot_job_queue_depth",
+        "Jobs scheduled on the job queue",
+        lambda: len(dispatcher.job_queue.jobs()) if dispatcher.job_queue else 0,
+    )
+    metrics.gauge(
+        "quadsbot_users",
+        "Users with stats, as last written",
+        lambda: persistence.count_users()[0],
+    )
+
+    server = MetricsServer((listen, port))
+    server.start()
+    return server
@@ -0,0 +1,53 @@
+import logging
+from collections import Counter
+
+from quadsbot.aggregates import Aggregates
+from quadsbot.persistence import SQLitePersistence
+
+# State name -> the per user total of it, see `add_aggregates`
+state_fields = {"CHECKED": "checked_total", "DELETE": "deleted", "PASS": "passed"}
+
+
+def add_aggregates(bot_data: dict, persistence: SQLitePersistence) -> None:
+    """
+    Running totals for /stats, starting from the totals every user already
+    has: CHECKED from checked_total, DELETE from deleted and PASS from passed.
+    (So a CHECK_THEN_DELETE counts as both a CHECKED and a DELETE.) There
+    aren't per user totals of each matcher, so those start from now.
+    """
+    if "aggregates" in bot_data:
+        return
+    totals = Counter()
+    for _, _, user_info in persistence.iter_records():
+        for state_name, field in state_fields.items():
+            totals[state_name] += user_info.get(field, 0)
+    # Without the states no one has had
+    bot_data["aggregates"] = Aggregates.from_totals(+totals)
+
+
+# Run in order on bot_data that's older than them, never remove or reorder
+# these. Add new ones on the end.
+# (Stats from when they were the whole of bot_data are moved under
+# "user_stats" by `SQLitePersistence.import_pickle`)
+migrations = [
+    add_aggregates,
+]
+
+
+def migrate(bot_data: dict, persistence: SQLitePersistence) -> bool:
+    """
+    Run any migrations that haven't been run on bot_data yet.
+    Returns whether any were run (so bot_data needs saving).
+
+    bot_data["schema_version"] is the number of migrations that have been
+    applied, so once it's up to date this is just one comparison.
+    """
+    version = bot_data.get("schema_version", 0)
+    if version >= len(migrations):
+        return False
+
+    for number, migration in enumerate(migrations[version:], version + 1):
+        logging.info(f"Running migration {number}: {migration.__name__}")
+        migration(bot_data, persistence)
+        bot_data["schema_version"] = number
+    return True
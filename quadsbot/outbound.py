@@ -0,0 +1,351 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, NamedTuple, Optional, Sequence
+
+from telegram import Bot, Message
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+from quadsbot.metrics import metrics, outbound_errors, outbound_seconds
+from quadsbot.tracing import tracer
+
+# Telegram allows about 20 messages a minute in a group
+chat_rate = 20 / 60
+chat_burst = 20
+
+# And about 30 requests a second overall
+global_rate = 30
+global_burst = 30
+
+# Most messages deleteMessages accepts at once
+max_bulk_delete = 100
+
+max_attempts = 5
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Set by RetryAfter, nothing is sent until then
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """
+        How long until a token is available (0 if one is available now)
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class Send(NamedTuple):
+    chat_id: int
+    text: str
+    reply_to_message_id: Optional[int] = None
+    # Delete the sent message after this many seconds
+    delete_after: Optional[float] = None
+    attempt: int = 0
+    # The (trace, span) it was sent from, see `quadsbot.tracing`
+    trace: Optional[tuple[int, int]] = None
+
+
+class FlushDeletes(NamedTuple):
+    chat_id: int
+
+
+class PendingDelete(NamedTuple):
+    due: float
+    message_id: int
+    attempt: int = 0
+    trace: Optional[tuple[int, int]] = None
+
+
+class OutboundScheduler:
+    """
+    Sends replies and deletes messages from a background thread, so handlers
+    never wait on a network round trip.
+
+    - Every call goes through a token bucket for its chat (and a global one)
+      to stay under Telegram's flood limits
+    - Deletions for the same chat that are due by the time we get to them are
+      sent as one bulk `deleteMessages` call
+    - RetryAfter pauses the chat until Telegram says to retry, and network
+      errors are retried with exponential backoff
+
+    Each call's trace span is a child of the span it was scheduled from, a
+    bulk delete links to all of theirs.
+
+    The thread is started the first time something is scheduled.
+    """
+
+    def __init__(self):
+        self.bot = None
+        self._thread = None
+        self._stopping = False
+        self._condition = threading.Condition()
+
+        # Heap of (due, seq, action)
+        self._heap = []
+        self._seq = itertools.count()
+
+        # chat_id -> [PendingDelete]
+        self._deletes = {}
+        # chat_id -> when its FlushDeletes is due, there's at most one per chat
+        self._flush_due = {}
+
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets = {}
+
+    # >> Scheduling
+
+    def reply(self, bot: Bot, message: Message, text: str) -> None:
+        self.send(bot, message.chat_id, text, reply_to_message_id=message.message_id)
+
+    def send(
+        self,
+        bot: Optional[Bot],
+        chat_id: int,
+        text: str,
+        reply_to_message_id: Optional[int] = None,
+        delete_after: Optional[float] = None,
+    ) -> None:
+        action = Send(chat_id, text, reply_to_message_id, delete_after, trace=tracer.current())
+        self._push(bot, time.monotonic(), action)
+
+    def delete(
+        self,
+        bot: Optional[Bot],
+        chat_id: int,
+        message_id: int,
+        delay: float = 0,
+        trace: Optional[tuple[int, int]] = None,
+    ) -> None:
+        due = time.monotonic() + delay
+        pending = PendingDelete(due, message_id, trace=trace or tracer.current())
+        with self._condition:
+            self._deletes.setdefault(chat_id, []).append(pending)
+            self._schedule_flush(bot, chat_id, due)
+
+    def stop(self, timeout: float = 5) -> None:
+        """
+        Send everything that's left (waiting for it to be due), then stop
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def queue_depth(self) -> int:
+        with self._condition:
+            sends = sum(isinstance(action, Send) for _, _, action in self._heap)
+            return sends + sum(len(pending) for pending in self._deletes.values())
+
+    def _push(self, bot: Optional[Bot], due: float, action) -> None:
+        with self._condition:
+            if bot is not None:
+                self.bot = bot
+            heapq.heappush(self._heap, (due, next(self._seq), action))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="outbound", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _schedule_flush(self, bot: Optional[Bot], chat_id: int, due: float) -> None:
+        """
+        Make sure the chat's deletes are flushed by `due`, must hold the lock
+        """
+        if chat_id in self._flush_due and self._flush_due[chat_id] <= due:
+            return
+        self._flush_due[chat_id] = due
+        self._push(bot, due, FlushDeletes(chat_id))
+
+    # >> Worker
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    if self._stopping and not self._heap:
+                        return
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._condition.wait(timeout)
+                due, _, action = heapq.heappop(self._heap)
+
+                if isinstance(action, FlushDeletes):
+                    if self._flush_due.get(action.chat_id) != due:
+                        # Replaced by an earlier flush
+                        continue
+                    del self._flush_due[action.chat_id]
+
+                # Wait for the flood limits
+                chat_bucket = self._chat_buckets.setdefault(
+                    action.chat_id, TokenBucket(chat_rate, chat_burst)
+                )
+                wait = max(chat_bucket.wait_time(now), self._global_bucket.wait_time(now))
+                if wait > 0:
+                    if isinstance(action, FlushDeletes):
+                        self._schedule_flush(None, action.chat_id, now + wait)
+                    else:
+                        self._push(None, now + wait, action)
+                    continue
+                chat_bucket.take()
+                self._global_bucket.take()
+
+            try:
+                if isinstance(action, Send):
+                    self._send(action)
+                else:
+                    self._flush_deletes(action.chat_id, now)
+            except Exception:
+                logging.exception("Unexpected error in the outbound scheduler")
+
+    def _send(self, action: Send) -> None:
+        try:
+            message = self._call(
+                "sendMessage",
+                self.bot.send_message,
+                action.chat_id,
+                action.text,
+                reply_to_message_id=action.reply_to_message_id,
+                traces=[action.trace],
+            )
+        except RetryAfter as e:
+            self._retry_after(action.chat_id, e.retry_after)
+            self._push(None, time.monotonic() + e.retry_after, action)
+        except BadRequest as e:
+            logging.warning(f"Failed to send message to {action.chat_id}: {e}")
+        except NetworkError as e:
+            if action.attempt + 1 < max_attempts:
+                retry = action._replace(attempt=action.attempt + 1)
+                self._push(None, time.monotonic() + 2**action.attempt, retry)
+            else:
+                logging.warning(f"Gave up sending message to {action.chat_id}: {e}")
+        else:
+            if action.delete_after is not None:
+                self.delete(
+                    None, message.chat_id, message.message_id, action.delete_after, action.trace
+                )
+
+    def _flush_deletes(self, chat_id: int, now: float) -> None:
+        with self._condition:
+            pending = self._deletes.pop(chat_id, [])
+            batch = [entry for entry in pending if entry.due <= now][:max_bulk_delete]
+            rest = [entry for entry in pending if entry not in batch]
+            if rest:
+                self._deletes[chat_id] = rest
+                self._schedule_flush(None, chat_id, min(entry.due for entry in rest))
+        if not batch:
+            return
+
+        message_ids = [entry.message_id for entry in batch]
+        traces = [entry.trace for entry in batch]
+        logging.info(f"Deleting {len(message_ids)} messages in {chat_id}")
+
+        try:
+            if len(message_ids) == 1:
+                self._call(
+                    "deleteMessage", self.bot.delete_message, chat_id, message_ids[0], traces=traces
+                )
+            else:
+                self._call(
+                    "deleteMessages", self._delete_messages, chat_id, message_ids, traces=traces
+                )
+        except RetryAfter as e:
+            self._retry_after(chat_id, e.retry_after)
+            self._requeue_deletes(chat_id, batch, e.retry_after, next_attempt=False)
+        except BadRequest as e:
+            if len(message_ids) == 1:
+                logging.warning(f"Failed to delete message in {chat_id}: {e}")
+                return
+            # Try them one by one so one bad message doesn't stop the rest
+            self._delete_one_by_one(chat_id, batch)
+        except NetworkError as e:
+            attempt = max(entry.attempt for entry in batch)
+            if attempt + 1 < max_attempts:
+                self._requeue_deletes(chat_id, batch, 2**attempt, next_attempt=True)
+            elif len(message_ids) > 1:
+                # The bulk request itself may be what fails (e.g. a proxy
+                # that drops it), so have one last go at each message
+                logging.warning(f"Deleting messages in {chat_id} one at a time: {e}")
+                self._delete_one_by_one(chat_id, batch)
+            else:
+                logging.warning(f"Gave up deleting messages in {chat_id}: {e}")
+        except TelegramError as e:
+            logging.warning(f"Failed to delete messages in {chat_id}: {e}")
+
+    def _delete_one_by_one(self, chat_id: int, batch: list) -> None:
+        for entry in batch:
+            try:
+                self._call(
+                    "deleteMessage",
+                    self.bot.delete_message,
+                    chat_id,
+                    entry.message_id,
+                    traces=[entry.trace],
+                )
+            except TelegramError as e:
+                logging.warning(f"Failed to delete message in {chat_id}: {e}")
+
+    def _delete_messages(self, chat_id: int, message_ids: list[int]) -> None:
+        """
+        Not wrapped by this version of python-telegram-bot, so it's posted
+        with the bot's request object, which sends the message_ids as a JSON
+        string like any other list. A Bot API server without it raises
+        BadRequest, so they're deleted one at a time instead.
+        """
+        self.bot.request.post(
+            f"{self.bot.base_url}/deleteMessages",
+            {"chat_id": chat_id, "message_ids": message_ids},
+        )
+
+    def _call(self, method: str, fn: Callable, *args, traces: Sequence = (), **kwargs):
+        """
+        Call the Bot API with `fn`, recording metrics as `method`. `traces`
+        are the (trace, span) of what it's for, see `quadsbot.tracing`.
+        """
+        traces = list(dict.fromkeys(trace for trace in traces if trace is not None))
+        parent = traces[0] if len(traces) == 1 else None
+        links = traces if len(traces) > 1 else ()
+        with tracer.span(method, parent=parent, links=links, chat_id=args[0]):
+            if not metrics.enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except TelegramError as e:
+                outbound_errors.inc(method, type(e).__name__)
+                raise
+            finally:
+                outbound_seconds.observe(method, value=time.perf_counter() - start)
+
+    def _requeue_deletes(self, chat_id: int, batch: list, delay: float, next_attempt: bool) -> None:
+        due = time.monotonic() + delay
+        with self._condition:
+            pending = self._deletes.setdefault(chat_id, [])
+            for entry in batch:
+                pending.append(entry._replace(due=due, attempt=entry.attempt + next_attempt))
+            self._schedule_flush(None, chat_id, due)
+
+    def _retry_after(self, chat_id: int, retry_after: float) -> None:
+        logging.warning(f"Flood limit hit in {chat_id}, waiting {retry_after}s")
+        bucket = self._chat_buckets[chat_id]
+        bucket.blocked_until = time.monotonic() + retry_after
+
+
+outbound = OutboundScheduler()
@@ -0,0 +1,766 @@
+import itertools
+import logging
+import os
+import pathlib
+import pickle
+import sqlite3
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import nullcontext
+from typing import Callable, Iterator, Optional
+
+from telegram.ext import BasePersistence
+
+from quadsbot.metrics import persistence_seconds
+from quadsbot.rank_index import score_field
+from quadsbot.tracing import tracer
+from quadsbot.user import UserRecord, default_tz, user_lock
+
+
+class UserStats(dict):
+    """
+    A dict for bot_data["user_stats"] that remembers which users have been
+    changed since the last write, so only they need saving.
+
+    NOTE: Changes made inside a record (e.g. `user_info["passed"] += 1`) aren't
+    seen unless the record is assigned back, which `User.__exit__` always does.
+
+    Also holds the chat's `RankIndex` once the leaderboard has been used.
+    Removing users throws it away to be rebuilt.
+
+    With `cold` set only some of the users are in memory, the rest are loaded
+    from it the first time they're looked up. So `in`, `len` and iterating
+    only see the users in memory.
+    """
+
+    def __init__(self, *args, cold: Optional["ColdUsers"] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dirty = set()
+        self.rank_index = None
+        self.cold = cold
+        # Set when the users that aren't in memory have been cleared too
+        self.cleared = False
+
+    def __missing__(self, key):
+        user_info = self.cold.load(key) if self.cold is not None else None
+        if user_info is None:
+            raise KeyError(key)
+        self.cold.touch(key)
+        # Another thread may have loaded (and changed) it while we did
+        return super().setdefault(key, user_info)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.dirty.add(key)
+        if self.cold is not None:
+            self.cold.touch(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.dirty.add(key)
+        self.rank_index = None
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.dirty.add(key)
+        return super().setdefault(key, default)
+
+    def pop(self, key, *args):
+        if self.cold is not None and not super().__contains__(key):
+            self.get(key)
+        self.dirty.add(key)
+        self.rank_index = None
+        return super().pop(key, *args)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.dirty.add(key)
+        self.rank_index = None
+        return key, value
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        super().update(other)
+        self.dirty.update(other)
+
+    def clear(self):
+        self.dirty.update(self)
+        self.rank_index = None
+        self.cleared = self.cold is not None
+        super().clear()
+
+    def evict(self, key) -> None:
+        """
+        Drop a user from memory, they must have been written first
+        """
+        super().pop(key, None)
+
+
+class ColdUsers:
+    """
+    Where a chat's users that haven't been used for a while are kept (their
+    rows in the database), see `SQLitePersistence.evict_cold`.
+
+    No chat_id is the unclaimed users, which are only ever loaded to be
+    removed so aren't tracked.
+    """
+
+    def __init__(self, persistence: "SQLitePersistence", chat_id: Optional[int]):
+        self.persistence = persistence
+        self.chat_id = chat_id
+
+    def load(self, user_id: int):
+        return self.persistence.read_user(self.chat_id, user_id)
+
+    def summary(self) -> dict[int, tuple[int, Optional[str]]]:
+        return self.persistence.read_summary(self.chat_id)
+
+    def touch(self, user_id: int) -> None:
+        if self.chat_id is not None:
+            self.persistence.hot.touch((self.chat_id, user_id))
+
+
+class HotUsers:
+    """
+    The (chat_id, user_id) of the users in memory, least recently used first
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._order = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def touch(self, key: tuple[int, int]) -> None:
+        with self._lock:
+            self._order[key] = None
+            self._order.move_to_end(key)
+
+    def discard(self, key: tuple[int, int]) -> None:
+        with self._lock:
+            self._order.pop(key, None)
+
+    def coldest(self) -> list[tuple[int, int]]:
+        """
+        The users over capacity, least recently used first
+        """
+        with self._lock:
+            over = len(self._order) - self.capacity
+            return list(itertools.islice(self._order, over)) if over > 0 else []
+
+
+class ChatStats(dict):
+    """
+    A dict for bot_data["chat_stats"] of chat_id -> UserStats.
+
+    Each chat's stats are a separate shard that's only loaded (using `load`)
+    the first time the chat is used, so iterating only sees the loaded chats.
+    """
+
+    def __init__(self, load: Optional[Callable[[int], UserStats]] = None):
+        super().__init__()
+        self.load = load
+        self._lock = threading.Lock()
+        # Set when everything (including the unloaded chats) has been cleared
+        self.cleared = False
+
+    def __missing__(self, chat_id: int) -> UserStats:
+        with self._lock:
+            # Another thread may have loaded it while we waited
+            if chat_id in self:
+                return super().__getitem__(chat_id)
+            shard = self.load(chat_id) if self.load else UserStats()
+            super().__setitem__(chat_id, shard)
+            return shard
+
+    def clear(self):
+        super().clear()
+        self.cleared = True
+
+
+class Timezones(dict):
+    """
+    A dict for bot_data["timezones"] of user_id -> the timezone they've set,
+    which is the same in every chat. Users who haven't set one aren't in it.
+
+    Remembers which users have changed since the last write, like
+    `UserStats`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dirty = set()
+
+    def __setitem__(self, user_id, tz):
+        super().__setitem__(user_id, tz)
+        self.dirty.add(user_id)
+
+    def __delitem__(self, user_id):
+        super().__delitem__(user_id)
+        self.dirty.add(user_id)
+
+    def update(self, *args, **kwargs):
+        other = dict(*args, **kwargs)
+        super().update(other)
+        self.dirty.update(other)
+
+
+def record_tz(user_info: dict) -> Optional[str]:
+    """
+    The timezone set in an imported record (from before timezones were per
+    user), if it's not the default
+    """
+    tz = user_info.get("tz")
+    return tz if tz and tz != default_tz else None
+
+
+def as_dict(user_info) -> dict:
+    """
+    A stored user as a plain dict, old rows can still hold dicts rather
+    than `UserRecord`s
+    """
+    if not isinstance(user_info, UserRecord):
+        user_info = UserRecord.from_dict(user_info)
+    return user_info.to_dict()
+
+
+def summarise(user_info) -> tuple[int, Optional[str]]:
+    """
+    (score, username) of a stored user, for the leaderboard
+    """
+    return user_info.get(score_field, 0), user_info.get("username")
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Stores bot_data in an SQLite database.
+
+    Each user in each chat of bot_data["chat_stats"] is their own row, so
+    after an update only the users that changed are written rather than the
+    whole of bot_data. Every write is a single transaction so a crash can't
+    leave a half written file behind.
+
+    The rows are clustered by chat, and users are only loaded when they're
+    first used. At most `hot_users` are kept in memory, after a write the
+    least recently used are dropped until they're next used (see
+    `evict_cold`). So memory doesn't grow with everyone who has ever posted.
+
+    Each row also has the user's score and username, so the leaderboard can
+    rank everyone without loading them (see `read_summary`).
+
+    bot_data["user_stats"] holds the stats from before they were per chat,
+    see `quadsbot.user.User`. Timezones are per user rather than per chat, in
+    bot_data["timezones"] (see `Timezones`).
+
+    The other (small) bot_data keys are stored in their own table.
+
+    If the database is empty and `import_from` points to a `PicklePersistence`
+    file, then its bot_data is imported on startup.
+
+    With `read_only` the database is opened read only (e.g. while the bot is
+    using it, see `quadsbot.rebuild`), so it must already exist.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        import_from: Optional[str] = None,
+        hot_users: int = 10_000,
+        read_only: bool = False,
+    ):
+        super().__init__(store_user_data=False, store_chat_data=False, store_bot_data=True)
+
+        # BasePersistence wraps the get/update methods to deep copy the data
+        # while replacing Bot instances. We never store a Bot and want to keep
+        # the same UserStats object, so use the methods directly.
+        for name in ("get_bot_data", "update_bot_data"):
+            self.__dict__.pop(name, None)
+
+        self.filename = filename
+        self.import_from = import_from
+        self.read_only = read_only
+        self.bot_data = None
+
+        # Values of the other bot_data keys, as last written
+        self._written = {}
+        # See `defer_write`, set while there are changes that haven't been written
+        self.deferred = False
+        self._defer = threading.local()
+        self.hot = HotUsers(hot_users)
+
+        self._lock = threading.Lock()
+        self._connection = self.connect()
+        # Read only databases are used as they are
+        if not read_only:
+            self.create_tables()
+
+        # chat_id (None for the unclaimed users) -> users, as last written.
+        # Counted once here, then kept up to date by each write so
+        # `count_users` doesn't need the database.
+        self._chat_users = self.read_user_counts()
+        self._users = sum(self._chat_users.values())
+
+        # Users are loaded while handlers hold their lock, which `write_users`
+        # takes while holding `_lock`. So they're read with their own
+        # connection, which also doesn't wait for writes.
+        self._read_lock = threading.Lock()
+        self._reader = self.connect()
+        # Ranking every chat (see `read_rankings`) takes a while, so it has
+        # its own connection too rather than holding up loading users
+        self._rank_lock = threading.Lock()
+        self._ranker = self.connect()
+
+    def connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            uri = f"{pathlib.Path(self.filename).absolute().as_uri()}?mode=ro"
+            return sqlite3.connect(uri, uri=True, check_same_thread=False)
+        return sqlite3.connect(self.filename, check_same_thread=False)
+
+    def create_tables(self) -> None:
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS user_stats (user_id INTEGER PRIMARY KEY, record BLOB)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS chat_stats ("
+                "chat_id INTEGER, user_id INTEGER, record BLOB, "
+                "score INTEGER NOT NULL DEFAULT 0, username TEXT, "
+                "PRIMARY KEY (chat_id, user_id)"
+                ") WITHOUT ROWID"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS timezones ("
+                "user_id INTEGER PRIMARY KEY, tz TEXT NOT NULL"
+                ")"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS bot_data (key TEXT PRIMARY KEY, value BLOB)"
+            )
+
+    # >> bot_data
+
+    def get_bot_data(self) -> dict:
+        if self.bot_data is not None:
+            return self.bot_data
+
+        with self._lock:
+            if (
+                not self.read_only
+                and self.is_empty()
+                and self.import_from
+                and os.path.exists(self.import_from)
+            ):
+                self.import_pickle(self.import_from)
+
+            unclaimed = self._chat_users.get(None, 0)
+            user_stats = UserStats(cold=ColdUsers(self, None))
+
+            bot_data = {}
+            for key, value in self._connection.execute("SELECT key, value FROM bot_data"):
+                bot_data[key] = pickle.loads(value)
+                self._written[key] = value
+            bot_data["user_stats"] = user_stats
+            bot_data["chat_stats"] = ChatStats(self.load_chat)
+            # Only the users who've set one, so there aren't many
+            bot_data["timezones"] = Timezones(
+                self._connection.execute("SELECT user_id, tz FROM timezones")
+            )
+
+        logging.info(f"Opened {self.filename}, with {unclaimed} unclaimed users")
+        self.bot_data = bot_data
+        return bot_data
+
+    def load_chat(self, chat_id: int) -> UserStats:
+        # Its users are loaded as they're used
+        return UserStats(cold=ColdUsers(self, chat_id))
+
+    def update_bot_data(self, data: dict) -> None:
+        if getattr(self._defer, "next", False):
+            self._defer.next = False
+            self.bot_data = data
+            self.deferred = True
+            return
+        self.write_bot_data(data)
+
+    def write_bot_data(self, data: dict) -> None:
+        with self._lock, persistence_seconds.time(), tracer.span("persistence"):
+            # chat_id -> change in users, only counted once it's committed
+            added = Counter()
+            with self._connection:
+                self.deferred = False
+                user_stats = data.get("user_stats")
+                if not isinstance(user_stats, UserStats):
+                    # It's been replaced, so write all of it
+                    user_stats = UserStats(user_stats or {})
+                    user_stats.dirty.update(user_stats)
+                    data["user_stats"] = user_stats
+                    self._connection.execute("DELETE FROM user_stats")
+                    added[None] -= self._chat_users.get(None, 0)
+                elif user_stats.cleared:
+                    self._connection.execute("DELETE FROM user_stats")
+                    added[None] -= self._chat_users.get(None, 0)
+                    user_stats.cleared = False
+
+                added[None] += self.write_users(user_stats)
+
+                chat_stats = data.get("chat_stats")
+                if chat_stats.cleared:
+                    self._connection.execute("DELETE FROM chat_stats")
+                    for chat_id, users in self._chat_users.items():
+                        if chat_id is not None:
+                            added[chat_id] -= users
+                    chat_stats.cleared = False
+                for chat_id, shard in list(chat_stats.items()):
+                    added[chat_id] += self.write_users(shard, chat_id)
+
+                self.write_timezones(data.get("timezones"))
+
+                for key, value in data.items():
+                    if key in ("user_stats", "chat_stats", "timezones"):
+                        continue
+                    value = pickle.dumps(value)
+                    if self._written.get(key) != value:
+                        self._connection.execute(
+                            "INSERT OR REPLACE INTO bot_data (key, value) VALUES (?, ?)",
+                            (key, value),
+                        )
+                        self._written[key] = value
+                for key in set(self._written) - set(data):
+                    self._connection.execute("DELETE FROM bot_data WHERE key = ?", (key,))
+                    del self._written[key]
+
+            self.bot_data = data
+            self.count_added(added)
+            # After the commit, and before another write can take users out of
+            # `dirty` without having written them yet
+            self.evict_cold(chat_stats)
+
+    def count_added(self, added: Counter) -> None:
+        """
+        Update the user counts with the (committed) changes from a write, must
+        hold `_lock`
+        """
+        for chat_id, change in added.items():
+            if not change:
+                continue
+            users = self._chat_users.get(chat_id, 0) + change
+            if users:
+                self._chat_users[chat_id] = users
+            else:
+                self._chat_users.pop(chat_id, None)
+            self._users += change
+
+    def write_users(self, user_stats: UserStats, chat_id: Optional[int] = None) -> int:
+        """
+        Write the dirty users of a chat (or the unclaimed users if no chat_id),
+        must be called inside a transaction. Returns the change in how many
+        users there are.
+
+        The users that are already there are updated first, so the rows that
+        are then inserted are the new users.
+        """
+        upserts = []
+        deletes = []
+        # Handlers may be marking users dirty as we go, popping means any we
+        # miss are still there for the next write
+        while user_stats.dirty:
+            user_id = user_stats.dirty.pop()
+            # Don't pickle a record while a handler is halfway through it
+            # (unclaimed users are only ever removed, so need no lock)
+            lock = nullcontext() if chat_id is None else user_lock(chat_id, user_id)
+            with lock:
+                if user_id in user_stats:
+                    user_info = user_stats[user_id]
+                    upserts.append((user_id, pickle.dumps(user_info), *summarise(user_info)))
+                else:
+                    deletes.append((user_id,))
+
+        if chat_id is None:
+            self._connection.executemany(
+                "UPDATE user_stats SET record = ? WHERE user_id = ?",
+                [(record, user_id) for user_id, record, *_ in upserts],
+            )
+            inserted = self._connection.executemany(
+                "INSERT OR IGNORE INTO user_stats (user_id, record) VALUES (?, ?)",
+                [(user_id, record) for user_id, record, *_ in upserts],
+            )
+            deleted = self._connection.executemany(
+                "DELETE FROM user_stats WHERE user_id = ?", deletes
+            )
+        else:
+            self._connection.executemany(
+                "UPDATE chat_stats SET record = ?, score = ?, username = ? "
+                "WHERE chat_id = ? AND user_id = ?",
+                [(record, *summary, chat_id, user_id) for user_id, record, *summary in upserts],
+            )
+            inserted = self._connection.executemany(
+                "INSERT OR IGNORE INTO chat_stats (chat_id, user_id, record, score, username) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(chat_id, *upsert) for upsert in upserts],
+            )
+            deleted = self._connection.executemany(
+                "DELETE FROM chat_stats WHERE chat_id = ? AND user_id = ?",
+                [(chat_id, user_id) for (user_id,) in deletes],
+            )
+        return inserted.rowcount - deleted.rowcount
+
+    def write_timezones(self, timezones: Optional[Timezones]) -> None:
+        """
+        Write the timezones that have changed, must be called inside a
+        transaction
+        """
+        if timezones is None:
+            return
+        upserts = []
+        deletes = []
+        while timezones.dirty:
+            user_id = timezones.dirty.pop()
+            tz = timezones.get(user_id)
+            if tz is None:
+                deletes.append((user_id,))
+            else:
+                upserts.append((user_id, tz))
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO timezones (user_id, tz) VALUES (?, ?)", upserts
+        )
+        self._connection.executemany("DELETE FROM timezones WHERE user_id = ?", deletes)
+
+    # >> Hot and cold users
+
+    def evict_cold(self, chat_stats: ChatStats) -> None:
+        """
+        Drop the least recently used users from memory until there are at
+        most `hot.capacity`. Ones that are being used or haven't been written
+        yet are skipped, and go next time. Must hold the lock.
+        """
+        for key in self.hot.coldest():
+            chat_id, user_id = key
+            shard = dict.get(chat_stats, chat_id)
+            lock = user_lock(chat_id, user_id)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                if shard is not None and user_id in shard.dirty:
+                    continue
+                if shard is not None:
+                    shard.evict(user_id)
+                self.hot.discard(key)
+            finally:
+                lock.release()
+
+    def read_user(self, chat_id: Optional[int], user_id: int):
+        """
+        A user as last written (None if they never were), with no chat_id for
+        an unclaimed user
+        """
+        with self._read_lock:
+            if chat_id is None:
+                row = self._reader.execute(
+                    "SELECT record FROM user_stats WHERE user_id = ?", (user_id,)
+                ).fetchone()
+            else:
+                row = self._reader.execute(
+                    "SELECT record FROM chat_stats WHERE chat_id = ? AND user_id = ?",
+                    (chat_id, user_id),
+                ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def read_summary(self, chat_id: int) -> dict[int, tuple[int, Optional[str]]]:
+        """
+        user_id -> (score, username) of everyone in a chat as last written
+        """
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT user_id, score, username FROM chat_stats WHERE chat_id = ?", (chat_id,)
+            ).fetchall()
+        return {user_id: (score, username) for user_id, score, username in rows}
+
+    def read_rankings(self, top_n: int) -> dict[int, tuple[int, int, list]]:
+        """
+        chat_id -> (users, checks, [(score, user_id, username)] of the top
+        `top_n`) of every chat as last written, see `quadsbot.snapshot`
+        """
+        rankings = {}
+        with self._rank_lock:
+            rows = self._ranker.execute(
+                "SELECT chat_id, users, checks, score, user_id, username FROM ("
+                "SELECT chat_id, user_id, score, username, "
+                "ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY score DESC, user_id) AS place, "
+                "COUNT(*) OVER (PARTITION BY chat_id) AS users, "
+                "SUM(score) OVER (PARTITION BY chat_id) AS checks "
+                "FROM chat_stats"
+                ") WHERE place <= ? ORDER BY chat_id, place",
+                (top_n,),
+            ).fetchall()
+        for chat_id, users, checks, score, user_id, username in rows:
+            if chat_id not in rankings:
+                rankings[chat_id] = (users, checks, [])
+            rankings[chat_id][2].append((score, user_id, username))
+        return rankings
+
+    def data_version(self) -> int:
+        """
+        Changes whenever something has been written, for `read_rankings`
+        """
+        with self._rank_lock:
+            return self._ranker.execute("PRAGMA data_version").fetchone()[0]
+
+    # >> Deferring writes
+
+    def defer_write(self) -> None:
+        """
+        Only keep bot_data in memory the next time it's updated from this
+        thread, until `write_deferred` (or any other write, which writes
+        everything that's changed). Updates from other threads are written
+        as usual.
+        """
+        self._defer.next = True
+
+    def write_deferred(self) -> None:
+        if self.bot_data is not None:
+            self.write_bot_data(self.bot_data)
+
+    def flush(self) -> None:
+        # Stopping, so write anything that's been deferred
+        if self.deferred:
+            self.write_deferred()
+        with self._lock:
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # >> Reading
+
+    def storage_size(self) -> int:
+        """
+        Size of the database on disk in bytes, including the WAL
+        """
+        paths = (self.filename, self.filename + "-wal", self.filename + "-shm")
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+    def count_users(self) -> tuple[int, int]:
+        """
+        The number of (users, chats) as last written, not counting unclaimed
+        users as a chat. Kept up to date as they're written, so doesn't wait
+        for the lock (e.g. on every metrics scrape).
+        """
+        return self._users, len(self._chat_users) - (None in self._chat_users)
+
+    def read_user_counts(self) -> dict[Optional[int], int]:
+        """
+        chat_id (None for the unclaimed users) -> users, from the database
+        """
+        with self._lock:
+            counts = dict(
+                self._connection.execute(
+                    "SELECT chat_id, COUNT(*) FROM chat_stats GROUP BY chat_id"
+                )
+            )
+            (unclaimed,) = self._connection.execute("SELECT COUNT(*) FROM user_stats").fetchone()
+        if unclaimed:
+            counts[None] = unclaimed
+        return counts
+
+    def iter_records(self, chunk_size: int = 500) -> Iterator[tuple[Optional[int], int, dict]]:
+        """
+        Every user as last written, as `(chat_id, user_id, user_info)`, with
+        a chat_id of None for unclaimed users.
+
+        Only `chunk_size` rows are read at a time, and the lock is only held
+        while reading them, so handlers aren't held up for long.
+        """
+        after = (None, None)
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT chat_id, user_id, record FROM chat_stats "
+                    "WHERE ? IS NULL OR (chat_id, user_id) > (?, ?) "
+                    "ORDER BY chat_id, user_id LIMIT ?",
+                    (after[0], *after, chunk_size),
+                ).fetchall()
+            if not rows:
+                break
+            for chat_id, user_id, record in rows:
+                yield chat_id, user_id, as_dict(pickle.loads(record))
+            after = rows[-1][:2]
+
+        after = None
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT user_id, record FROM user_stats WHERE ? IS NULL OR user_id > ? "
+                    "ORDER BY user_id LIMIT ?",
+                    (after, after, chunk_size),
+                ).fetchall()
+            if not rows:
+                break
+            for user_id, record in rows:
+                yield None, user_id, as_dict(pickle.loads(record))
+            after = rows[-1][0]
+
+    # >> Importing
+
+    def is_empty(self) -> bool:
+        for table in ("user_stats", "chat_stats", "bot_data"):
+            if self._connection.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return False
+        return True
+
+    def import_pickle(self, filename: str) -> None:
+        """
+        One time import of the bot_data from a (single file) PicklePersistence
+        """
+        logging.info(f"Importing bot_data from {filename}")
+
+        with open(filename, "rb") as f:
+            bot_data = pickle.load(f).get("bot_data", {})
+
+        # The oldest versions stored the user stats as the whole of bot_data
+        if "user_stats" not in bot_data:
+            bot_data = {"user_stats": bot_data}
+
+        with self._connection:
+            user_stats = UserStats(bot_data.pop("user_stats"))
+            user_stats.dirty.update(user_stats)
+            added = Counter({None: self.write_users(user_stats)})
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO timezones (user_id, tz) VALUES (?, ?)",
+                [
+                    (user_id, record_tz(user_info))
+                    for user_id, user_info in user_stats.items()
+                    if record_tz(user_info)
+                ],
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO bot_data (key, value) VALUES (?, ?)",
+                [(key, pickle.dumps(value)) for key, value in bot_data.items()],
+            )
+        self.count_added(added)
+
+    # >> Unused
+
+    def get_user_data(self) -> defaultdict:
+        return defaultdict(dict)
+
+    def get_chat_data(self) -> defaultdict:
+        return defaultdict(dict)
+
+    def get_conversations(self, name: str) -> dict:
+        return {}
+
+    def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        pass
+
+    def update_user_data(self, user_id: int, data: dict) -> None:
+        pass
+
+    def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
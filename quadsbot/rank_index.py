@@ -0,0 +1,79 @@
+import bisect
+import threading
+from typing import Callable, Optional, Tuple
+
+score_field = "checked_unique"
+
+
+class RankIndex:
+    """
+    The users of a chat, kept sorted by score so the leaderboard doesn't need
+    to sort everyone on every call.
+
+    Ties are ordered by user id.
+
+    `summary` is the (score, username) of users that aren't in `user_stats`,
+    e.g. ones that are only on disk.
+
+    Also caches the rendered leaderboard, which is thrown away whenever a
+    score or username changes.
+
+    Safe to use from multiple threads.
+    """
+
+    def __init__(self, user_stats: dict, summary: Optional[dict] = None):
+        # user_id -> (score, username)
+        self.entries = dict(summary or {})
+        self.entries.update(
+            (user_id, (user_info.get(score_field, 0), user_info.get("username")))
+            for user_id, user_info in user_stats.items()
+        )
+        # Sorted list of (-score, user_id)
+        self.order = sorted((-score, user_id) for user_id, (score, _) in self.entries.items())
+        # top_n -> rendered message
+        self.rendered = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def update(self, user_id: int, score: int, username: str) -> None:
+        entry = (score, username)
+        with self._lock:
+            old = self.entries.get(user_id)
+            if old == entry:
+                return
+
+            if old is not None and old[0] != score:
+                self.order.pop(bisect.bisect_left(self.order, (-old[0], user_id)))
+            if old is None or old[0] != score:
+                bisect.insort(self.order, (-score, user_id))
+
+            self.entries[user_id] = entry
+            self.rendered.clear()
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """
+        The 1-indexed place of the user, or None if they aren't in the chat
+        """
+        with self._lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            return bisect.bisect_left(self.order, (-entry[0], user_id)) + 1
+
+    def top(self, n: int) -> list[Tuple[int, str]]:
+        """
+        The (score, username) of the top `n` users
+        """
+        with self._lock:
+            return [self.entries[user_id] for _, user_id in self.order[:n]]
+
+    def render(self, n: int, render: Callable[[list[Tuple[int, str]]], str]) -> str:
+        """
+        `render(self.top(n))`, cached until the top changes
+        """
+        with self._lock:
+            if n not in self.rendered:
+                self.rendered[n] = render(self.top(n))
+            return self.rendered[n]
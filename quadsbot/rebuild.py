@@ -0,0 +1,223 @@
+"""
+Rebuild the stats from a recorded message history (see HISTORY_LOG), by
+checking every message again with the current matchers.
+
+The messages are split up by user between processes, and the result is
+written to a new database along with a report of what changed:
+
+```bash
+$ poetry run python -m quadsbot.rebuild history.jsonl rebuilt.sqlite3 --current stats.sqlite3
+```
+
+`--current` is the database in use now (which is only read, so it can be
+while the bot is running), the report compares against it and its other
+settings (e.g. the admin) are copied over. The totals for /stats are counted
+again from the history.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from quadsbot.aggregates import Aggregates
+from quadsbot.handlers.message import State, count, plan
+from quadsbot.history import read_history
+from quadsbot.persistence import SQLitePersistence
+from quadsbot.user import UserRecord, default_tz
+
+# The stats that are compared in the report
+compared = ("checked_total", "checked_unique", "deleted", "passed", "messages_total")
+
+
+def split(history_file: str, directory: str, partitions: int) -> list[str]:
+    """
+    Split the history into a file per partition, with all of a user's
+    messages (in order) in the same one
+    """
+    paths = [os.path.join(directory, f"{partition}.jsonl") for partition in range(partitions)]
+    files = [open(path, "w", encoding="utf-8") for path in paths]
+    try:
+        with open(history_file, encoding="utf-8") as f:
+            for line in f:
+                data = json.loads(line)
+                files[hash((data["chat_id"], data["user_id"])) % partitions].write(line)
+    finally:
+        for file in files:
+            file.close()
+    return paths
+
+
+def replay(
+    path: str,
+) -> tuple[dict[tuple[int, int], UserRecord], dict[int, tuple], Aggregates]:
+    """
+    The stats of every (chat_id, user_id) from a partition of the history,
+    the (date, timezone) of each user's last message in it, and the totals
+    of its messages for /stats
+    """
+    # Every message is logged, which would be most of the time spent
+    logging.disable(logging.CRITICAL)
+
+    users = {}
+    timezones = {}
+    aggregates = Aggregates(since=time.time())
+    for message in read_history(path):
+        key = (message.chat_id, message.user_id)
+        user_info = users.get(key)
+        if user_info is None:
+            user_info = users[key] = UserRecord()
+        user_info.username = message.username
+        # A user's messages are in order
+        timezones[message.user_id] = (message.date, message.tz)
+
+        state, check_info = plan(message.date, message.forward_date, message.tz, message.text)
+        count(user_info, state, check_info, message.date, message.tz)
+        checked = state in (State.CHECKED, State.CHECK_THEN_DELETE)
+        aggregates.record(state.name, check_info[0] if checked else None)
+        aggregates.since = min(aggregates.since, message.date.timestamp())
+    return users, timezones, aggregates
+
+
+def rebuild(
+    history_file: str, processes: Optional[int] = None
+) -> tuple[dict, dict, Aggregates]:
+    """
+    The rebuilt stats of every (chat_id, user_id), the timezone each user's
+    last message was checked with, and the totals for /stats since the
+    first message
+    """
+    processes = processes or os.cpu_count()
+    with tempfile.TemporaryDirectory() as directory:
+        # More partitions than processes, so one big one doesn't hold up the end
+        paths = split(history_file, directory, processes * 4)
+        users = {}
+        timezones = {}
+        aggregates = Aggregates()
+        with ProcessPoolExecutor(processes) as pool:
+            for partition, partition_timezones, partition_aggregates in pool.map(replay, paths):
+                users.update(partition)
+                for user_id, last in partition_timezones.items():
+                    timezones[user_id] = max(timezones.get(user_id, last), last)
+                aggregates.since = min(aggregates.since, partition_aggregates.since)
+                aggregates.states.update(partition_aggregates.states)
+                aggregates.matchers.update(partition_aggregates.matchers)
+    return users, {user_id: tz for user_id, (_, tz) in timezones.items()}, aggregates
+
+
+def write_snapshot(
+    users: dict,
+    timezones: dict,
+    aggregates: Aggregates,
+    filename: str,
+    current: Optional[SQLitePersistence],
+) -> None:
+    persistence = SQLitePersistence(filename)
+    bot_data = persistence.get_bot_data()
+    bot_data["aggregates"] = aggregates
+    for user_id, tz in timezones.items():
+        if tz != default_tz:
+            bot_data["timezones"][user_id] = tz
+    if current is not None:
+        for key, value in current.get_bot_data().items():
+            if key == "timezones":
+                # What users have set now wins over their history
+                bot_data["timezones"].update(value)
+            elif key not in ("user_stats", "chat_stats", "aggregates"):
+                bot_data[key] = value
+    for (chat_id, user_id), user_info in users.items():
+        bot_data["chat_stats"][chat_id][user_id] = user_info
+    persistence.update_bot_data(bot_data)
+    persistence.flush()
+
+
+def report(users: dict, current: SQLitePersistence, report_file: Optional[str]) -> None:
+    """
+    Print how the rebuilt stats differ from the current ones, and write the
+    users that changed to `report_file` as CSV
+    """
+    totals = {field: [0, 0] for field in compared}
+    changed = added = removed = 0
+    seen = set()
+
+    writer = None
+    if report_file:
+        f = open(report_file, "w", newline="", encoding="utf-8")
+        writer = csv.writer(f)
+        writer.writerow(
+            ["chat_id", "user_id", "username"]
+            + [f"{field}_{which}" for field in compared for which in ("current", "rebuilt")]
+        )
+
+    def write(chat_id, user_id, username, before: dict, after: dict) -> None:
+        if writer is not None:
+            values = [value for field in compared for value in (before[field], after[field])]
+            writer.writerow([chat_id, user_id, username] + values)
+
+    empty = {field: 0 for field in compared}
+    for chat_id, user_id, before in current.iter_records():
+        if chat_id is None:
+            # Unclaimed users aren't in any chat's history
+            continue
+        seen.add((chat_id, user_id))
+        user_info = users.get((chat_id, user_id))
+        after = user_info.to_dict() if user_info else empty
+        if user_info is None:
+            removed += 1
+        for field in compared:
+            totals[field][0] += before[field]
+            totals[field][1] += after[field]
+        if any(before[field] != after[field] for field in compared):
+            changed += user_info is not None
+            write(chat_id, user_id, before["username"], before, after)
+
+    for (chat_id, user_id), user_info in users.items():
+        if (chat_id, user_id) in seen:
+            continue
+        added += 1
+        after = user_info.to_dict()
+        for field in compared:
+            totals[field][1] += after[field]
+        write(chat_id, user_id, user_info.username, empty, after)
+
+    if writer is not None:
+        f.close()
+
+    print(f"{changed} users changed, {added} added, {removed} not in the history")
+    print(f"{'':<16}{'current':>12}{'rebuilt':>12}{'change':>12}")
+    for field, (before, after) in totals.items():
+        print(f"{field:<16}{before:>12}{after:>12}{after - before:>+12}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("history", help="The message history, from HISTORY_LOG")
+    parser.add_argument("output", help="The database to write the rebuilt stats to")
+    parser.add_argument("--current", help="The database in use now, to compare against")
+    parser.add_argument("--report", help="Write the users that changed to this CSV file")
+    parser.add_argument("--processes", type=int, help="Defaults to the number of CPUs")
+    args = parser.parse_args()
+    if os.path.exists(args.output):
+        parser.error(f"{args.output} already exists")
+    if args.report and not args.current:
+        parser.error("--report needs --current to compare against")
+
+    start = time.perf_counter()
+    users, timezones, aggregates = rebuild(args.history, args.processes)
+    print(f"Rebuilt {len(users)} users in {time.perf_counter() - start:.1f}s")
+
+    current = SQLitePersistence(args.current, read_only=True) if args.current else None
+    write_snapshot(users, timezones, aggregates, args.output, current)
+    print(f"Wrote {args.output}")
+
+    if current is not None:
+        report(users, current, args.report)
+
+
+if __name__ == "__main__":
+    main()
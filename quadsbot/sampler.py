@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# How often every thread's stack is looked at
+interval = 0.005
+
+# Lines of each table in the report
+report_lines = 15
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+# (file, function) where a thread is waiting for something to do, e.g. a
+# worker waiting for an update. Waiting on the network isn't idle, that's
+# worth seeing.
+idle_functions = {
+    ("threading.py", "wait"),
+    # The main thread while stopping
+    ("threading.py", "_shutdown"),
+    # The main thread the rest of the time
+    ("updater.py", "idle"),
+}
+
+
+def is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in idle_functions
+
+
+class StackSampler:
+    """
+    A sampling profiler. Every `interval` it records where every thread is,
+    so unlike cProfile it sees all of the handler threads (and the outbound
+    and persistence ones) without slowing them down much.
+
+    Threads that are waiting for work are left out.
+    """
+
+    def __init__(self):
+        self.samples = 0
+        self.ticks = 0
+        # function -> samples it was running in
+        self.own = Counter()
+        # function -> samples it was anywhere on the stack in
+        self.total = Counter()
+        # thread name -> samples
+        self.threads = Counter()
+
+    def run(self, duration: float) -> None:
+        me = threading.get_ident()
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != me and not is_idle(frame):
+                    self.sample(names.get(ident, str(ident)), frame)
+            self.ticks += 1
+            time.sleep(interval)
+
+    def sample(self, thread: str, frame) -> None:
+        self.samples += 1
+        self.threads[thread] += 1
+        self.own[frame_name(frame)] += 1
+        seen = set()
+        while frame is not None:
+            name = frame_name(frame)
+            if name not in seen:
+                seen.add(name)
+                self.total[name] += 1
+            frame = frame.f_back
+
+    def report(self, duration: float) -> str:
+        lines = [
+            f"Profiled {duration:.0f}s: {self.samples} busy samples over {self.ticks} ticks"
+            f" ({interval * 1000:.0f}ms apart)"
+        ]
+        if not self.samples:
+            return lines[0]
+
+        for title, counts in (
+            ("By thread", self.threads),
+            ("Running", self.own),
+            ("Running or calling", self.total),
+        ):
+            lines.append(f"\n{title}:")
+            for name, samples in counts.most_common(report_lines):
+                lines.append(f"{samples / self.samples:>6.1%}  {name}")
+        return "\n".join(lines)
+
+
+def profile_for(duration: float) -> str:
+    """
+    Sample every thread for `duration` seconds, and report where the time went
+    """
+    sampler = StackSampler()
+    sampler.run(duration)
+    return sampler.report(duration)
@@ -0,0 +1,232 @@
+import json
+import logging
+import multiprocessing
+import queue
+import runpy
+import threading
+from collections import Counter
+from typing import Optional
+
+from quadsbot.history import from_timestamp
+from quadsbot.metrics import shadow_messages
+
+# Messages each worker checks before sending back what it found
+batch_size = 100
+
+# Seconds to wait for the workers to finish what's queued when stopping
+stop_timeout = 5
+
+
+def load_candidate(filename: str) -> tuple[list, list]:
+    """
+    The `matchers` and `joke_matchers` of a Python file laid out like
+    `quadsbot.matchers`, without joke_matchers the live ones are used
+    """
+    from quadsbot.matchers import joke_matchers
+
+    candidate = runpy.run_path(filename)
+    return list(candidate["matchers"]), list(candidate.get("joke_matchers", joke_matchers))
+
+
+def evaluate(matchers: list, joke_matchers: list, tasks, results) -> None:
+    """
+    A worker process, `plan`s each message in `tasks` with the candidate
+    matchers. After each batch it puts `(agreed, disagreements)` in `results`.
+
+    Stops at a None task.
+    """
+    from quadsbot.day_table import DayTables
+    from quadsbot.handlers.message import plan
+    from quadsbot.matcher_engine import MatcherEngine
+
+    # Every check is logged, which would be most of the time spent
+    logging.disable(logging.CRITICAL)
+    tables = DayTables(MatcherEngine(matchers), MatcherEngine(matchers + joke_matchers))
+
+    stopping = False
+    while not stopping:
+        batch = [tasks.get()]
+        while len(batch) < batch_size and batch[-1] is not None:
+            try:
+                batch.append(tasks.get_nowait())
+            except queue.Empty:
+                break
+
+        agreed = 0
+        disagreements = []
+        for task in batch:
+            if task is None:
+                stopping = True
+                break
+            date, forward_date, tz, text, live_state, live_matcher = task
+            try:
+                state, check_info = plan(
+                    from_timestamp(date), from_timestamp(forward_date), tz, text, tables
+                )
+                checked = state.name in ("CHECKED", "CHECK_THEN_DELETE")
+                candidate = (state.name, check_info[0] if checked else None)
+            except Exception as e:
+                # e.g. a forwarded message with outcomes the live matchers never
+                # give, which is worth seeing rather than stopping for
+                candidate = ("ERROR", repr(e))
+            if candidate == (live_state, live_matcher):
+                agreed += 1
+            else:
+                disagreements.append(
+                    {
+                        "date": date,
+                        "forward_date": forward_date,
+                        "tz": tz,
+                        "text": text,
+                        "live": [live_state, live_matcher],
+                        "candidate": list(candidate),
+                    }
+                )
+        results.put((agreed, disagreements))
+
+
+class Shadow:
+    """
+    Checks every message again with a candidate set of matchers, to see how
+    they'd have judged real traffic before they replace the live ones.
+
+    Messages are checked by worker processes, so the live checks don't wait
+    for them. They're given to them through a queue of at most `max_queued`,
+    when it's full messages are dropped (and counted) rather than waiting.
+
+    Every message where the candidate's outcome (state and matcher) differs
+    from the live one is written to a JSONL file, along with what was
+    checked:
+    `{"date": ..., "text": ..., "live": ["CHECKED", "quads"], "candidate": ["PASS", null]}`
+
+    Does nothing until `start` is called (when SHADOW_MATCHERS is set).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.compared = 0
+        self.dropped = 0
+        # (live state, candidate state) -> messages
+        self.disagreed = Counter()
+
+        self._tasks = None
+        self._results = None
+        self._workers = []
+        self._collector = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def start(
+        self, candidate_file: str, log_file: str, workers: int = 1, max_queued: int = 1000
+    ) -> None:
+        matchers, joke_matchers = load_candidate(candidate_file)
+
+        # Not forked, other threads may be holding locks the workers would need
+        context = multiprocessing.get_context("spawn")
+        self._tasks = context.Queue(max_queued)
+        self._results = context.Queue()
+        self._workers = [
+            context.Process(
+                target=evaluate,
+                args=(matchers, joke_matchers, self._tasks, self._results),
+                name=f"shadow-{worker}",
+                daemon=True,
+            )
+            for worker in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        self._file = open(log_file, "a", encoding="utf-8")
+        self._collector = threading.Thread(target=self.collect, name="shadow", daemon=True)
+        self._collector.start()
+        self.enabled = True
+        logging.info(
+            f"Shadow checking with {len(matchers)} matchers from {candidate_file}"
+            f" in {workers} processes, disagreements go to {log_file}"
+        )
+
+    def stop(self) -> None:
+        """
+        Check what's still queued, then stop the workers
+        """
+        if not self.enabled:
+            return
+        self.enabled = False
+
+        try:
+            for _ in self._workers:
+                self._tasks.put(None, timeout=stop_timeout)
+        except queue.Full:
+            pass
+        for worker in self._workers:
+            worker.join(stop_timeout)
+            if worker.is_alive():
+                worker.terminate()
+        # Don't wait at exit to send what a stopped worker won't read
+        self._tasks.cancel_join_thread()
+        self._results.put(None)
+        self._collector.join()
+        self._file.close()
+        logging.info(f"Shadow checking stopped: {self.summary()}")
+
+    def submit(
+        self,
+        date,
+        forward_date,
+        tz: str,
+        text: Optional[str],
+        live_state: str,
+        live_matcher: Optional[str],
+    ) -> None:
+        """
+        Queue a message to check, along with how the live matchers judged it
+        """
+        if not self.enabled:
+            return
+        task = (
+            int(date.timestamp()),
+            int(forward_date.timestamp()) if forward_date else None,
+            tz,
+            text,
+            live_state,
+            live_matcher,
+        )
+        try:
+            self._tasks.put_nowait(task)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            shadow_messages.inc("dropped")
+
+    def collect(self) -> None:
+        """
+        Count and write what the workers found, until a None result
+        """
+        while True:
+            result = self._results.get()
+            if result is None:
+                return
+            agreed, disagreements = result
+            with self._lock:
+                self.compared += agreed + len(disagreements)
+                for disagreement in disagreements:
+                    live, candidate = disagreement["live"][0], disagreement["candidate"][0]
+                    self.disagreed[(live, candidate)] += 1
+                    self._file.write(json.dumps(disagreement) + "\n")
+                self._file.flush()
+            shadow_messages.inc("agreed", amount=agreed)
+            shadow_messages.inc("disagreed", amount=len(disagreements))
+
+    def summary(self) -> str:
+        with self._lock:
+            disagreed = sum(self.disagreed.values())
+            lines = [
+                f"{self.compared} compared, {disagreed} disagreed, {self.dropped} dropped"
+            ]
+            for (live, candidate), messages in self.disagreed.most_common():
+                lines.append(f"  {live} -> {candidate}: {messages}")
+        return "\n".join(lines)
+
+
+shadow = Shadow()
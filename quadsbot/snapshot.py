@@ -0,0 +1,275 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import Counter
+from typing import Callable, NamedTuple, Optional
+
+# Bump when the layout changes, readers refuse versions they don't know
+format_version = 1
+magic = b"QBLB"
+
+# magic, format_version, sequence, payload length, published (unix time)
+header = struct.Struct("<4sIQQd")
+# chats
+counts = struct.Struct("<I")
+# chat_id, first entry, entries, users, checks
+chat = struct.Struct("<qIIIQ")
+# Longer usernames are cut short
+username_bytes = 32
+# score, user_id, username (utf-8, nul padded)
+entry = struct.Struct(f"<qq{username_bytes}s")
+
+# How many times a reader retries while the snapshot is being written
+read_attempts = 100
+
+
+class ChatSummary(NamedTuple):
+    chat_id: int
+    # Everyone in the chat, not just those in the snapshot
+    users: int
+    checks: int
+
+
+def encode(chats: dict[int, tuple[int, int, list]], size: int) -> bytes:
+    """
+    chat_id -> (users, checks, [(score, user_id, username)] best first), as
+    a payload of at most `size` bytes.
+
+    The chats are sorted so a reader can binary search them. If they don't
+    all fit, the ones with the fewest users are left out.
+    """
+    chat_ids = sorted(chats, key=lambda chat_id: -chats[chat_id][0])
+    used = counts.size
+    kept = []
+    for chat_id in chat_ids:
+        needed = chat.size + entry.size * len(chats[chat_id][2])
+        if used + needed > size:
+            break
+        used += needed
+        kept.append(chat_id)
+    if len(kept) < len(chats):
+        logging.warning(f"Only {len(kept)} of {len(chats)} chats fit in the snapshot")
+    kept.sort()
+
+    payload = bytearray(used)
+    counts.pack_into(payload, 0, len(kept))
+    first = 0
+    entries_offset = counts.size + chat.size * len(kept)
+    for index, chat_id in enumerate(kept):
+        users, checks, top = chats[chat_id]
+        chat.pack_into(
+            payload, counts.size + chat.size * index, chat_id, first, len(top), users, checks
+        )
+        for score, user_id, username in top:
+            entry.pack_into(
+                payload,
+                entries_offset + entry.size * first,
+                score,
+                user_id,
+                (username or "").encode("utf-8")[:username_bytes],
+            )
+            first += 1
+    return bytes(payload)
+
+
+def open_mmap(filename: str, size: int, write: bool) -> mmap.mmap:
+    if write:
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+        access = mmap.ACCESS_WRITE
+    else:
+        fd = os.open(filename, os.O_RDONLY)
+        size = os.fstat(fd).st_size
+        access = mmap.ACCESS_READ
+    try:
+        return mmap.mmap(fd, size, access=access)
+    finally:
+        os.close(fd)
+
+
+class SnapshotWriter:
+    """
+    Publishes every chat's leaderboard to a memory mapped file of `size`
+    bytes, for `quadsbot.dashboard` to read without asking the bot.
+
+    Consistency uses a seqlock: the sequence number in the header is odd
+    while a snapshot is being written and goes up by 2 every time. A reader
+    reads it, reads what it needs, then checks it's still the same (and
+    even), otherwise it tries again. So readers never hold up the writer.
+    This relies on writes to the file being seen in order, as they are on
+    x86.
+    """
+
+    def __init__(self, filename: str, size: int):
+        self.filename = filename
+        self.size = size
+        self._mmap = open_mmap(filename, size, write=True)
+        found, _, sequence, _, _ = header.unpack_from(self._mmap, 0)
+        if found == magic:
+            # Carry on from the old file, so a reader that has it open notices
+            self.sequence = sequence + sequence % 2
+        else:
+            self.sequence = 0
+            self.publish({})
+
+    def publish(self, chats: dict[int, tuple[int, int, list]]) -> None:
+        payload = encode(chats, self.size - header.size)
+
+        self.sequence += 1
+        header.pack_into(self._mmap, 0, magic, format_version, self.sequence, 0, 0)
+        self._mmap[header.size : header.size + len(payload)] = payload
+        self.sequence += 1
+        header.pack_into(
+            self._mmap, 0, magic, format_version, self.sequence, len(payload), time.time()
+        )
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+class RankingPublisher:
+    """
+    A repeating job that publishes every chat's rankings, as last written to
+    the database, when they've changed since the last time
+    """
+
+    def __init__(self, writer: SnapshotWriter, persistence, top_n: int):
+        self.writer = writer
+        self.persistence = persistence
+        self.top_n = top_n
+        self._version = None
+
+    def publish(self, context=None) -> None:
+        version = self.persistence.data_version()
+        if version == self._version:
+            return
+        self._version = version
+        self.writer.publish(self.persistence.read_rankings(self.top_n))
+
+
+class SnapshotReader:
+    """
+    Reads what a `SnapshotWriter` (in another process) published, straight
+    from the mapped file without copying the snapshot.
+
+    Safe to read from many threads (e.g. the dashboard's). When the file is
+    resized the new mapping is swapped in, and the old one is only closed
+    once no read is using it.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._mmap = open_mmap(filename, 0, write=False)
+        self._lock = threading.Lock()
+        # id(mmap) -> reads using it
+        self._readers = Counter()
+        # id(mmap) -> a replaced mmap that's still being read
+        self._retired = {}
+
+    def read(self, fn: Callable[[mmap.mmap, int], object]):
+        """
+        `fn(mmap, payload_offset)` of a consistent snapshot, retrying while
+        one is being written.
+
+        `fn` may see a half written snapshot (which is then thrown away), so
+        must keep any counts it reads inside the file.
+        """
+        size = os.stat(self.filename).st_size
+        with self._lock:
+            if size != len(self._mmap):
+                # The bot was restarted with a different SNAPSHOT_SIZE
+                self._retire(self._mmap)
+                self._mmap = open_mmap(self.filename, 0, write=False)
+            data = self._mmap
+            self._readers[id(data)] += 1
+        try:
+            return self._read(data, fn)
+        finally:
+            with self._lock:
+                self._readers[id(data)] -= 1
+                if not self._readers[id(data)]:
+                    del self._readers[id(data)]
+                    if id(data) in self._retired:
+                        self._retired.pop(id(data)).close()
+
+    def _retire(self, data: mmap.mmap) -> None:
+        """
+        Close a replaced mmap, or leave that to its last read, must hold the
+        lock
+        """
+        if self._readers[id(data)]:
+            self._retired[id(data)] = data
+        else:
+            data.close()
+
+    def _read(self, data: mmap.mmap, fn: Callable[[mmap.mmap, int], object]):
+        for _ in range(read_attempts):
+            found, version, sequence, _, _ = header.unpack_from(data, 0)
+            if found != magic or version != format_version:
+                raise ValueError(f"{self.filename} isn't a version {format_version} snapshot")
+            if sequence % 2:
+                time.sleep(0.001)
+                continue
+            result = fn(data, header.size)
+            if header.unpack_from(data, 0)[2] == sequence:
+                return result
+        raise TimeoutError(f"{self.filename} kept changing while being read")
+
+    def published(self) -> float:
+        return self.read(lambda data, offset: header.unpack_from(data, 0)[4])
+
+    def chats(self) -> list[ChatSummary]:
+        def read_chats(data, offset):
+            (chat_count,) = counts.unpack_from(data, offset)
+            offset += counts.size
+            chat_count = min(chat_count, (len(data) - offset) // chat.size)
+            summaries = []
+            for index in range(chat_count):
+                chat_id, _, _, users, checks = chat.unpack_from(data, offset + chat.size * index)
+                summaries.append(ChatSummary(chat_id, users, checks))
+            return summaries
+
+        return self.read(read_chats)
+
+    def leaderboard(self, chat_id: int) -> Optional[list[tuple[int, str]]]:
+        """
+        The (score, username) of a chat's top users, or None if it's not in
+        the snapshot
+        """
+
+        def read_leaderboard(data, offset):
+            (chat_count,) = counts.unpack_from(data, offset)
+            chats_offset = offset + counts.size
+            chat_count = min(chat_count, (len(data) - chats_offset) // chat.size)
+            entries_offset = chats_offset + chat.size * chat_count
+
+            # The chats are sorted by id
+            lo, hi = 0, chat_count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if chat.unpack_from(data, chats_offset + chat.size * mid)[0] < chat_id:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo == chat_count:
+                return None
+            found, first, entries, _, _ = chat.unpack_from(data, chats_offset + chat.size * lo)
+            if found != chat_id:
+                return None
+
+            top = []
+            last = min(first + entries, (len(data) - entries_offset) // entry.size)
+            for index in range(first, last):
+                score, _, username = entry.unpack_from(data, entries_offset + entry.size * index)
+                top.append((score, username.rstrip(b"\0").decode("utf-8", "ignore")))
+            return top
+
+        return self.read(read_leaderboard)
+
+    def close(self) -> None:
+        with self._lock:
+            self._retire(self._mmap)
@@ -0,0 +1,154 @@
+import importlib
+import logging
+import threading
+import time
+from typing import Callable
+
+from quadsbot.metrics import handler_seconds
+from quadsbot.tracing import tracer
+
+# As early as we can measure it, main.py imports this first
+process_start = time.perf_counter()
+
+
+class StartupProfile:
+    """
+    Records how long each step of starting up takes, up until the first
+    update has been handled, then logs a report.
+
+    Does nothing unless enabled (with `main.py --startup-profile`).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.steps = []
+        self._last = process_start
+        self._lock = threading.Lock()
+        self._handling = False
+        self._reported = False
+
+    def mark(self, step: str) -> None:
+        """
+        Record that `step` has just finished
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.perf_counter()
+            self.steps.append((step, now - self._last))
+            self._last = now
+
+    def handling(self) -> None:
+        """
+        Called before every update is handled
+        """
+        if not self.enabled or self._handling:
+            return
+        with self._lock:
+            if self._handling:
+                return
+            self._handling = True
+        # Mostly waiting for someone to send a message, but it's there to
+        # see whether polling/the webhook took a while to get going
+        self.mark("Wait for the first update")
+
+    def handled(self) -> None:
+        """
+        Called after every update is handled, reports after the first
+        """
+        if not self.enabled or self._reported:
+            return
+        with self._lock:
+            if self._reported:
+                return
+            self._reported = True
+        self.mark("Handle the first update")
+        self.report()
+
+    def report(self) -> None:
+        total = sum(duration for _, duration in self.steps)
+        lines = ["Startup profile:"]
+        for step, duration in self.steps:
+            lines.append(f"{duration * 1000:>9.1f}ms  {step}")
+        lines.append(f"{total * 1000:>9.1f}ms  Total")
+        logging.info("\n".join(lines))
+
+
+profile = StartupProfile()
+
+# The (trace, span) of the update each thread last handled, see
+# `trace_persistence`
+handled = threading.local()
+
+
+def update_attributes(update) -> dict:
+    """
+    For an update's trace span
+    """
+    attributes = {"update_id": update.update_id}
+    message = update.effective_message
+    if message is not None:
+        # Time since it was sent, including waiting to be fetched and handled
+        attributes["age"] = time.time() - message.date.timestamp()
+    return attributes
+
+
+def lazy_callback(module: str, name: str) -> Callable:
+    """
+    A handler callback for `module.name`, that only imports the module the
+    first time there's an update for it. So handlers that are rarely used
+    don't slow down starting up.
+    """
+    callback = None
+
+    def wrapper(update, context):
+        nonlocal callback
+        profile.handling()
+        if callback is None:
+            callback = getattr(importlib.import_module(module), name)
+        attributes = update_attributes(update) if tracer.enabled else {}
+        with handler_seconds.time(name), tracer.span(name, **attributes):
+            handled.trace = tracer.current()
+            result = callback(update, context)
+        profile.handled()
+        return result
+
+    wrapper.__name__ = name
+    wrapper.__qualname__ = name
+    return wrapper
+
+
+def trace_persistence(dispatcher) -> None:
+    """
+    Make the span of writing bot_data after an update a child of the
+    update's handler span. The dispatcher writes it once the handler has
+    returned (so its span has ended), on the same thread.
+    """
+    update_persistence = dispatcher.update_persistence
+
+    def wrapper(update=None):
+        trace = getattr(handled, "trace", None) if update is not None else None
+        handled.trace = None
+        with tracer.span("update_persistence", parent=trace):
+            update_persistence(update=update)
+
+    dispatcher.update_persistence = wrapper
+
+
+def warm_up() -> None:
+    """
+    Do the slow part of handling the first message (building today's table
+    of date matches) in the background, so it doesn't have to wait for it.
+    The message handler itself is still only imported by the first message.
+    """
+
+    def run():
+        from datetime import datetime, timezone
+
+        from quadsbot.matchers import day_tables
+        from quadsbot.user import default_tz
+
+        day_tables.date_hits(datetime.now(timezone.utc), default_tz)
+        logging.info("Warmed up")
+
+    threading.Thread(target=run, name="warm_up", daemon=True).start()
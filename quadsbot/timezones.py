@@ -0,0 +1,113 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+# Locations are rounded to this many decimal places (about 100m) and the
+# timezone is looked up at the middle of that cell, so nearby locations (e.g.
+# a live location moving about) share a cache entry
+precision = 3
+cache_size = 4096
+
+# A moving live location is only looked up again for a user once it's been
+# this many seconds, or it's moved this many km, since the last lookup
+min_interval = 5 * 60
+min_distance = 1
+
+
+class TimezoneCache:
+    """
+    Finds the timezone of a location.
+
+    TimezoneFinder loads a lot of polygon data, so it's only imported and
+    created the first time it's needed. Lookups are then cached by
+    rounded location, evicting the least recently used.
+    """
+
+    def __init__(self):
+        self._finder = None
+        # (latitude, longitude) as rounded ints -> timezone
+        self._cache = OrderedDict()
+        # TimezoneFinder reads its data files with seeks, so isn't thread safe
+        self._lock = threading.Lock()
+
+    def timezone_at(self, latitude: float, longitude: float) -> Optional[str]:
+        """
+        The timezone name at the location, or None if there isn't one
+        """
+        scale = 10**precision
+        key = (round(latitude * scale), round(longitude * scale))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+            timezone = self.finder().timezone_at(lat=key[0] / scale, lng=key[1] / scale)
+            self._cache[key] = timezone
+            if len(self._cache) > cache_size:
+                self._cache.popitem(last=False)
+            return timezone
+
+    def finder(self):
+        """
+        The TimezoneFinder, created the first time, must hold the lock
+        """
+        if self._finder is None:
+            from timezonefinder import TimezoneFinder
+
+            logging.info("Loading TimezoneFinder")
+            self._finder = TimezoneFinder()
+        return self._finder
+
+
+def distance_km(
+    latitude: float, longitude: float, other_latitude: float, other_longitude: float
+) -> float:
+    """
+    Roughly, which is plenty for telling whether a live location has moved
+    """
+    x = math.radians(other_longitude - longitude) * math.cos(
+        math.radians((latitude + other_latitude) / 2)
+    )
+    y = math.radians(other_latitude - latitude)
+    return 6371 * math.hypot(x, y)
+
+
+class LiveLocations:
+    """
+    Live locations are edited every few seconds while they're shared, so
+    this tracks where and when each user's timezone was last looked up, to
+    skip the edits that are too soon and too close to it.
+    Only the most recently seen users are kept.
+    """
+
+    def __init__(self):
+        # user_id -> (monotonic time, latitude, longitude)
+        self._last = OrderedDict()
+        self._lock = threading.Lock()
+
+    def due(self, user_id: int, latitude: float, longitude: float, first: bool = False) -> bool:
+        """
+        Whether to look up the timezone of this location, and if so remember
+        it as the last lookup. Always true for the `first` of a live location.
+        """
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(user_id)
+            if not first and last is not None:
+                last_time, last_latitude, last_longitude = last
+                moved = distance_km(last_latitude, last_longitude, latitude, longitude)
+                if now - last_time < min_interval and moved < min_distance:
+                    return False
+
+            self._last[user_id] = (now, latitude, longitude)
+            self._last.move_to_end(user_id)
+            if len(self._last) > cache_size:
+                self._last.popitem(last=False)
+            return True
+
+
+timezones = TimezoneCache()
+live_locations = LiveLocations()
@@ -0,0 +1,110 @@
+import atexit
+import itertools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Optional, Sequence
+
+
+class Tracer:
+    """
+    Writes spans (how long each step of handling an update took) to a JSONL
+    file, one per line:
+    `{"trace": 1, "span": 2, "parent": 1, "name": "check", "start": ..., "duration": ...}`
+
+    Spans started inside another on the same thread are its children, and
+    share its trace. So an update's handler span is the parent of its check
+    span etc. Work handed to another thread (e.g. sending replies) takes the
+    `current` (trace, span) with it and passes it as the `parent`, or as
+    `links` when one span does the work of several (e.g. a bulk delete):
+    `{..., "parent": null, "links": [[1, 2], [5, 6]]}`
+
+    Does nothing until `open` is called (when TRACE_FILE is set).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._file = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # The current (trace, span) of each thread
+        self._local = threading.local()
+
+    def open(self, filename: str) -> None:
+        self._file = open(filename, "a", encoding="utf-8")
+        self.enabled = True
+        atexit.register(self.close)
+        logging.info(f"Writing trace spans to {filename}")
+
+    def close(self) -> None:
+        with self._lock:
+            self.enabled = False
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def current(self) -> Optional[tuple[int, int]]:
+        """
+        The (trace, span) this thread is in, if any
+        """
+        if not self.enabled:
+            return None
+        return getattr(self._local, "current", None)
+
+    def span(
+        self,
+        name: str,
+        parent: Optional[tuple[int, int]] = None,
+        links: Sequence[tuple[int, int]] = (),
+        **attributes,
+    ):
+        """
+        Context manager timing its body as a span, a child of the thread's
+        current span unless given a `parent` (trace, span)
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, parent, links, attributes)
+
+    @contextmanager
+    def _span(
+        self,
+        name: str,
+        parent: Optional[tuple[int, int]],
+        links: Sequence[tuple[int, int]],
+        attributes: dict,
+    ):
+        previous = getattr(self._local, "current", None)
+        parent = parent or previous
+        span_id = next(self._ids)
+        trace_id = parent[0] if parent else span_id
+        self._local.current = (trace_id, span_id)
+
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            self._local.current = previous
+            line = json.dumps(
+                {
+                    "trace": trace_id,
+                    "span": span_id,
+                    "parent": parent[1] if parent else None,
+                    "name": name,
+                    "start": start,
+                    "duration": duration,
+                    **({"links": list(links)} if links else {}),
+                    **attributes,
+                },
+                default=str,
+            )
+            with self._lock:
+                if self._file is not None:
+                    self._file.write(line + "\n")
+
+
+tracer = Tracer()
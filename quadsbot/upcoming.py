@@ -0,0 +1,225 @@
+import calendar
+import heapq
+import itertools
+import re
+from datetime import datetime, timedelta
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+import pytz
+
+from quadsbot.date_utils import format_strings
+from quadsbot.digit_pattern import Atom, parse_digit_pattern
+
+# No timezone is more than this far ahead of UTC
+MAX_UTC_OFFSET = 14 * 60 * 60
+
+# The strftime directives in `format_strings`, in chronological order
+# directive -> (first value, width)
+directive_fields = {
+    "Y": (1, 4),
+    "m": (1, 2),
+    "d": (1, 2),
+    "H": (0, 2),
+    "I": (0, 2),  # We still count 0-23, it's only rendered as 12 hour
+    "M": (0, 2),
+    "S": (0, 2),
+}
+
+
+class Moment(NamedTuple):
+    """
+    A window of time where the date side of a matcher matches
+    """
+
+    start: datetime
+    end: datetime
+    message_re: str
+
+
+def field_max(directive: str, values: list[int]) -> int:
+    if directive == "Y":
+        return 9999
+    if directive == "m":
+        return 12
+    if directive == "d":
+        return calendar.monthrange(values[0], values[1])[1]
+    if directive in "HI":
+        return 23
+    return 59
+
+
+def render(directive: str, value: int) -> str:
+    if directive == "I":
+        value = value % 12 or 12
+    return str(value).zfill(directive_fields[directive][1])
+
+
+def bind(atoms: list[Atom], position: int, digits: str, groups: dict) -> Optional[dict]:
+    """
+    Check `digits` (starting at `position`) against the atoms.
+    Returns the updated group captures, or None if they don't match.
+    """
+    for offset, digit in enumerate(digits, position):
+        if offset >= len(atoms):
+            break
+        atom = atoms[offset]
+        if atom.kind == "lit" and digit != atom.value:
+            return None
+        if atom.kind == "ref" and groups.get(atom.group) != digit:
+            return None
+        if atom.kind == "any" and atom.group is not None:
+            groups = {**groups, atom.group: digit}
+    return groups
+
+
+def add_unit(values: list[int], directive: str) -> datetime:
+    """
+    The start of the next year/month/day/... after the given field values
+    """
+    year, month, day, hour, minute, second = values + [1, 1, 0, 0, 0][len(values) - 1:]
+    start = datetime(year, month, day, hour, minute, second)
+    if directive == "Y":
+        return start.replace(year=year + 1)
+    if directive == "m":
+        return start.replace(year=year + month // 12, month=month % 12 + 1)
+    if directive == "d":
+        return start + timedelta(days=1)
+    if directive in "HI":
+        return start + timedelta(hours=1)
+    if directive == "M":
+        return start + timedelta(minutes=1)
+    return start + timedelta(seconds=1)
+
+
+def wall_windows(
+    atoms: list[Atom], format_string: str, after: datetime
+) -> Iterator[Tuple[datetime, datetime]]:
+    """
+    Yield the local wall-clock windows `[start, end)` after `after` where the
+    digits of `format_string` match the (anchored) atoms, in order.
+
+    Walks the fields from the year down, only trying values whose digits fit
+    the atoms. Once the atoms run out the remaining fields are free, so the
+    whole span is yielded as one window.
+    """
+    directives = re.findall(r"%(.)", format_string)
+    positions = list(itertools.accumulate([directive_fields[d][1] for d in directives], initial=0))
+    free_from = next(
+        (k for k, position in enumerate(positions) if position >= len(atoms)), len(directives)
+    )
+    lower = [after.year, after.month, after.day, after.hour, after.minute, after.second]
+
+    # Below a field, whether anything matches only depends on the groups bound
+    # so far and how many days the months have. So remember where nothing
+    # does, otherwise a format that can never match (e.g. 13:37 as 12 hour)
+    # would be searched all the way to the year 9999.
+    dead = set()
+
+    def days(k: int, values: list[int]):
+        if k == 1:
+            return calendar.isleap(values[0])
+        if k == 2:
+            return field_max("d", values)
+        return None
+
+    def search(k: int, values: list[int], groups: dict, tight: bool):
+        if k == free_from:
+            start = datetime(*(values + [1, 1, 0, 0, 0][len(values) - 1:]))
+            yield max(start, after), add_unit(values, directives[k - 1])
+            return
+
+        key = None if tight else (k, tuple(sorted(groups.items())), days(k, values))
+        if key in dead:
+            return
+
+        directive = directives[k]
+        first = lower[k] if tight else directive_fields[directive][0]
+        found = False
+        for value in range(first, field_max(directive, values) + 1):
+            new_groups = bind(atoms, positions[k], render(directive, value), groups)
+            if new_groups is not None:
+                for window in search(k + 1, values + [value], new_groups, tight and value == first):
+                    found = True
+                    yield window
+        if key is not None and not found:
+            dead.add(key)
+
+    # Join up windows that follow on from each other (e.g. 22:20-22:29)
+    window = None
+    for start, end in search(0, [], {}, True):
+        if window and window[1] == start:
+            window = (window[0], end)
+            continue
+        if window:
+            yield window
+        window = (start, end)
+    if window:
+        yield window
+
+
+def localize(tzinfo: pytz.BaseTzInfo, wall: datetime) -> list[datetime]:
+    """
+    Every instant that has the given wall-clock time.
+    Usually one, but none in a DST gap and two in a DST overlap.
+    """
+    instants = []
+    for is_dst in (True, False):
+        instant = tzinfo.localize(wall, is_dst=is_dst)
+        if tzinfo.normalize(instant).replace(tzinfo=None) == wall and instant not in instants:
+            instants.append(instant)
+    return instants
+
+
+def tag(
+    windows: Iterator[Tuple[datetime, datetime]], matcher_idx: int
+) -> Iterator[Tuple[datetime, datetime, int]]:
+    for start, end in windows:
+        yield start, end, matcher_idx
+
+
+def upcoming(after: datetime, tz: str, matchers: list[Tuple[str, str]]) -> Iterator[Moment]:
+    """
+    Yield every upcoming window where the date side of one of the `matchers`
+    matches in the given timezone, in order of start time.
+
+    Built directly from the digit structure of each date regex, so the rarer
+    matchers take no longer than the common ones.
+    Matchers that aren't anchored, fixed width patterns (or that can't be
+    parsed, see `parse_digit_pattern`) are skipped.
+    """
+    tzinfo = pytz.timezone(tz)
+    after = after.astimezone(tzinfo)
+    after_wall = after.replace(tzinfo=None)
+
+    streams = []
+    for matcher_idx, (date_re, _) in enumerate(matchers):
+        try:
+            pattern = parse_digit_pattern(date_re)
+        except ValueError:
+            continue
+        if not pattern.anchored or not pattern.fixed_width:
+            continue
+        for format_string in format_strings:
+            windows = wall_windows(pattern.atoms(), format_string, after_wall)
+            streams.append(tag(windows, matcher_idx))
+
+    # Wall-clock order is nearly UTC order, other than around DST changes.
+    # So hold windows back until no later wall-clock time could come before them.
+    pending = []
+    emitted = set()
+    for wall_start, wall_end, matcher_idx in heapq.merge(*streams):
+        for start in localize(tzinfo, wall_start):
+            end = start + (wall_end - wall_start)
+            if end > after and (start, matcher_idx) not in emitted:
+                emitted.add((start, matcher_idx))
+                heapq.heappush(pending, (start, matcher_idx, end))
+
+        horizon = calendar.timegm(wall_start.timetuple()) - MAX_UTC_OFFSET
+        while pending and pending[0][0].timestamp() <= horizon:
+            start, matcher_idx, end = heapq.heappop(pending)
+            emitted.discard((start, matcher_idx))
+            yield Moment(tzinfo.normalize(start), tzinfo.normalize(end), matchers[matcher_idx][1])
+
+    while pending:
+        start, matcher_idx, end = heapq.heappop(pending)
+        yield Moment(tzinfo.normalize(start), tzinfo.normalize(end), matchers[matcher_idx][1])
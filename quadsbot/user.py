@@ -1,16 +1,174 @@
 import os
+import threading
+from array import array
+from typing import Optional
 
-from telegram import Update
+from telegram import Update, User as TelegramUser
 from telegram.ext import CallbackContext
 
+from quadsbot.check_ids import check_day, pack_check_id, unpack_check_id
+from quadsbot.tracing import tracer
+
 default_tz = os.environ.get("TZ", "Europe/London")
 
+# Updates are handled concurrently, so each user (in each chat) is guarded by
+# one of a fixed set of locks. Different users rarely share one, so they can
+# be handled at the same time while the same user's updates take turns.
+lock_stripes = 64
+user_locks = [threading.RLock() for _ in range(lock_stripes)]
+
+
+def user_lock(chat_id: int, user_id: int) -> threading.RLock:
+    return user_locks[hash((chat_id, user_id)) % lock_stripes]
+
+
+class UserRecord:
+    """
+    The stats of a user in a chat.
+
+    Used to be a plain dict, so it can still be used like one (e.g.
+    `user_info["passed"] += 1`), including for keys that aren't fields.
+    But the usual fields are slots, and the unique checks are packed ints
+    (see `quadsbot.check_ids`) in an array, so a record is far smaller.
+    """
+
+    __slots__ = (
+        "username",
+        "checked_total",
+        "checked_unique",
+        "deleted",
+        "passed",
+        "messages_total",
+        "checks",
+        "extra",
+    )
+    fields = __slots__[:-2]
+
+    def __init__(
+        self,
+        username: Optional[str] = None,
+        checked_total: int = 0,
+        checked_unique: int = 0,
+        deleted: int = 0,
+        passed: int = 0,
+        messages_total: int = 0,
+        checks: bytes = b"",
+        extra: Optional[dict] = None,
+    ):
+        self.username = username
+        self.checked_total = checked_total
+        self.checked_unique = checked_unique
+        self.deleted = deleted
+        self.passed = passed
+        self.messages_total = messages_total
+        # The packed check_ids of recent unique checks
+        self.checks = array("q", checks)
+        # Any other keys, None until there are some
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, user_info: dict) -> "UserRecord":
+        """
+        Convert a record from when they were dicts
+        """
+        user_info = dict(user_info)
+        # The timezone is per user now, and has already been moved to
+        # bot_data["timezones"] (see `user_tz`)
+        user_info.pop("tz", None)
+        record = cls(**{field: user_info.pop(field) for field in cls.fields if field in user_info})
+        for check_id in user_info.pop("check_id_cache", []):
+            record.checks.append(pack_check_id(check_id))
+        record.extra = user_info or None
+        return record
+
+    def __reduce__(self):
+        # Pickled as a plain tuple of values, to keep the database small
+        values = tuple(getattr(self, field) for field in self.fields)
+        return UserRecord, (*values, self.checks.tobytes(), self.extra)
+
+    def add_check(self, check_id: int, oldest_day: int) -> bool:
+        """
+        Record a (packed) check_id. Returns whether it's unique, meaning it
+        hasn't been seen before and isn't from before `oldest_day` (YYYYMMDD).
+        Checks from before `oldest_day` are forgotten.
+        """
+        if check_day(check_id) < oldest_day or check_id in self.checks:
+            return False
+
+        if any(check_day(c) < oldest_day for c in self.checks):
+            self.checks = array("q", (c for c in self.checks if check_day(c) >= oldest_day))
+        self.checks.append(check_id)
+        return True
+
+    # >> dict compatibility
+
+    def __getitem__(self, key: str):
+        if key in self.fields:
+            return getattr(self, key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key: str, value) -> None:
+        if key in self.fields:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.fields or (self.extra is not None and key in self.extra)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key: str, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def to_dict(self) -> dict:
+        """
+        As a plain dict (e.g. for json), with the checks unpacked
+        """
+        user_info = {field: getattr(self, field) for field in self.fields}
+        user_info["checks"] = [unpack_check_id(check_id) for check_id in self.checks]
+        user_info.update(self.extra or {})
+        return user_info
+
+    def __repr__(self) -> str:
+        return f"UserRecord({self.to_dict()})"
+
+
+def user_tz(context: CallbackContext, user_id: int) -> str:
+    """
+    The timezone a user has set, which is the same in every chat they're in
+    (see `quadsbot.persistence.Timezones`), otherwise the default
+    """
+    return context.bot_data["timezones"].get(user_id, default_tz)
+
+
+def stats_user(update: Update) -> TelegramUser:
+    """
+    The user an update counts towards, if the message was forwarded that's
+    the forwarded user
+    """
+    if update.effective_message.forward_from:
+        return update.effective_message.forward_from
+    return update.effective_message.from_user
+
 
 class User:
     """
     A ContextManager that:
-    - Set's up the defaults of the user data
+    - Set's up the defaults of the user data (for the chat the update is in)
     - Saves the user data on context exit
+    - Holds the user's lock from creation until exit, so don't touch
+      persistence (e.g. load another chat) inside the context
 
     # Usage
     ```python
@@ -22,19 +180,42 @@ class User:
     """
 
     def __init__(self, update: Update, context: CallbackContext):
-        # Because we're basically a wrapper around bot_data["user_stats"],
-        # store a reference to bot_data["user_stats"] and the user_id
-        self._user_stats = context.bot_data["user_stats"]
+        # Because we're basically a wrapper around bot_data["chat_stats"][chat_id],
+        # store a reference to bot_data["chat_stats"][chat_id] and the user_id
+        chat = update.effective_chat
+        self._user_stats = context.bot_data["chat_stats"][chat.id]
 
-        # If the message was forwarded use the forwarded user
-        if update.effective_message.forward_from:
-            user = update.effective_message.forward_from
-        else:
-            user = update.effective_message.from_user
+        user = stats_user(update)
         self._user_id = user.id
 
+        self._lock = user_lock(chat.id, self._user_id)
+        with tracer.span("user.load"):
+            self._lock.acquire()
+            try:
+                self._load(update, context, user)
+            except BaseException:
+                self._lock.release()
+                raise
+
+    def _load(self, update: Update, context: CallbackContext, user: TelegramUser) -> None:
+        chat = update.effective_chat
+
         # Get the currently stored user_info
-        user_info = self._user_stats.get(self._user_id, {})
+        user_info = self._user_stats.get(self._user_id)
+        if user_info is None:
+            user_info = UserRecord()
+
+            # Stats used to be shared between all chats (in bot_data["user_stats"])
+            # The first group chat the user talks in gets them
+            if chat.type != "private":
+                user_info = context.bot_data["user_stats"].pop(self._user_id, user_info)
+
+        # Records used to be dicts
+        if not isinstance(user_info, UserRecord):
+            user_info = UserRecord.from_dict(user_info)
+
+        # To tell whether the leaderboard needs updating on exit
+        self._ranked = (user_info.checked_unique, user_info.username)
 
         # Always update username
         username = user.username
@@ -42,17 +223,7 @@ class User:
             username = user.first_name
             if user.last_name:
                 username += f" {user.last_name}"
-        user_info["username"] = username
-
-        # Set defaults for the usual values
-        # (Doesn't override the current value)
-        user_info.setdefault("checked_total", 0)
-        user_info.setdefault("checked_unique", 0)
-        user_info.setdefault("deleted", 0)
-        user_info.setdefault("passed", 0)
-        user_info.setdefault("messages_total", 0)
-        user_info.setdefault("tz", default_tz)
-        user_info.setdefault("check_id_cache", [])
+        user_info.username = username
 
         # Update the stored user_info
         self._user_stats[self._user_id] = user_info
@@ -64,8 +235,19 @@ class User:
         return self.user_info
 
     def __exit__(self, type, value, traceback):
-        # Limit size of the check_id_cache for memory usage
-        self.user_info["check_id_cache"] = self.user_info["check_id_cache"][-10:]
+        try:
+            with tracer.span("user.save"):
+                self._save()
+        finally:
+            self._lock.release()
 
+    def _save(self) -> None:
         # Update the stored user_info
         self._user_stats[self._user_id] = self.user_info
+
+        # Keep the leaderboard up to date (if it's been built)
+        score = self.user_info.checked_unique
+        username = self.user_info.username
+        rank_index = getattr(self._user_stats, "rank_index", None)
+        if rank_index is not None and self._ranked != (score, username):
+            rank_index.update(self._user_id, score, username)
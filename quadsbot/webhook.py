@@ -0,0 +1,170 @@
+import hmac
+import json
+import logging
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+from typing import Optional
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+secret_header = "X-Telegram-Bot-Api-Secret-Token"
+
+# Telegram's updates are small, anything bigger than this isn't one
+max_body_size = 1024 * 1024
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    A small HTTP server that receives updates from Telegram's webhook and puts
+    them straight onto the dispatcher's update queue.
+
+    - Requests must be a POST to `path` with the secret token Telegram was
+      given in `set_webhook`, otherwise they're rejected
+    - If `max_pending` updates are already waiting to be handled then the
+      request gets a 503, so Telegram holds on to the update and retries
+      later instead of us buffering without limit
+
+    Doesn't need the rest of the bot, so it can be tested by POSTing recorded
+    updates to it, e.g.
+    ```bash
+    $ curl -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+        -H "Content-Type: application/json" -d @update.json \\
+        http://localhost:8080/telegram
+    ```
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple,
+        bot: Bot,
+        update_queue: Queue,
+        secret_token: str,
+        path: str = "/telegram",
+        max_pending: int = 1000,
+    ):
+        super().__init__(address, WebhookRequestHandler)
+        self.bot = bot
+        self.update_queue = update_queue
+        self.secret_token = secret_token
+        self.webhook_path = path
+        self.max_pending = max_pending
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.serve_forever, name="webhook", daemon=True)
+        self._thread.start()
+        logging.info(f"Listening for webhook updates on {self.server_address}")
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    server: WebhookServer
+
+    def do_POST(self) -> None:
+        if self.path != self.server.webhook_path:
+            self.respond(HTTPStatus.NOT_FOUND)
+            return
+
+        secret_token = self.headers.get(secret_header, "")
+        if not hmac.compare_digest(secret_token.encode(), self.server.secret_token.encode()):
+            logging.warning(f"Webhook request from {self.client_address[0]} with a bad secret")
+            self.respond(HTTPStatus.FORBIDDEN)
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self.respond(HTTPStatus.LENGTH_REQUIRED)
+            return
+        if length > max_body_size:
+            self.respond(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return
+
+        if self.server.update_queue.qsize() >= self.server.max_pending:
+            logging.warning("Too many updates waiting, asking Telegram to retry")
+            self.respond(HTTPStatus.SERVICE_UNAVAILABLE, {"Retry-After": "1"})
+            return
+
+        try:
+            data = json.loads(self.rfile.read(length))
+            update = Update.de_json(data, self.server.bot)
+        except (ValueError, TypeError, KeyError):
+            self.respond(HTTPStatus.BAD_REQUEST)
+            return
+        if update is None:
+            self.respond(HTTPStatus.BAD_REQUEST)
+            return
+
+        self.server.update_queue.put(update)
+        self.respond(HTTPStatus.OK)
+
+    def do_GET(self) -> None:
+        self.respond(HTTPStatus.METHOD_NOT_ALLOWED)
+
+    def respond(self, status: HTTPStatus, headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        # Every update is a request, so only log them when debugging
+        logging.debug(f"Webhook {self.client_address[0]}: {format % args}")
+
+
+def start_webhook(
+    updater: Updater,
+    listen: str,
+    port: int,
+    secret_token: str,
+    path: str = "/telegram",
+    max_pending: int = 1000,
+    url: Optional[str] = None,
+) -> WebhookServer:
+    """
+    Start the dispatcher and a `WebhookServer` feeding it, in place of
+    `updater.start_polling()`. `updater.idle()` still stops the dispatcher,
+    the returned server needs stopping separately.
+
+    If `url` is given then Telegram is told to send updates there.
+    """
+    dispatcher = updater.dispatcher
+
+    # The same as Updater.start_webhook does, but with our own server.
+    # `updater.stop()` (from `idle`) stops the dispatcher, which ends the thread
+    dispatcher_ready = threading.Event()
+    updater.running = True
+    threading.Thread(
+        target=dispatcher.start,
+        kwargs={"ready": dispatcher_ready},
+        name="dispatcher",
+    ).start()
+    dispatcher_ready.wait()
+
+    server = WebhookServer(
+        (listen, port),
+        updater.bot,
+        dispatcher.update_queue,
+        secret_token,
+        path=path,
+        max_pending=max_pending,
+    )
+    server.start()
+
+    if url is not None:
+        # secret_token isn't an argument in every 13.x version
+        updater.bot.set_webhook(url, api_kwargs={"secret_token": secret_token})
+        logging.info(f"Set webhook to {url}")
+
+    return server
@@ -0,0 +1,38 @@
+import time
+from queue import Queue
+
+import pytest
+from telegram import Update
+
+from quadsbot.catch_up import CatchUpHandler
+
+
+def message_update(text: str, age: float) -> Update:
+    return Update.de_json(
+        {
+            "update_id": 1,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time() - age),
+                "chat": {"id": -100, "type": "group"},
+                "from": {"id": 1, "is_bot": False, "first_name": "alice"},
+                "text": text,
+            },
+        },
+        None,
+    )
+
+
+@pytest.mark.parametrize(
+    "text, age, caught_up",
+    [
+        ("quads", 3600, True),
+        ("quads", 0, None),
+        # Left to the command handlers, however old
+        ("/stats", 3600, None),
+        ("/leaderboard week", 3600, None),
+    ],
+)
+def test_check_update(text, age, caught_up):
+    handler = CatchUpHandler(None, Queue(), max_age=60, max_backlog=100)
+    assert handler.check_update(message_update(text, age)) == caught_up
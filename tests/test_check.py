@@ -0,0 +1,199 @@
+import re
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+import pytz
+
+from quadsbot import day_table
+from quadsbot.batch import check_many
+from quadsbot.date_utils import get_date_strings, is_april_fools_day
+from quadsbot.day_table import DayTables
+from quadsbot.handlers.message import State, check
+from quadsbot.matchers import (
+    april_fools_matcher_engine,
+    joke_matchers,
+    matcher_engine,
+    matchers,
+)
+
+texts = [None, "quads", "sexts", "blaze it", "LEET", "pie", "fibs", "nope"]
+
+
+def baseline_check(date: datetime, tz: str, message_text):
+    """
+    `check` as it was before the matcher engine and day tables
+    """
+    dates = get_date_strings(date, tz)
+    message_text = (message_text or "").lower()
+
+    more_matchers = matchers
+    if is_april_fools_day(date, tz):
+        more_matchers = matchers + joke_matchers
+
+    delete = True
+    for date_re, message_re in more_matchers:
+        for date_idx, date_digits in enumerate(dates):
+            date_match = re.search(date_re, date_digits)
+            if date_match:
+                delete = False
+                if re.search(message_re, message_text):
+                    check_id = date_digits[: date_match.end()] + str(date_idx)
+                    return State.CHECKED, (message_re, check_id)
+    return (State.DELETE if delete else State.PASS), None
+
+
+def utc(*args) -> int:
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+
+def at(timestamp: int) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+# (tz, start, seconds), each around a DST change, April fools or in a half
+# (or three quarter) hour zone
+windows = [
+    # Clocks go forward at 01:00 UTC
+    ("Europe/London", utc(2022, 3, 27, 0, 0), 2 * 3600),
+    # 01:00-02:00 local happens twice
+    ("Europe/London", utc(2022, 10, 29, 23, 30), 3 * 3600),
+    # +10:30 -> +9:30 at 03:00 local
+    ("Australia/Adelaide", utc(2022, 4, 2, 15, 30), 2 * 3600),
+    # -2:30 -> -3:30 at 02:00 local
+    ("America/St_Johns", utc(2022, 11, 6, 3, 30), 2 * 3600),
+    ("Asia/Kolkata", utc(2022, 3, 31, 18, 0), 2 * 3600),
+    ("Asia/Kathmandu", utc(2022, 4, 1, 0, 0), 2 * 3600),
+    # April fools, with the joke matchers, around 11:11 and 13:37
+    ("Europe/London", utc(2022, 4, 1, 10, 0), 3 * 3600),
+    ("UTC", utc(2022, 4, 1, 23, 0), 2 * 3600),
+]
+
+
+@pytest.fixture
+def fixed_now(monkeypatch):
+    """
+    Make `DayTables` think it's `now`, so it builds tables for the past
+    """
+
+    def set_now(now: int) -> None:
+        monkeypatch.setattr(day_table, "time", SimpleNamespace(time=lambda: now))
+
+    return set_now
+
+
+@pytest.mark.parametrize("tz, start, seconds", windows)
+def test_check_matches_baseline(fixed_now, tz, start, seconds):
+    fixed_now(start + seconds // 2)
+    tables = DayTables(matcher_engine, april_fools_matcher_engine)
+    for timestamp in range(start, start + seconds):
+        date = at(timestamp)
+        text = texts[timestamp % len(texts)]
+        assert check(date, tz, text, tables) == baseline_check(date, tz, text), date
+
+
+@pytest.mark.parametrize("tz, start, seconds", windows)
+def test_check_many_matches_check(tz, start, seconds):
+    timestamps = list(range(start, start + seconds))
+    message_texts = [texts[timestamp % len(texts)] for timestamp in timestamps]
+    states, check_ids = check_many(timestamps, tz, message_texts, chunk_size=1000)
+    for timestamp, text, state, check_id in zip(timestamps, message_texts, states, check_ids):
+        date = at(timestamp)
+        expected_state, check_info = check(date, tz, text)
+        assert State(state) == expected_state, date
+        assert check_id == (check_info[1] if check_info else None), date
+
+
+def test_check_many_without_texts():
+    # The first matcher to hit is the one that checks, even at 11:11:11
+    timestamps = [
+        utc(2022, 11, 11, 11, 11, 11),
+        utc(2022, 11, 11, 11, 12),
+        utc(2022, 11, 11, 1),
+    ]
+    states, check_ids = check_many(timestamps, "UTC")
+    assert [State(state) for state in states] == [State.CHECKED, State.DELETE, State.DELETE]
+    assert list(check_ids) == ["2022111111110", None, None]
+
+
+def london_segments(tables: DayTables) -> list[tuple[int, int, int, str]]:
+    return [
+        (segment.start, segment.end, segment.offset, segment.table.date_prefix)
+        for segment in tables._segments["Europe/London"]
+    ]
+
+
+def test_day_table_spring_forward(fixed_now):
+    fixed_now(utc(2022, 3, 27, 1, 0))
+    tables = DayTables(matcher_engine, april_fools_matcher_engine)
+
+    tables.date_hits(at(utc(2022, 3, 27, 0, 30)), "Europe/London")
+    assert london_segments(tables) == [
+        (utc(2022, 3, 27, 0, 0), utc(2022, 3, 27, 1, 0), 0, "20220327")
+    ]
+
+    # The other side of the change shares the day's table
+    tables.date_hits(at(utc(2022, 3, 27, 1, 30)), "Europe/London")
+    assert london_segments(tables) == [
+        (utc(2022, 3, 27, 0, 0), utc(2022, 3, 27, 1, 0), 0, "20220327"),
+        (utc(2022, 3, 27, 1, 0), utc(2022, 3, 27, 23, 0), 3600, "20220327"),
+    ]
+    segments = tables._segments["Europe/London"]
+    assert segments[0].table is segments[1].table
+
+
+def test_day_table_fall_back(fixed_now):
+    fixed_now(utc(2022, 10, 30, 1, 0))
+    tables = DayTables(matcher_engine, april_fools_matcher_engine)
+
+    tables.date_hits(at(utc(2022, 10, 30, 1, 30)), "Europe/London")
+    tables.date_hits(at(utc(2022, 10, 30, 0, 30)), "Europe/London")
+    assert london_segments(tables) == [
+        (utc(2022, 10, 30, 1, 0), utc(2022, 10, 31, 0, 0), 0, "20221030"),
+        (utc(2022, 10, 29, 23, 0), utc(2022, 10, 30, 1, 0), 3600, "20221030"),
+    ]
+
+    # Both 01:11:11s are found
+    for timestamp in (utc(2022, 10, 30, 0, 11, 11), utc(2022, 10, 30, 1, 11, 11)):
+        dates, _ = tables.date_hits(at(timestamp), "Europe/London")
+        assert dates == ["20221030011111", "20221030011111"]
+
+
+def test_day_table_rolls_over(fixed_now):
+    fixed_now(utc(2022, 3, 27, 12, 0))
+    tables = DayTables(matcher_engine, april_fools_matcher_engine)
+
+    tables.date_hits(at(utc(2022, 3, 27, 12, 0)), "Europe/London")
+    tables.date_hits(at(utc(2022, 3, 28, 0, 0)), "Europe/London")
+    assert london_segments(tables) == [
+        (utc(2022, 3, 27, 23, 0), utc(2022, 3, 28, 23, 0), 3600, "20220328")
+    ]
+    assert list(tables._tables) == ["20220328"]
+
+    # Going back a day isn't cached
+    date = at(utc(2022, 3, 27, 12, 0))
+    assert tables.date_hits(date, "Europe/London") == tables.direct_date_hits(
+        date.astimezone(pytz.timezone("Europe/London"))
+    )
+    assert list(tables._tables) == ["20220328"]
+
+
+@pytest.mark.parametrize(
+    "date_prefix, engine",
+    [
+        ("20221111", matcher_engine),
+        ("20111111", matcher_engine),
+        ("20220401", april_fools_matcher_engine),
+        ("20691101", april_fools_matcher_engine),
+    ],
+)
+def test_day_table_matches_regexes(date_prefix, engine):
+    table = day_table.DayTable(date_prefix, engine)
+    for second in range(day_table.SECONDS_PER_DAY):
+        digits = date_prefix + day_table.time_digits(second)
+        expected = sum(
+            1 << matcher_idx
+            for matcher_idx, matcher in enumerate(engine.matchers)
+            if matcher.date_re.search(digits)
+        )
+        assert table.masks[second] == expected, digits
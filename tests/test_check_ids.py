@@ -0,0 +1,54 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from quadsbot.check_ids import check_day, oldest_day, pack_check_id, unpack_check_id
+from quadsbot.user import UserRecord
+
+
+@pytest.mark.parametrize(
+    "check_id",
+    ["2022030122220", "2022030122221", "202203011111111", "202211111111110", "0000000000000"],
+)
+def test_pack_round_trip(check_id):
+    assert unpack_check_id(pack_check_id(check_id)) == check_id
+
+
+def test_pack_keeps_leading_zeros():
+    assert pack_check_id("00120") != pack_check_id("0120")
+    assert unpack_check_id(pack_check_id("00120")) == "00120"
+
+
+@pytest.mark.parametrize(
+    "check_id, day",
+    [
+        ("2022030122220", 20220301),
+        ("202211111111111", 20221111),
+        ("20220401130", 20220401),
+        ("202204010", 20220401),
+        # Too short for the whole day, so the last day it could be
+        ("2022040", 20220499),
+        ("20220", 20229999),
+    ],
+)
+def test_check_day(check_id, day):
+    assert check_day(pack_check_id(check_id)) == day
+
+
+def test_oldest_day():
+    assert oldest_day(datetime(2022, 3, 8, 12, tzinfo=timezone.utc), "UTC") == 20220301
+    assert oldest_day(datetime(2022, 3, 1, tzinfo=timezone.utc), "Europe/London") == 20220222
+
+
+def test_oldest_day_is_local():
+    # Already the 9th in Auckland
+    date = datetime(2022, 3, 8, 20, tzinfo=timezone.utc)
+    assert oldest_day(date, "UTC") == 20220301
+    assert oldest_day(date, "Pacific/Auckland") == 20220302
+
+
+def test_short_check_unique_once():
+    user_info = UserRecord()
+    oldest = oldest_day(datetime(2022, 4, 8, tzinfo=timezone.utc), "UTC")
+    assert user_info.add_check(pack_check_id("20220"), oldest)
+    assert not user_info.add_check(pack_check_id("20220"), oldest)
@@ -0,0 +1,53 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from quadsbot.event_log import EventLog, read_events
+
+
+def test_reads_late_recorded_events(tmp_path):
+    filename = str(tmp_path / "events")
+    now = datetime.now(timezone.utc)
+    log = EventLog("UTC")
+    log.open(filename)
+    log.record(now - timedelta(hours=1), 1, 10, state=0)
+    # e.g. caught up on after the bot was down for hours
+    log.record(now - timedelta(hours=20), 1, 11, state=0)
+    log.close()
+
+    since = (now - timedelta(hours=2)).timestamp()
+    assert [event.user_id for event in read_events(filename, since)] == [10, 11]
+
+
+def test_clear(tmp_path):
+    filename = str(tmp_path / "events")
+    log = EventLog("UTC")
+    log.open(filename)
+    log.record(datetime.now(timezone.utc), 1, 10, state=0, unique=True)
+    assert log.ranking(1, log.today()) == [(1, 10)]
+
+    log.clear()
+    assert log.ranking(1, log.today()) == []
+    assert list(read_events(filename)) == []
+
+    log.record(datetime.now(timezone.utc), 1, 11, state=0, unique=True)
+    log.close()
+    assert [event.user_id for event in read_events(filename, time.time() - 60)] == [11]
+
+
+def test_days_are_in_the_users_timezone(tmp_path):
+    filename = str(tmp_path / "events")
+    # 20:00 in UTC is already the next day in Kolkata
+    evening = datetime.now(timezone.utc).replace(hour=20, minute=0) - timedelta(days=2)
+    next_day = evening.date() + timedelta(days=1)
+    log = EventLog("UTC")
+    log.open(filename)
+    log.record(evening, 1, 10, state=0, unique=True)
+    log.record(evening, 1, 11, state=0, unique=True, tz="Asia/Kolkata")
+    log.close()
+    assert log.ranking(1, next_day) == [(1, 11)]
+
+    # Read back with each user's timezone
+    log = EventLog("UTC")
+    log.open(filename, {11: "Asia/Kolkata"})
+    log.close()
+    assert log.ranking(1, next_day) == [(1, 11)]
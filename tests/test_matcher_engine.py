@@ -0,0 +1,144 @@
+import random
+import re
+
+import pytest
+
+from quadsbot import digit_pattern, matcher_engine
+from quadsbot.digit_pattern import Atom, parse_digit_pattern
+from quadsbot.matchers import joke_matchers, matchers
+from quadsbot.matcher_engine import MatcherEngine, literal_keywords
+
+all_matchers = matchers + joke_matchers
+
+texts = [
+    "",
+    "quads",
+    "QUADS",
+    "is it quads yet",
+    "sexts",
+    "blaze it",
+    "blazeit",
+    "pie",
+    "ow",
+    "nope",
+]
+
+
+def reference_first_check(dates: list[str], message_text: str):
+    # Each matcher in order against each date in order, like the original loop
+    for date_re, message_re in all_matchers:
+        for date_idx, date_digits in enumerate(dates):
+            date_match = re.search(date_re, date_digits)
+            if date_match and re.search(message_re, message_text):
+                return message_re, date_digits[: date_match.end()] + str(date_idx)
+    return None
+
+
+def random_dates(rng: random.Random) -> list[str]:
+    # Lots of repeated digits so the rarer matchers get hit too
+    digits = rng.choice(["0123456789", "12", "1", "2", "0420", "1337"])
+    date = "".join(rng.choice(digits) for _ in range(14))
+    return [date, date[:8] + rng.choice(["01", "11", "12"]) + date[10:]]
+
+
+def engine_first_check(engine: MatcherEngine, dates: list[str], message_text: str):
+    return engine.first_check(dates, engine.date_hits(dates), message_text)
+
+
+@pytest.mark.parametrize(
+    "pattern, expected",
+    [
+        ("quads", ("quads",)),
+        (r"(blaze it|blazeit)", ("blaze it", "blazeit")),
+        (r"(pi|pie)", ("pi", "pie")),
+        (r"no\. 1", ("no. 1",)),
+        (r"11235?8?(13)?", None),
+        (r"^quads", None),
+        ("", None),
+        ("(", None),
+    ],
+)
+def test_literal_keywords(pattern, expected):
+    assert literal_keywords(pattern) == expected
+
+
+def test_engine_matches_regexes():
+    engine = MatcherEngine(all_matchers)
+    rng = random.Random(1)
+    for _ in range(20_000):
+        dates = random_dates(rng)
+        text = rng.choice(texts).lower()
+        assert engine_first_check(engine, dates, text) == reference_first_check(dates, text)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [("", set()), ("pi", {1, 2}), ("a pie", {0, 1, 2, 3}), ("tie", {3}), ("regex", set())],
+)
+def test_keyword_matches(text, expected):
+    # Overlapping keywords are all found by the one scan
+    engine = MatcherEngine([("", "pie"), ("", "(pi|pie)"), ("", "pi"), ("", "ie"), ("", "r.g")])
+    assert engine.keyword_matches(text) == expected
+
+
+class BrokenParser:
+    @staticmethod
+    def parse(pattern):
+        raise AttributeError("the parser changed")
+
+
+@pytest.mark.parametrize("parser", [None, BrokenParser])
+def test_engine_without_parser(monkeypatch, parser):
+    monkeypatch.setattr(matcher_engine, "sre_parse", parser)
+    assert literal_keywords("quads") is None
+
+    engine = MatcherEngine(all_matchers)
+    assert all(matcher.keywords is None for matcher in engine.matchers)
+    rng = random.Random(2)
+    for _ in range(5_000):
+        dates = random_dates(rng)
+        text = rng.choice(texts).lower()
+        assert engine_first_check(engine, dates, text) == reference_first_check(dates, text)
+
+
+def test_parse_digit_pattern():
+    pattern = parse_digit_pattern(r"^........(.)\1{3}")
+    assert pattern.anchored
+    assert pattern.fixed_width
+    assert pattern.atoms() == [Atom("any")] * 8 + [Atom("any", group=1)] + [
+        Atom("ref", group=1)
+    ] * 3
+
+    pattern = parse_digit_pattern(r"11235?8?(13)?")
+    assert not pattern.anchored
+    assert pattern.optionals == 3
+
+
+@pytest.mark.parametrize("pattern", [r"^\d{4}", r"(a|b)", r"1+", "("])
+def test_parse_digit_pattern_unsupported(pattern):
+    with pytest.raises(ValueError):
+        parse_digit_pattern(pattern)
+
+
+@pytest.mark.parametrize("parser", [None, BrokenParser])
+def test_parse_digit_pattern_without_parser(monkeypatch, parser):
+    monkeypatch.setattr(digit_pattern, "sre_parse", parser)
+    with pytest.raises(ValueError):
+        parse_digit_pattern(r"^........(.)\1{3}")
+
+
+@pytest.mark.parametrize("parser", [None, BrokenParser])
+def test_check_many_without_parser(monkeypatch, parser):
+    from quadsbot.batch import check_many
+
+    rng = random.Random(3)
+    timestamps = [rng.randrange(1_600_000_000, 1_700_000_000) for _ in range(2_000)]
+    # Make sure some of them hit
+    timestamps += [1_648_815_780 + second for second in range(0, 3600, 7)]
+    message_texts = [rng.choice(texts) for _ in timestamps]
+    expected = check_many(timestamps, "Europe/London", message_texts)
+
+    monkeypatch.setattr(digit_pattern, "sre_parse", parser)
+    states, check_ids = check_many(timestamps, "Europe/London", message_texts)
+    assert (states == expected[0]).all()
+    assert list(check_ids) == list(expected[1])
@@ -0,0 +1,18 @@
+from quadsbot.migrations import migrate
+from quadsbot.persistence import SQLitePersistence
+from quadsbot.user import UserRecord
+
+
+def test_aggregates_start_from_user_totals(tmp_path):
+    persistence = SQLitePersistence(str(tmp_path / "quadsbot.sqlite"))
+    bot_data = persistence.get_bot_data()
+    bot_data["chat_stats"][-100][1] = UserRecord(checked_total=3, deleted=2, passed=1)
+    bot_data["chat_stats"][-200][1] = UserRecord(checked_total=1)
+    bot_data["user_stats"][2] = {"checked_total": 1, "deleted": 4}
+    persistence.update_bot_data(bot_data)
+
+    assert migrate(bot_data, persistence)
+    aggregates = bot_data["aggregates"]
+    assert aggregates.state_totals() == {"CHECKED": 5, "DELETE": 6, "PASS": 1}
+    assert aggregates.since is None
+    assert not migrate(bot_data, persistence)
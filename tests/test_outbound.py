@@ -0,0 +1,121 @@
+import json
+import time
+from types import SimpleNamespace
+
+from telegram.error import BadRequest, NetworkError
+from telegram.utils.request import Request
+
+from quadsbot import outbound
+from quadsbot.outbound import OutboundScheduler
+from quadsbot.tracing import tracer
+
+
+class FakeBot:
+    base_url = "https://api.telegram.org/bot123:abc"
+
+    def __init__(self, bulk_error=None):
+        self.calls = []
+        self.request = SimpleNamespace(post=self.post)
+        self.bulk_error = bulk_error
+
+    def post(self, url, data):
+        self.calls.append((url, data))
+        if self.bulk_error:
+            raise self.bulk_error
+        return True
+
+    def delete_message(self, chat_id, message_id):
+        self.calls.append(("deleteMessage", chat_id, message_id))
+        return True
+
+
+def schedule_deletes(scheduler: OutboundScheduler, bot: FakeBot, deletes: list) -> None:
+    # All due by the time the worker gets to them
+    with scheduler._condition:
+        for chat_id, message_id in deletes:
+            scheduler.delete(bot, chat_id, message_id)
+        time.sleep(0.01)
+    scheduler.stop()
+
+
+def test_deletes_are_batched():
+    bot = FakeBot()
+    scheduler = OutboundScheduler()
+    schedule_deletes(scheduler, bot, [(-100, 0), (-100, 1), (-100, 2), (-200, 7)])
+
+    assert sorted(bot.calls, key=str) == sorted(
+        [
+            (f"{bot.base_url}/deleteMessages", {"chat_id": -100, "message_ids": [0, 1, 2]}),
+            ("deleteMessage", -200, 7),
+        ],
+        key=str,
+    )
+
+
+def test_deletes_one_at_a_time_without_bulk():
+    bot = FakeBot(bulk_error=BadRequest("Method not found"))
+    scheduler = OutboundScheduler()
+    schedule_deletes(scheduler, bot, [(-100, 0), (-100, 1), (-100, 2)])
+
+    assert bot.calls[1:] == [("deleteMessage", -100, message_id) for message_id in range(3)]
+
+
+class RecordingRequest(Request):
+    """
+    python-telegram-bot's own request encoding, without the network
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.bodies = []
+
+    def _request_wrapper(self, method, url, body=None, **kwargs):
+        self.bodies.append((url, json.loads(body)))
+        return b'{"ok": true, "result": true}'
+
+
+def test_bulk_delete_payload():
+    bot = FakeBot()
+    bot.request = RecordingRequest()
+    scheduler = OutboundScheduler()
+    schedule_deletes(scheduler, bot, [(-100, 0), (-100, 1), (-100, 2)])
+
+    # What python-telegram-bot actually sends
+    assert bot.request.bodies == [
+        (f"{bot.base_url}/deleteMessages", {"chat_id": "-100", "message_ids": "[0, 1, 2]"})
+    ]
+
+
+def test_deletes_one_at_a_time_after_network_errors(monkeypatch):
+    monkeypatch.setattr(outbound, "max_attempts", 1)
+    bot = FakeBot(bulk_error=NetworkError("Connection aborted"))
+    scheduler = OutboundScheduler()
+    schedule_deletes(scheduler, bot, [(-100, 0), (-100, 1), (-100, 2)])
+
+    assert bot.calls[1:] == [("deleteMessage", -100, message_id) for message_id in range(3)]
+
+
+def test_calls_are_in_the_trace_they_were_scheduled_from(tmp_path):
+    trace_file = tmp_path / "trace.jsonl"
+    tracer.open(str(trace_file))
+    try:
+        bot = FakeBot()
+        scheduler = OutboundScheduler()
+        with scheduler._condition:
+            for message_id in range(2):
+                with tracer.span("message"):
+                    scheduler.delete(bot, -100, message_id)
+            with tracer.span("message"):
+                scheduler.delete(bot, -200, 7)
+            time.sleep(0.01)
+        scheduler.stop()
+    finally:
+        tracer.close()
+
+    spans = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    messages = [(span["trace"], span["span"]) for span in spans if span["name"] == "message"]
+    calls = {span["name"]: span for span in spans if span["name"] != "message"}
+    # One delete is part of its message's trace, a bulk one links to them all
+    assert (calls["deleteMessage"]["trace"], calls["deleteMessage"]["parent"]) == messages[2]
+    assert calls["deleteMessages"]["parent"] is None
+    assert [tuple(link) for link in calls["deleteMessages"]["links"]] == messages[:2]
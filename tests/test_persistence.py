@@ -0,0 +1,273 @@
+import pickle
+import sqlite3
+import threading
+
+import pytest
+
+from quadsbot.check_ids import pack_check_id
+from quadsbot.persistence import SQLitePersistence
+from quadsbot.user import UserRecord
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / "quadsbot.sqlite")
+
+
+def record(username: str, checked_unique: int) -> UserRecord:
+    user_info = UserRecord(username=username, checked_unique=checked_unique)
+    user_info.add_check(pack_check_id("2022030122220"), 20220301)
+    return user_info
+
+
+def test_round_trip(database):
+    persistence = SQLitePersistence(database)
+    bot_data = persistence.get_bot_data()
+    bot_data["chat_stats"][-100][1] = record("alice", 3)
+    bot_data["chat_stats"][-100][2] = record("bob", 5)
+    bot_data["chat_stats"][-200][1] = record("alice", 1)
+    bot_data["chat_stats"][-200][1]["some_new_value"] = "Hi!"
+    bot_data["admins"] = {-100: [1]}
+    bot_data["timezones"][2] = "Asia/Kolkata"
+    persistence.update_bot_data(bot_data)
+
+    reopened = SQLitePersistence(database)
+    bot_data = reopened.get_bot_data()
+    # Users are only loaded when they're used
+    assert dict(bot_data["chat_stats"][-100]) == {}
+    assert bot_data["chat_stats"][-100][2].to_dict() == record("bob", 5).to_dict()
+    assert bot_data["chat_stats"][-200][1]["some_new_value"] == "Hi!"
+    assert bot_data["chat_stats"][-300].get(1) is None
+    assert bot_data["admins"] == {-100: [1]}
+    assert bot_data["timezones"] == {2: "Asia/Kolkata"}
+
+    assert reopened.read_summary(-100) == {1: (3, "alice"), 2: (5, "bob")}
+    assert reopened.count_users() == (3, 2)
+    assert [(chat_id, user_id) for chat_id, user_id, _ in reopened.iter_records(2)] == [
+        (-200, 1),
+        (-100, 1),
+        (-100, 2),
+    ]
+
+
+def test_count_users(database):
+    persistence = SQLitePersistence(database)
+    bot_data = persistence.get_bot_data()
+    bot_data["chat_stats"][-100][1] = record("alice", 3)
+    bot_data["chat_stats"][-100][2] = record("bob", 5)
+    bot_data["chat_stats"][-200][1] = record("alice", 1)
+    bot_data["user_stats"][3] = record("carol", 2)
+    persistence.update_bot_data(bot_data)
+    assert persistence.count_users() == (4, 2)
+
+    # Rewriting a user doesn't count them again
+    bot_data["chat_stats"][-100][1] = record("alice", 4)
+    del bot_data["chat_stats"][-200][1]
+    del bot_data["user_stats"][3]
+    persistence.update_bot_data(bot_data)
+    assert persistence.count_users() == (2, 1)
+    assert SQLitePersistence(database).count_users() == (2, 1)
+
+    bot_data["chat_stats"].clear()
+    persistence.update_bot_data(bot_data)
+    assert persistence.count_users() == (0, 0)
+
+
+def test_only_changes_are_written(database):
+    persistence = SQLitePersistence(database)
+    bot_data = persistence.get_bot_data()
+    bot_data["chat_stats"][-100][1] = record("alice", 3)
+    bot_data["chat_stats"][-100][2] = record("bob", 5)
+    persistence.update_bot_data(bot_data)
+
+    # Changed inside the record without assigning it back, so not written
+    bot_data["chat_stats"][-100][1]["checked_unique"] = 4
+    del bot_data["chat_stats"][-100][2]
+    bot_data["admins"] = {}
+    bot_data["timezones"][1] = "Asia/Kolkata"
+    persistence.update_bot_data(bot_data)
+    del bot_data["timezones"][1]
+    bot_data["timezones"][2] = "Asia/Kathmandu"
+    persistence.update_bot_data(bot_data)
+
+    bot_data = SQLitePersistence(database).get_bot_data()
+    assert bot_data["chat_stats"][-100][1]["checked_unique"] == 3
+    assert bot_data["chat_stats"][-100].get(2) is None
+    assert bot_data["admins"] == {}
+    assert bot_data["timezones"] == {2: "Asia/Kathmandu"}
+
+
+def test_read_only(database):
+    persistence = SQLitePersistence(database)
+    bot_data = persistence.get_bot_data()
+    bot_data["chat_stats"][-100][1] = record("alice", 3)
+    bot_data["timezones"][1] = "Asia/Kolkata"
+    persistence.update_bot_data(bot_data)
+    persistence.flush()
+
+    read_only = SQLitePersistence(database, read_only=True)
+    bot_data = read_only.get_bot_data()
+    assert bot_data["chat_stats"][-100][1]["username"] == "alice"
+    assert bot_data["timezones"] == {1: "Asia/Kolkata"}
+
+    bot_data["chat_stats"][-100][2] = record("bob", 1)
+    with pytest.raises(sqlite3.OperationalError):
+        read_only.update_bot_data(bot_data)
+
+
+def test_defer_write(database):
+    persistence = SQLitePersistence(database)
+    bot_data = persistence.get_bot_data()
+    bot_data["chat_stats"][-100][1] = record("alice", 3)
+    persistence.defer_write()
+    persistence.update_bot_data(bot_data)
+    assert SQLitePersistence(database).read_user(-100, 1) is None
+
+    # Only the next write on the thread that deferred it is skipped
+    bot_data["chat_stats"][-100][2] = record("bob", 1)
+    persistence.defer_write()
+    thread = threading.Thread(target=persistence.update_bot_data, args=(bot_data,))
+    thread.start()
+    thread.join()
+    assert SQLitePersistence(database).read_user(-100, 1)["checked_unique"] == 3
+    assert not persistence.deferred
+
+    persistence.update_bot_data(bot_data)
+    bot_data["chat_stats"][-100][3] = record("carol", 2)
+    persistence.update_bot_data(bot_data)
+    assert SQLitePersistence(database).read_user(-100, 3)["checked_unique"] == 2
+
+
+def test_clear(database):
+    persistence = SQLitePersistence(database)
+    bot_data = persistence.get_bot_data()
+    bot_data["chat_stats"][-100][1] = record("alice", 3)
+    bot_data["chat_stats"][-200][1] = record("alice", 1)
+    persistence.update_bot_data(bot_data)
+
+    # Clears the chats that haven't been loaded too
+    persistence = SQLitePersistence(database)
+    bot_data = persistence.get_bot_data()
+    bot_data["chat_stats"].clear()
+    persistence.update_bot_data(bot_data)
+    assert SQLitePersistence(database).count_users() == (0, 0)
+
+
+def test_evicts_cold_users(database):
+    persistence = SQLitePersistence(database, hot_users=2)
+    bot_data = persistence.get_bot_data()
+    for user_id in range(5):
+        bot_data["chat_stats"][-100][user_id] = record(f"user {user_id}", user_id)
+    persistence.update_bot_data(bot_data)
+
+    shard = bot_data["chat_stats"][-100]
+    assert sorted(dict(shard)) == [3, 4]
+    # The rest are loaded again when they're used
+    assert shard[0]["username"] == "user 0"
+    assert sorted(dict(shard)) == [0, 3, 4]
+
+
+def test_evicting_while_writing(database):
+    persistence = SQLitePersistence(database, hot_users=0)
+    bot_data = persistence.get_bot_data()
+    shard = bot_data["chat_stats"][-100]
+    shard[1] = record("alice", 1)
+    persistence.update_bot_data(bot_data)
+
+    evicting = threading.Event()
+    written = threading.Event()
+    resume = threading.Event()
+
+    coldest = persistence.hot.coldest
+
+    def slow_coldest():
+        evicting.set()
+        # Gives the other write a chance to start
+        written.wait(0.5)
+        return coldest()
+
+    write_users = persistence.write_users
+
+    def slow_write_users(user_stats, chat_id=None):
+        added = write_users(user_stats, chat_id)
+        if chat_id == -100:
+            written.set()
+            resume.wait(5)
+        return added
+
+    # A write that's evicting users
+    shard[2] = record("bob", 1)
+    persistence.hot.coldest = slow_coldest
+    first = threading.Thread(target=persistence.update_bot_data, args=(bot_data,))
+    first.start()
+    assert evicting.wait(5)
+    persistence.hot.coldest = coldest
+
+    # Meanwhile a handler changes alice, and another write starts
+    shard[1] = record("alice", 2)
+    persistence.write_users = slow_write_users
+    second = threading.Thread(target=persistence.update_bot_data, args=(bot_data,))
+    second.start()
+    first.join(5)
+
+    # Alice has to be in memory until her change has been committed
+    assert shard[1]["checked_unique"] == 2
+    resume.set()
+    second.join(5)
+    persistence.write_users = write_users
+    assert shard[1]["checked_unique"] == 2
+    assert persistence.read_user(-100, 1)["checked_unique"] == 2
+
+
+def test_rankings(database):
+    persistence = SQLitePersistence(database)
+    bot_data = persistence.get_bot_data()
+    bot_data["chat_stats"][-100][1] = record("alice", 3)
+    bot_data["chat_stats"][-100][2] = record("bob", 5)
+    persistence.update_bot_data(bot_data)
+    version = persistence.data_version()
+
+    with persistence._rank_lock:
+        # Publishing the rankings doesn't hold up loading users
+        loaded = []
+        thread = threading.Thread(target=lambda: loaded.append(persistence.read_user(-100, 1)))
+        thread.start()
+        thread.join(5)
+        assert loaded[0]["username"] == "alice"
+
+    assert persistence.read_rankings(1) == {-100: (2, 8, [(5, 2, "bob")])}
+    bot_data["chat_stats"][-100][1] = record("alice", 4)
+    persistence.update_bot_data(bot_data)
+    assert persistence.data_version() != version
+
+
+@pytest.mark.parametrize("nested", [True, False])
+def test_import_pickle(tmp_path, database, nested):
+    user_stats = {
+        1: {"username": "alice", "checked_unique": 2, "check_id_cache": ["2022030122220"]},
+        2: {"username": "bob", "tz": "Asia/Kolkata", "some_new_value": "Hi!"},
+    }
+    # The oldest versions stored the user stats as the whole of bot_data
+    bot_data = {"user_stats": user_stats, "admins": {-100: [1]}} if nested else user_stats
+    pickle_file = tmp_path / "quadsbot.pickle"
+    with open(pickle_file, "wb") as f:
+        pickle.dump({"bot_data": bot_data, "user_data": {}, "chat_data": {}}, f)
+
+    persistence = SQLitePersistence(database, import_from=str(pickle_file))
+    bot_data = persistence.get_bot_data()
+    assert bot_data.get("admins") == ({-100: [1]} if nested else None)
+    assert persistence.count_users() == (2, 0)
+
+    records = {user_id: user_info for _, user_id, user_info in persistence.iter_records()}
+    assert records[1]["checks"] == ["2022030122220"]
+    assert records[1]["checked_unique"] == 2
+    assert "tz" not in records[2]
+    assert records[2]["some_new_value"] == "Hi!"
+    assert bot_data["timezones"] == {2: "Asia/Kolkata"}
+
+    # The unclaimed users can still be claimed
+    assert bot_data["user_stats"].pop(1)["username"] == "alice"
+
+    # Only imported into an empty database
+    SQLitePersistence(database, import_from=str(pickle_file)).get_bot_data()
+    assert persistence.count_users() == (2, 0)
@@ -0,0 +1,53 @@
+import json
+from datetime import datetime, timezone
+
+from quadsbot.persistence import SQLitePersistence
+from quadsbot.rebuild import rebuild, write_snapshot
+
+
+def message(user_id: int, date: datetime, text: str, tz: str = "Europe/London") -> dict:
+    return {
+        "chat_id": -100,
+        "user_id": user_id,
+        "username": f"user{user_id}",
+        "date": int(date.timestamp()),
+        "forward_date": None,
+        "tz": tz,
+        "text": text,
+    }
+
+
+def test_rebuild(tmp_path):
+    history = tmp_path / "history.jsonl"
+    first = datetime(2022, 3, 1, 22, 22, tzinfo=timezone.utc)
+    messages = [
+        message(1, first, "Quads"),
+        message(1, datetime(2022, 3, 1, 22, 23, tzinfo=timezone.utc), "Hi"),
+        message(2, datetime(2022, 3, 2, 12, tzinfo=timezone.utc), "Hello", "Asia/Kolkata"),
+    ]
+    history.write_text("".join(json.dumps(m) + "\n" for m in messages))
+
+    current = tmp_path / "current.sqlite3"
+    persistence = SQLitePersistence(str(current))
+    bot_data = persistence.get_bot_data()
+    bot_data["admins"] = {-100: [1]}
+    bot_data["timezones"][1] = "Asia/Tokyo"
+    persistence.update_bot_data(bot_data)
+    persistence.flush()
+
+    users, timezones, aggregates = rebuild(str(history), processes=1)
+    assert users[(-100, 1)].checked_unique == 1
+    assert timezones == {1: "Europe/London", 2: "Asia/Kolkata"}
+    assert aggregates.since == first.timestamp()
+    assert aggregates.state_totals() == {"CHECKED": 1, "DELETE": 2}
+
+    output = str(tmp_path / "rebuilt.sqlite3")
+    write_snapshot(
+        users, timezones, aggregates, output, SQLitePersistence(str(current), read_only=True)
+    )
+    bot_data = SQLitePersistence(output).get_bot_data()
+    assert bot_data["admins"] == {-100: [1]}
+    # What's set now wins over the history
+    assert bot_data["timezones"] == {1: "Asia/Tokyo", 2: "Asia/Kolkata"}
+    assert bot_data["aggregates"].state_totals() == {"CHECKED": 1, "DELETE": 2}
+    assert bot_data["chat_stats"][-100][1].checked_unique == 1
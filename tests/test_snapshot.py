@@ -0,0 +1,155 @@
+import threading
+
+import pytest
+
+from quadsbot import snapshot
+from quadsbot.snapshot import ChatSummary, SnapshotReader, SnapshotWriter, encode, header
+
+
+@pytest.fixture
+def snapshot_file(tmp_path):
+    return str(tmp_path / "leaderboard.snapshot")
+
+
+chats = {
+    -100: (3, 9, [(5, 2, "bob"), (3, 1, "alice")]),
+    -200: (1, 1, [(1, 1, "alice")]),
+    7: (1, 0, [(0, 7, None)]),
+}
+
+
+def test_encode_decode(snapshot_file):
+    writer = SnapshotWriter(snapshot_file, 4096)
+    writer.publish(chats)
+    reader = SnapshotReader(snapshot_file)
+
+    # Sorted by chat_id
+    assert reader.chats() == [
+        ChatSummary(-200, 1, 1),
+        ChatSummary(-100, 3, 9),
+        ChatSummary(7, 1, 0),
+    ]
+    assert reader.leaderboard(-100) == [(5, "bob"), (3, "alice")]
+    assert reader.leaderboard(7) == [(0, "")]
+    assert reader.leaderboard(-150) is None
+    assert reader.leaderboard(100) is None
+    assert reader.published() > 0
+
+
+def test_long_usernames_are_cut(snapshot_file):
+    writer = SnapshotWriter(snapshot_file, 4096)
+    writer.publish({1: (1, 1, [(1, 1, "a" * 40)])})
+    assert SnapshotReader(snapshot_file).leaderboard(1) == [(1, "a" * 32)]
+
+
+def test_smallest_chats_left_out():
+    size = snapshot.counts.size + 2 * snapshot.chat.size + 3 * snapshot.entry.size
+    payload = encode(chats, size)
+    (chat_count,) = snapshot.counts.unpack_from(payload, 0)
+    assert chat_count == 2
+    chat_ids = [
+        snapshot.chat.unpack_from(payload, snapshot.counts.size + snapshot.chat.size * index)[0]
+        for index in range(chat_count)
+    ]
+    assert chat_ids == [-200, -100]
+
+
+def test_reopen_keeps_sequence(snapshot_file):
+    writer = SnapshotWriter(snapshot_file, 4096)
+    writer.publish(chats)
+    sequence = writer.sequence
+    writer.close()
+
+    writer = SnapshotWriter(snapshot_file, 4096)
+    assert writer.sequence == sequence
+    assert SnapshotReader(snapshot_file).leaderboard(-100) == [(5, "bob"), (3, "alice")]
+
+
+def test_read_retries_when_written_during_read(snapshot_file):
+    writer = SnapshotWriter(snapshot_file, 4096)
+    writer.publish(chats)
+    reader = SnapshotReader(snapshot_file)
+
+    calls = []
+
+    def read_chat_count(data, offset):
+        calls.append(None)
+        if len(calls) == 1:
+            # As if the writer published halfway through the read
+            writer.publish({1: (1, 1, [(1, 1, "alice")])})
+        return snapshot.counts.unpack_from(data, offset)[0]
+
+    assert reader.read(read_chat_count) == 1
+    assert len(calls) == 2
+
+
+def test_resized_while_reading(snapshot_file):
+    writer = SnapshotWriter(snapshot_file, 4096)
+    writer.publish(chats)
+    reader = SnapshotReader(snapshot_file)
+
+    mapped = []
+
+    def read_chat_count(data, offset):
+        mapped.append(data)
+        if len(mapped) == 1:
+            # Restarted with a bigger SNAPSHOT_SIZE, and read from another
+            # thread, while this read is still using the old mapping
+            writer.close()
+            SnapshotWriter(snapshot_file, 8192).publish(chats)
+            thread = threading.Thread(target=reader.chats)
+            thread.start()
+            thread.join()
+        return snapshot.counts.unpack_from(data, offset)[0]
+
+    assert reader.read(read_chat_count) == 3
+    # Closed once this read was done with it
+    assert mapped[0].closed
+    assert len(reader.chats()) == 3
+
+
+def test_read_waits_for_writer(snapshot_file, monkeypatch):
+    writer = SnapshotWriter(snapshot_file, 4096)
+    reader = SnapshotReader(snapshot_file)
+
+    # Left halfway through a write
+    header.pack_into(writer._mmap, 0, snapshot.magic, snapshot.format_version, 1, 0, 0)
+    monkeypatch.setattr(snapshot, "read_attempts", 3)
+    with pytest.raises(TimeoutError):
+        reader.chats()
+
+
+def test_rejects_other_versions(snapshot_file):
+    writer = SnapshotWriter(snapshot_file, 4096)
+    header.pack_into(writer._mmap, 0, snapshot.magic, snapshot.format_version + 1, 0, 0, 0)
+    with pytest.raises(ValueError):
+        SnapshotReader(snapshot_file).chats()
+
+
+def test_reads_are_consistent(snapshot_file):
+    writer = SnapshotWriter(snapshot_file, 1 << 16)
+    reader = SnapshotReader(snapshot_file)
+    stop = threading.Event()
+
+    def publish():
+        # Every chat's users is its checks, and its scores are all the same
+        version = 0
+        while not stop.is_set():
+            version += 1
+            writer.publish(
+                {chat_id: (version, version, [(version, 1, "a")] * 5) for chat_id in range(50)}
+            )
+
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    try:
+        for _ in range(2000):
+            summaries = reader.chats()
+            assert len({summary.users for summary in summaries}) <= 1
+            assert all(summary.users == summary.checks for summary in summaries)
+            top = reader.leaderboard(49)
+            if top is not None:
+                assert len({score for score, _ in top}) == 1
+    finally:
+        stop.set()
+        publisher.join()
@@ -0,0 +1,36 @@
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from quadsbot.startup import lazy_callback, trace_persistence
+from quadsbot.tracing import tracer
+
+
+class FakeDispatcher:
+    def update_persistence(self, update=None):
+        with tracer.span("persistence"):
+            pass
+
+
+def test_persistence_is_in_the_update_trace(tmp_path, monkeypatch):
+    trace_file = tmp_path / "trace.jsonl"
+    tracer.open(str(trace_file))
+    try:
+        dispatcher = FakeDispatcher()
+        trace_persistence(dispatcher)
+        callback = lazy_callback("quadsbot.handlers.clear", "clear_handler")
+        monkeypatch.setattr("quadsbot.handlers.clear.clear_handler", lambda *args: None)
+        message = SimpleNamespace(date=datetime.now(timezone.utc))
+        update = SimpleNamespace(update_id=1, effective_message=message)
+        # As the dispatcher does
+        callback(update, None)
+        dispatcher.update_persistence(update=update)
+    finally:
+        tracer.close()
+
+    spans = {
+        span["name"]: span for span in map(json.loads, trace_file.read_text().splitlines())
+    }
+    handler = spans["clear_handler"]
+    assert spans["update_persistence"]["parent"] == handler["span"]
+    assert spans["persistence"]["trace"] == handler["trace"]
@@ -0,0 +1,24 @@
+from types import SimpleNamespace
+
+from quadsbot import timezones
+from quadsbot.timezones import LiveLocations
+
+
+def test_live_locations_debounced(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(timezones, "time", SimpleNamespace(monotonic=lambda: now))
+    live_locations = LiveLocations()
+
+    assert live_locations.due(1, 51.5072, -0.1276, first=True)
+    # Too soon and too close
+    assert not live_locations.due(1, 51.5080, -0.1270)
+    # Other users are separate
+    assert live_locations.due(2, 51.5080, -0.1270)
+    # Moved far enough
+    assert live_locations.due(1, 51.52, -0.1276)
+    assert not live_locations.due(1, 51.52, -0.1276)
+    # A new live location is always looked up
+    assert live_locations.due(1, 51.52, -0.1276, first=True)
+
+    now += timezones.min_interval
+    assert live_locations.due(1, 51.52, -0.1276)
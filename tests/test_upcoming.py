@@ -0,0 +1,87 @@
+import itertools
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from quadsbot.date_utils import get_date_strings
+from quadsbot.matchers import joke_matchers, matchers
+from quadsbot.upcoming import upcoming
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def covered_seconds(after: datetime, until: datetime, tz: str, matcher_list) -> dict:
+    """
+    message_re -> the seconds in [after, until) covered by `upcoming`'s windows
+    """
+    covered = defaultdict(set)
+    moments = upcoming(after, tz, matcher_list)
+    previous = None
+    for moment in itertools.takewhile(lambda moment: moment.start < until, moments):
+        if previous:
+            assert previous.start <= moment.start
+        assert moment.end > after
+        previous = moment
+
+        start = max(int(moment.start.timestamp()), int(after.timestamp()))
+        end = min(int(moment.end.timestamp()), int(until.timestamp()))
+        covered[moment.message_re].update(range(start, end))
+    return covered
+
+
+def matching_seconds(after: datetime, until: datetime, tz: str, matcher_list) -> dict:
+    """
+    message_re -> the seconds in [after, until) where the date side matches
+    """
+    compiled = [(re.compile(date_re), message_re) for date_re, message_re in matcher_list]
+    matching = defaultdict(set)
+    for timestamp in range(int(after.timestamp()), int(until.timestamp())):
+        dates = get_date_strings(datetime.fromtimestamp(timestamp, timezone.utc), tz)
+        for date_re, message_re in compiled:
+            if any(date_re.search(date) for date in dates):
+                matching[message_re].add(timestamp)
+    return matching
+
+
+@pytest.mark.parametrize(
+    "tz, after",
+    [
+        # 01:00-02:00 happens twice
+        ("Europe/London", utc(2022, 10, 30, 0, 0)),
+        # 01:00-02:00 doesn't happen
+        ("Europe/London", utc(2022, 3, 27, 0, 0)),
+        ("Australia/Adelaide", utc(2022, 4, 2, 14, 0)),
+        ("Asia/Kolkata", utc(2022, 11, 11, 0, 0, 7)),
+    ],
+)
+def test_upcoming_matches_regexes(tz, after):
+    until = after + timedelta(hours=14)
+    assert covered_seconds(after, until, tz, matchers) == matching_seconds(
+        after, until, tz, matchers
+    )
+
+
+def test_upcoming_joke_matchers():
+    # Only the anchored, fixed width ones can be found, and 13:37 never
+    # happens as 12 hour
+    after = utc(2022, 4, 1, 0, 0)
+    until = after + timedelta(hours=14)
+    anchored = [matcher for matcher in joke_matchers if matcher[0].startswith("^")]
+    assert covered_seconds(after, until, "UTC", joke_matchers) == matching_seconds(
+        after, until, "UTC", anchored
+    )
+
+
+def test_upcoming_starts_inside_window():
+    # Halfway through 22:22
+    after = utc(2022, 3, 1, 22, 22, 30)
+    moment = next(upcoming(after, "UTC", matchers))
+    assert (moment.start, moment.end, moment.message_re) == (
+        after,
+        utc(2022, 3, 1, 22, 23),
+        "quads",
+    )
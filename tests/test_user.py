@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import pytest
+
+from quadsbot.persistence import SQLitePersistence
+from quadsbot.user import User, default_tz, user_tz
+
+
+@pytest.fixture
+def context(tmp_path):
+    persistence = SQLitePersistence(str(tmp_path / "quadsbot.sqlite"))
+    return SimpleNamespace(bot_data=persistence.get_bot_data(), persistence=persistence)
+
+
+def message_update(chat_id: int, chat_type: str, user_id: int, username: str):
+    user = SimpleNamespace(id=user_id, username=username, first_name=username, last_name=None)
+    message = SimpleNamespace(forward_from=None, from_user=user)
+    chat = SimpleNamespace(id=chat_id, type=chat_type)
+    return SimpleNamespace(effective_chat=chat, effective_message=message)
+
+
+def test_timezone_is_per_user(context):
+    assert user_tz(context, 1) == default_tz
+
+    context.bot_data["timezones"][1] = "Asia/Kolkata"
+    for chat_id, chat_type in ((1, "private"), (-100, "group"), (-200, "group")):
+        with User(message_update(chat_id, chat_type, 1, "alice"), context) as user_info:
+            user_info["messages_total"] += 1
+        assert user_tz(context, 1) == "Asia/Kolkata"
+
+
+def test_claiming_old_stats(context):
+    context.bot_data["user_stats"][1] = {
+        "username": "alice",
+        "checked_unique": 3,
+        "tz": "Asia/Kolkata",
+    }
+
+    # Not claimed by a private chat
+    with User(message_update(1, "private", 1, "alice"), context) as user_info:
+        assert user_info["checked_unique"] == 0
+
+    with User(message_update(-100, "group", 1, "alice"), context) as user_info:
+        assert user_info["checked_unique"] == 3
+        # The timezone has already been moved to bot_data["timezones"]
+        assert "tz" not in user_info.to_dict()
+    assert 1 not in context.bot_data["user_stats"]
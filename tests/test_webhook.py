@@ -0,0 +1,87 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+from telegram import Bot
+from telegram.ext import Filters, MessageHandler, Updater
+
+from quadsbot.webhook import secret_header, start_webhook
+
+
+class FakeRequest:
+    def __init__(self):
+        self.posts = []
+        self.con_pool_size = 8
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit("/", 1)[-1]
+        if method == "getMe":
+            return {"id": 42, "is_bot": True, "first_name": "quadsbot", "username": "quadsbot"}
+        self.posts.append((method, data))
+        return True
+
+    def stop(self):
+        pass
+
+
+update = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 1646173320,
+        "chat": {"id": -100, "type": "group"},
+        "from": {"id": 1, "is_bot": False, "first_name": "alice"},
+        "text": "quads",
+    },
+}
+
+
+@pytest.fixture
+def updater():
+    request = FakeRequest()
+    updater = Updater(bot=Bot("123:abc", request=request), use_context=True)
+    yield updater
+    updater.stop()
+
+
+def post(server, secret: str) -> int:
+    host, port = server.server_address
+    request = urllib.request.Request(
+        f"http://{host}:{port}/telegram",
+        data=json.dumps(update).encode(),
+        headers={secret_header: secret, "Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_updates_are_dispatched(updater):
+    handled = threading.Event()
+    updater.dispatcher.add_handler(MessageHandler(Filters.text, lambda u, c: handled.set()))
+
+    server = start_webhook(updater, "127.0.0.1", 0, "secret")
+    try:
+        assert post(server, "wrong") == 403
+        assert post(server, "secret") == 200
+        assert handled.wait(5)
+    finally:
+        updater.stop()
+        server.stop()
+    # Without a URL Telegram isn't told about it
+    assert updater.bot.request.posts == []
+
+
+def test_sets_webhook_with_secret(updater):
+    server = start_webhook(updater, "127.0.0.1", 0, "secret", url="https://example.com/telegram")
+    updater.stop()
+    server.stop()
+
+    method, data = updater.bot.request.posts[0]
+    assert method == "setWebhook"
+    assert data["url"] == "https://example.com/telegram"
+    assert data["secret_token"] == "secret"